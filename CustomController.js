@@ -20,21 +20,24 @@ var surface = deviceDriver.mSurface
 //-----------------------------------------------------------------------------
 // HELPER FUNCTIONS
 //-----------------------------------------------------------------------------
+// Every binding also has the output port: Cubase echoes Quick Control values
+// back to the Python controller, which keeps its sliders (and its CC dedupe
+// cache) in sync when a value is changed in Cubase.
 function makeFader(x, y, w, h, cc) {
     var fader = surface.makeFader(x, y, w, h)
-    fader.mSurfaceValue.mMidiBinding.setInputPort(midiInput).bindToControlChange(0, cc)
+    fader.mSurfaceValue.mMidiBinding.setInputPort(midiInput).setOutputPort(midiOutput).bindToControlChange(0, cc)
     return fader
 }
 
 function makeButton(x, y, cc) {
     var btn = surface.makeButton(x, y, 2, 2)
-    btn.mSurfaceValue.mMidiBinding.setInputPort(midiInput).bindToControlChange(0, cc)
+    btn.mSurfaceValue.mMidiBinding.setInputPort(midiInput).setOutputPort(midiOutput).bindToControlChange(0, cc)
     return btn
 }
 
 function makeKnob(x, y, cc) {
     var knob = surface.makeKnob(x, y, 2, 2)
-    knob.mSurfaceValue.mMidiBinding.setInputPort(midiInput).bindToControlChange(0, cc)
+    knob.mSurfaceValue.mMidiBinding.setInputPort(midiInput).setOutputPort(midiOutput).bindToControlChange(0, cc)
     return knob
 }
 
@@ -0,0 +1,243 @@
+"""
+Application Log
+Asynchronous, structured logging for the hot threads (audio callback,
+detection, MIDI sender/port threads, engine callbacks).
+
+A log call on a hot thread never formats and never touches the console or
+a file: it appends one tuple (time, level, category, thread, message, args)
+to a bounded ring buffer. When the ring is full the oldest record is
+dropped and counted (log_records_dropped_total). One background writer
+thread ("log-writer") formats records and writes them to the console
+and/or a size-rotated log file. A call below the configured level for its
+category returns after one dict lookup and compare, before anything is
+built.
+
+The console shows the message only (as the old print() calls did); the
+file has a timestamp, level, category and thread on every line.
+
+Categories: midi, audio, detector, engine, feedback (any name works).
+
+Usage:
+    from app_log import LOG
+    LOG.info("detector", "[DETECTED] %s %s", key, scale)
+    LOG.debug("midi", "MIDI Send: CC %d -> Value %d", cc, value)
+    LOG.close()                      # on exit: write what is queued
+
+Environment:
+    CUBASE_LOG_LEVEL=INFO            default level: DEBUG, INFO, WARN, ERROR, OFF
+    CUBASE_LOG_CATEGORIES=midi:DEBUG,audio:WARN   per-category levels
+    CUBASE_LOG_FILE=logs/controller.log           also write a rotating file (5 MB x 3)
+    CUBASE_LOG_CONSOLE=0             no console output (file only)
+"""
+
+import atexit
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+from metrics import LOG_DROPPED
+
+DEBUG, INFO, WARN, ERROR, OFF = 10, 20, 30, 40, 100
+LEVELS = {"DEBUG": DEBUG, "INFO": INFO, "WARN": WARN, "WARNING": WARN, "ERROR": ERROR, "OFF": OFF}
+LEVEL_NAMES = {DEBUG: "DEBUG", INFO: "INFO", WARN: "WARN", ERROR: "ERROR"}
+
+RING_SIZE = 4096
+IDLE_WAIT_S = 1.0            # writer safety wake-up when nothing signalled it
+FILE_MAX_BYTES = 5 * 1024 * 1024
+FILE_BACKUPS = 3
+
+# Fix Windows console encoding
+try:
+    sys.stdout.reconfigure(encoding='utf-8')
+except Exception:
+    pass
+
+
+def _parse_level(text, default=INFO):
+    level = LEVELS.get(str(text).strip().upper())
+    if level is None:
+        print(f"[WARN] Unknown log level '{text}' (use DEBUG, INFO, WARN, ERROR or OFF)")
+        return default
+    return level
+
+
+class RotatingFile:
+    """Append-only text file rotated to .1 .. .N when it grows past max_bytes (writer thread only)"""
+
+    def __init__(self, path, max_bytes=FILE_MAX_BYTES, backups=FILE_BACKUPS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self._file = open(path, "a", encoding='utf-8')
+        self._size = self._file.tell()
+
+    def write(self, text):
+        if self._size + len(text) > self.max_bytes and self._size > 0:
+            self._rotate()
+        self._file.write(text)
+        self._size += len(text)
+
+    def flush(self):
+        self._file.flush()
+
+    def _rotate(self):
+        self._file.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        os.replace(self.path, f"{self.path}.1")
+        self._file = open(self.path, "w", encoding='utf-8')
+        self._size = 0
+
+    def close(self):
+        self._file.close()
+
+
+class AppLog:
+    def __init__(self, level=INFO, categories=None, console=True, path=None, ring_size=RING_SIZE):
+        self.level = level
+        self.categories = dict(categories or {})   # category -> level
+        self.console = console
+        self.path = path
+        self._ring = deque(maxlen=ring_size)
+        self._wake = threading.Event()
+        self._idle = threading.Event()
+        self._idle.set()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._file = None
+        self._closed = False
+
+    @classmethod
+    def from_env(cls):
+        categories = {}
+        for item in os.environ.get("CUBASE_LOG_CATEGORIES", "").split(","):
+            if ":" in item:
+                name, _, level = item.partition(":")
+                categories[name.strip()] = _parse_level(level)
+        return cls(level=_parse_level(os.environ.get("CUBASE_LOG_LEVEL", "INFO")),
+                   categories=categories,
+                   console=os.environ.get("CUBASE_LOG_CONSOLE", "1") not in ("", "0"),
+                   path=os.environ.get("CUBASE_LOG_FILE") or None)
+
+    # --- configuration ---
+    def set_level(self, level, category=None):
+        """Level for one category, or the default level (names or numbers)"""
+        level = _parse_level(level) if isinstance(level, str) else level
+        if category is None:
+            self.level = level
+        else:
+            self.categories[category] = level
+
+    def enabled(self, level, category):
+        return level >= self.categories.get(category, self.level)
+
+    # --- hot path ---
+    def log(self, level, category, message, *args):
+        if level >= self.categories.get(category, self.level):
+            self._append(level, category, message, args)
+
+    def debug(self, category, message, *args):
+        if DEBUG >= self.categories.get(category, self.level):
+            self._append(DEBUG, category, message, args)
+
+    def info(self, category, message, *args):
+        if INFO >= self.categories.get(category, self.level):
+            self._append(INFO, category, message, args)
+
+    def warn(self, category, message, *args):
+        if WARN >= self.categories.get(category, self.level):
+            self._append(WARN, category, message, args)
+
+    def error(self, category, message, *args):
+        if ERROR >= self.categories.get(category, self.level):
+            self._append(ERROR, category, message, args)
+
+    def _append(self, level, category, message, args):
+        ring = self._ring
+        if len(ring) == ring.maxlen:
+            LOG_DROPPED.inc()  # the append below pushes the oldest record out
+        signal = not ring
+        ring.append((time.time(), level, category, threading.current_thread().name, message, args))
+        if signal:
+            self._idle.clear()
+            if self._thread is None:
+                self._start()
+            self._wake.set()
+
+    # --- writer thread ---
+    def _start(self):
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        if self.path:
+            try:
+                self._file = RotatingFile(self.path)
+            except OSError as e:
+                print(f"[ERROR] Log file {self.path} could not be opened: {e}")
+        ring = self._ring
+        while True:
+            self._wake.wait(IDLE_WAIT_S)
+            self._wake.clear()
+            console = []
+            while ring:
+                try:
+                    record = ring.popleft()
+                except IndexError:
+                    break
+                self._write(record, console)
+            if console:
+                try:
+                    sys.stdout.write("".join(console))
+                    sys.stdout.flush()
+                except (OSError, ValueError, UnicodeError):
+                    pass
+            if self._file is not None:
+                self._file.flush()
+            if not ring:
+                self._idle.set()
+            if self._closed and not ring:
+                return
+
+    def _write(self, record, console):
+        t, level, category, thread, message, args = record
+        if args:
+            try:
+                message = message % args
+            except (TypeError, ValueError) as e:
+                message = f"{message} {args!r} (format error: {e})"
+        if self.console:
+            console.append(message + "\n")
+        if self._file is not None:
+            stamp = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t))
+            self._file.write(f"{stamp}.{int(t % 1 * 1000):03d} {LEVEL_NAMES.get(level, level):<5} "
+                             f"{category:<9} [{thread}] {message}\n")
+
+    def flush(self, timeout=1.0):
+        """Wait (up to timeout) until every queued record is written"""
+        if self._thread is not None:
+            self._wake.set()
+            self._idle.wait(timeout)
+
+    def close(self, timeout=1.0):
+        """Write what is queued and stop the writer (call on exit)"""
+        if self._thread is None or self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self._thread.join(timeout)
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+LOG = AppLog.from_env()
+atexit.register(LOG.close)
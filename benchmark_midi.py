@@ -0,0 +1,317 @@
+"""
+MIDI Round-Trip Benchmark
+Pushes CC and note traffic at controlled rates through the real
+MidiHandler code paths (send_cc coalescing, sender thread, timer wheel for
+note-offs) into a MIDI input on the same machine, timestamps both sides
+and reports latency / jitter percentiles and message loss per rate.
+
+Ports:
+    Linux / macOS: a virtual rtmidi input port is created and MidiHandler
+                   connects to it (ALSA / CoreMIDI stand-in for loopMIDI).
+    Windows:       rtmidi has no virtual ports; use a loopMIDI port, which
+                   echoes its output back on its input: --port loopMIDI
+
+Latency is measured from the send_cc / send_note call to arrival at the
+input callback, so it includes the queue, the rate limiter and the driver.
+CC values that the rate limiter replaced on purpose are reported as
+"coalesced", not as loss; loss is written to the port but never received.
+
+Usage:
+    python benchmark_midi.py                          # all rates -> bench_results/midi_*.json
+    python benchmark_midi.py --quick                  # shorter runs (smoke run)
+    python benchmark_midi.py --cc-rate 0              # raw path, no CC coalescing
+    python benchmark_midi.py --port loopMIDI          # Windows
+    python benchmark_midi.py --compare old.json new.json
+"""
+
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+# Fix Windows console encoding
+try:
+    sys.stdout.reconfigure(encoding='utf-8')
+except:
+    pass
+
+import rtmidi
+
+from metrics import MIDI_CC_MESSAGES, MIDI_CC_COALESCED
+from midi_handler import MidiHandler, DEFAULT_CC_RATE
+
+RESULTS_DIR = "bench_results"
+VIRTUAL_PORT_NAME = "cubase-midi-bench"
+
+CC_RATES = [10, 50, 100, 200, 500, 1000]   # send_cc calls per second (one controller, like a slider drag)
+NOTE_RATES = [2, 10, 50]                   # key notes per second (on_pitch_detected sends ~1 per change)
+BENCH_CC = 102                             # undefined controller, harmless if a real synth listens
+NOTE_HOLD_S = 0.05                         # same note length as on_pitch_detected
+SETTLE_S = 0.3                             # wait for stragglers after each run
+
+
+class Receiver:
+    """MIDI input callback that stamps every message on arrival"""
+
+    def __init__(self, midiin):
+        self.events = []
+        self._lock = threading.Lock()
+        midiin.ignore_types(sysex=True, timing=True, active_sense=True)
+        midiin.set_callback(self._on_message)
+
+    def _on_message(self, event, data=None):
+        now = time.perf_counter()
+        with self._lock:
+            self.events.append((now, event[0]))
+
+    def take(self):
+        with self._lock:
+            events, self.events = self.events, []
+        return events
+
+
+def open_ports(port, cc_rate):
+    """(MidiHandler, Receiver, input port name) or None"""
+    midiin = rtmidi.MidiIn()
+    if port is None:
+        try:
+            midiin.open_virtual_port(VIRTUAL_PORT_NAME)
+        except Exception as e:
+            print(f"[ERROR] Virtual MIDI ports not available here ({e}). On Windows use --port loopMIDI")
+            return None
+        in_name = out_match = VIRTUAL_PORT_NAME
+    else:
+        names = midiin.get_ports()
+        index = next((i for i, name in enumerate(names) if port in name), None)
+        if index is None:
+            print(f"[ERROR] No MIDI input port matching '{port}' (inputs: {names})")
+            return None
+        midiin.open_port(index)
+        in_name, out_match = names[index], port
+    receiver = Receiver(midiin)
+    receiver.midiin = midiin  # keep the port open
+    handler = MidiHandler(cc_rate=cc_rate, port_match=out_match, routes=[{"name": "main", "match": out_match}])
+    if not handler.is_connected:
+        print(f"[ERROR] MidiHandler could not open an output matching '{out_match}'")
+        return None
+    return handler, receiver, in_name
+
+
+def paced(rate, duration):
+    """Yield send times at a fixed rate (sleep, then spin for the last ms)"""
+    interval = 1.0 / rate
+    start = time.perf_counter()
+    n = int(duration * rate)
+    for i in range(n):
+        target = start + i * interval
+        delay = target - time.perf_counter()
+        if delay > 0.002:
+            time.sleep(delay - 0.001)
+        while time.perf_counter() < target:
+            pass
+        yield i
+
+
+def percentiles_ms(values_s):
+    if not values_s:
+        return {"count": 0}
+    arr = np.asarray(values_s) * 1000.0
+    return {
+        "count": int(len(arr)),
+        "p50_ms": round(float(np.percentile(arr, 50)), 3),
+        "p90_ms": round(float(np.percentile(arr, 90)), 3),
+        "p99_ms": round(float(np.percentile(arr, 99)), 3),
+        "max_ms": round(float(arr.max()), 3),
+        "jitter_ms": round(float(np.percentile(arr, 99) - np.percentile(arr, 50)), 3),
+    }
+
+
+def cc_written():
+    return sum(child.value for child in list(MIDI_CC_MESSAGES.children.values()))
+
+
+def bench_cc(handler, receiver, rate, duration):
+    """Slider-drag traffic on one controller through send_cc"""
+    handler.send_cc(BENCH_CC, 0)
+    handler.drain()
+    time.sleep(SETTLE_S)
+    receiver.take()
+    written0, coalesced0 = cc_written(), MIDI_CC_COALESCED.value
+
+    called = {}  # value -> time of the latest send_cc call with that value
+    value = 0
+    calls = 0
+    for _ in paced(rate, duration):
+        value = value % 127 + 1  # 1..127, never equal to the previous value
+        called[value] = time.perf_counter()
+        handler.send_cc(BENCH_CC, value)
+        calls += 1
+    handler.drain(1.0)
+    time.sleep(SETTLE_S)
+
+    latencies = []
+    received = 0
+    for arrived, message in receiver.take():
+        if len(message) == 3 and message[0] & 0xF0 == 0xB0 and message[1] == BENCH_CC:
+            received += 1
+            sent_at = called.get(message[2])
+            if sent_at is not None and arrived >= sent_at:
+                latencies.append(arrived - sent_at)
+    written = cc_written() - written0
+    return dict(percentiles_ms(latencies), calls=calls, written=written, received=received,
+                coalesced=MIDI_CC_COALESCED.value - coalesced0, lost=max(0, written - received),
+                achieved_rate=round(received / duration, 1))
+
+
+def bench_notes(handler, receiver, rate, duration):
+    """Key-note traffic through send_note (note-on now, note-off from the timer wheel)"""
+    receiver.take()
+    note_on_called = {}
+    calls = 0
+    for i in paced(rate, duration):
+        note = 36 + i % 60
+        note_on_called[note] = time.perf_counter()
+        handler.send_note(note, 100, NOTE_HOLD_S)
+        calls += 1
+    handler.drain(1.0)
+    time.sleep(SETTLE_S + NOTE_HOLD_S)
+
+    on_latency, off_error = [], []
+    on_arrival = {}
+    received = 0
+    for arrived, message in receiver.take():
+        if len(message) != 3:
+            continue
+        status, note = message[0] & 0xF0, message[1]
+        if status == 0x90 and message[2] > 0:
+            received += 1
+            on_arrival[note] = arrived
+            if note in note_on_called:
+                on_latency.append(arrived - note_on_called[note])
+        elif status == 0x80 or (status == 0x90 and message[2] == 0):
+            received += 1
+            if note in on_arrival:
+                off_error.append(abs(arrived - on_arrival.pop(note) - NOTE_HOLD_S))
+    return {
+        "note_on": percentiles_ms(on_latency),
+        "note_off_timing_error": percentiles_ms(off_error),
+        "calls": calls,
+        "written": 2 * calls,
+        "received": received,
+        "lost": max(0, 2 * calls - received),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+                                       text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def environment(in_name, cc_rate):
+    return {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "host": platform.node(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "rtmidi": getattr(rtmidi, "__version__", "?"),
+        "commit": git_commit(),
+        "port": in_name,
+        "cc_rate_limit": cc_rate,
+    }
+
+
+def print_table(results):
+    print(f"\n{'RUN':<16} {'calls':>7} {'sent':>6} {'recv':>6} {'lost':>5} {'coal.':>6} "
+          f"{'p50 ms':>8} {'p99 ms':>8} {'max ms':>8} {'jitter':>8}")
+    print("-" * 92)
+    for name, r in results.items():
+        lat = r if "p50_ms" in r else r.get("note_on", {})
+        if not lat.get("count"):
+            lat = {"p50_ms": float('nan'), "p99_ms": float('nan'), "max_ms": float('nan'), "jitter_ms": float('nan')}
+        print(f"{name:<16} {r['calls']:>7} {r['written']:>6} {r['received']:>6} {r['lost']:>5} "
+              f"{r.get('coalesced', 0):>6} {lat['p50_ms']:>8.2f} {lat['p99_ms']:>8.2f} {lat['max_ms']:>8.2f} "
+              f"{lat['jitter_ms']:>8.2f}")
+        off = r.get("note_off_timing_error")
+        if off and off.get("count"):
+            print(f"{'':<16} note-off timing error p50 {off['p50_ms']:.2f} ms, p99 {off['p99_ms']:.2f} ms, "
+                  f"max {off['max_ms']:.2f} ms")
+
+
+def compare(old_path, new_path):
+    with open(old_path, "r", encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, "r", encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"OLD: {old['meta']['commit']} @ {old['meta']['host']} ({old['meta']['timestamp']})")
+    print(f"NEW: {new['meta']['commit']} @ {new['meta']['host']} ({new['meta']['timestamp']})")
+    print(f"\n{'RUN':<16} {'p99 old':>9} {'p99 new':>9} {'lost old':>9} {'lost new':>9}")
+    print("-" * 58)
+    for name, r_new in new["runs"].items():
+        r_old = old["runs"].get(name)
+        p99_new = (r_new if "p99_ms" in r_new else r_new.get("note_on", {})).get("p99_ms", float('nan'))
+        if not r_old:
+            print(f"{name:<16} {'-':>9} {p99_new:>9.2f} {'-':>9} {r_new['lost']:>9}")
+            continue
+        p99_old = (r_old if "p99_ms" in r_old else r_old.get("note_on", {})).get("p99_ms", float('nan'))
+        flag = "  <-- slower" if p99_new > 1.2 * p99_old + 0.5 else ""
+        flag += "  <-- loss" if r_new["lost"] > r_old["lost"] else ""
+        print(f"{name:<16} {p99_old:>9.2f} {p99_new:>9.2f} {r_old['lost']:>9} {r_new['lost']:>9}{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MIDI round-trip latency / jitter benchmark")
+    parser.add_argument("--quick", action="store_true", help="shorter runs (smoke run)")
+    parser.add_argument("--port", default=None,
+                        help="use existing ports whose name contains this (e.g. loopMIDI) instead of a virtual port")
+    parser.add_argument("--cc-rate", type=float, default=DEFAULT_CC_RATE,
+                        help=f"MidiHandler CC rate limit per controller (default {DEFAULT_CC_RATE:g}, 0 = off)")
+    parser.add_argument("--out", default=None, help="output JSON path (default: bench_results/...)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    opened = open_ports(args.port, args.cc_rate)
+    if opened is None:
+        sys.exit(1)
+    handler, receiver, in_name = opened
+    print(f"[OK] {handler.port_name} -> {in_name} (CC limit {args.cc_rate:g}/s)")
+    duration = 1.0 if args.quick else 5.0
+
+    results = {}
+    runs = [(f"cc@{rate}/s", lambda rate=rate: bench_cc(handler, receiver, rate, duration)) for rate in CC_RATES]
+    runs += [(f"note@{rate}/s", lambda rate=rate: bench_notes(handler, receiver, rate, duration)) for rate in NOTE_RATES]
+    for name, run in runs:
+        print(f"[BENCH] {name}")
+        # MidiHandler prints every CC it sends; keep the formatting cost but not the console
+        with open(os.devnull, "w", encoding="utf-8") as devnull, contextlib.redirect_stdout(devnull):
+            results[name] = run()
+
+    print_table(results)
+
+    meta = environment(in_name, args.cc_rate)
+    out_path = args.out
+    if out_path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        out_path = os.path.join(RESULTS_DIR, f"midi_{meta['host']}_{meta['commit']}_{stamp}.json")
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta, "runs": results}, f, indent=2)
+    print(f"\n[OK] Results written to {out_path}")
+
+
+if __name__ == "__main__":
+    main()
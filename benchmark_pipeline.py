@@ -0,0 +1,397 @@
+"""
+Pipeline Benchmark
+Measures every stage of realtime_pitch_detector.py separately and end-to-end
+on synthetic audio: realtime factor, per-call latency percentiles and
+allocation rate. Results are written as JSON so runs can be compared between
+commits and between machines.
+
+Usage:
+    python benchmark_pipeline.py                      # all stages -> bench_results/*.json
+    python benchmark_pipeline.py --quick              # fewer iterations (smoke run)
+    python benchmark_pipeline.py --stages analysis,aubio   # only these stage groups (substring match):
+        # capture, queue, resample, backend/crepe, backend/aubio, analysis, end_to_end/crepe, end_to_end/aubio
+    python benchmark_pipeline.py --compare old.json new.json
+"""
+
+import argparse
+import datetime
+import json
+import os
+import platform
+import queue
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+
+# Fix Windows console encoding
+try:
+    sys.stdout.reconfigure(encoding='utf-8')
+except:
+    pass
+
+import realtime_pitch_detector as rpd
+from realtime_pitch_detector import RealtimePitchDetector
+
+RESULTS_DIR = "bench_results"
+
+CREPE_CAPACITIES = ['tiny', 'small', 'medium', 'large', 'full']
+CREPE_STEPS_MS = [10, 25, 50, 100]
+AUBIO_WINDOWS = [(1024, 1024), (1024, 512), (2048, 512), (1024, 256)]  # (buffer, hop)
+
+CAPTURE_BLOCK = 1024
+MODEL_RATE = 16000
+LOOPBACK_RATE = 44100
+
+
+# --- Synthetic input ---
+def synth_melody(duration, sample_rate, seed=0, noise_level=0.01):
+    """A-minor-ish sine melody (with harmonics and a little noise) as float32 mono"""
+    rng = np.random.default_rng(seed)
+    notes = [57, 60, 62, 64, 65, 64, 62, 60, 59, 57]  # MIDI notes
+    note_len = int(0.25 * sample_rate)
+    n_samples = int(duration * sample_rate)
+    out = np.zeros(n_samples, dtype=np.float32)
+    t = np.arange(note_len) / sample_rate
+    env = np.minimum(1.0, np.minimum(t, t[::-1]) * 40.0)  # 25 ms fade in/out
+    pos = 0
+    i = 0
+    while pos < n_samples:
+        freq = 440.0 * 2 ** ((notes[i % len(notes)] - 69) / 12.0)
+        tone = 0.5 * np.sin(2 * np.pi * freq * t) + 0.15 * np.sin(4 * np.pi * freq * t)
+        seg = (tone * env).astype(np.float32)
+        end = min(n_samples, pos + note_len)
+        out[pos:end] = seg[:end - pos]
+        pos = end
+        i += 1
+    out += rng.normal(0, noise_level, n_samples).astype(np.float32)
+    return out
+
+
+# --- Measurement ---
+def percentile_us(samples_ns, q):
+    return float(np.percentile(samples_ns, q)) / 1000.0
+
+
+def measure(fn, iterations, audio_seconds_per_call=None, warmup=2, alloc_calls=20):
+    """
+    Time fn() per call, then measure its transient allocations in a separate
+    tracemalloc pass (so tracing does not distort the timings).
+
+    Allocation figures are the traced peak above baseline per call (Python and
+    NumPy heap; native TensorFlow memory is not visible to tracemalloc).
+    """
+    for _ in range(warmup):
+        fn()
+
+    samples = np.empty(iterations, dtype=np.int64)
+    perf = time.perf_counter_ns
+    t_start = perf()
+    for i in range(iterations):
+        t0 = perf()
+        fn()
+        samples[i] = perf() - t0
+    total_s = (perf() - t_start) / 1e9
+
+    alloc_calls = max(1, min(alloc_calls, iterations))
+    tracemalloc.start()
+    alloc_total = 0
+    for _ in range(alloc_calls):
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+        alloc_total += max(0, peak - base)
+    tracemalloc.stop()
+    alloc_per_call = alloc_total / alloc_calls
+
+    calls_per_s = iterations / total_s if total_s > 0 else float('inf')
+    result = {
+        "calls": iterations,
+        "total_s": round(total_s, 6),
+        "calls_per_s": round(calls_per_s, 2),
+        "mean_us": round(float(samples.mean()) / 1000.0, 3),
+        "p50_us": round(percentile_us(samples, 50), 3),
+        "p90_us": round(percentile_us(samples, 90), 3),
+        "p99_us": round(percentile_us(samples, 99), 3),
+        "max_us": round(float(samples.max()) / 1000.0, 3),
+        "alloc_bytes_per_call": int(alloc_per_call),
+        "alloc_mb_per_s": round(alloc_per_call * calls_per_s / 1e6, 3),
+    }
+    if audio_seconds_per_call:
+        result["realtime_factor"] = round(audio_seconds_per_call * iterations / total_s, 3)
+    return result
+
+
+def make_detector(backend):
+    """Detector with no audio stream and a no-op MIDI callback"""
+    return RealtimePitchDetector(midi_callback=lambda key, scale: None, backend=backend)
+
+
+# --- Stages ---
+def bench_capture(n):
+    results = {}
+    block_sec = CAPTURE_BLOCK / MODEL_RATE
+
+    indata = (synth_melody(block_sec, MODEL_RATE)).reshape(-1, 1)
+    results["capture/sounddevice_copy"] = measure(indata.copy, n, block_sec)
+
+    stereo = np.repeat(synth_melody(CAPTURE_BLOCK / LOOPBACK_RATE, LOOPBACK_RATE).reshape(-1, 1), 2, axis=1)
+    raw = (stereo * 32767).astype(np.int16).tobytes()
+    results["capture/wasapi_int16_to_mono"] = measure(
+        lambda: RealtimePitchDetector.int16_stereo_to_mono(raw), n, CAPTURE_BLOCK / LOOPBACK_RATE)
+    results["capture/soundcard_float_to_mono"] = measure(
+        lambda: RealtimePitchDetector.float_block_to_mono(stereo), n, CAPTURE_BLOCK / LOOPBACK_RATE)
+    return results
+
+
+def bench_queue(n):
+    results = {}
+    block = synth_melody(CAPTURE_BLOCK / MODEL_RATE, MODEL_RATE).reshape(-1, 1)
+    q = queue.Queue()
+
+    def put_get():
+        q.put((time.perf_counter_ns(), block))  # blocks travel with their capture stamp
+        q.get_nowait()
+    results["queue/put_get_same_thread"] = measure(put_get, n, CAPTURE_BLOCK / MODEL_RATE)
+
+    # Cross-thread hand-off: latency from put() to get() returning in the consumer,
+    # the way the capture thread feeds the detection thread
+    handoff = np.empty(n, dtype=np.int64)
+    q = queue.Queue()
+
+    def consumer():
+        for i in range(n):
+            t_put, _ = q.get()
+            handoff[i] = time.perf_counter_ns() - t_put
+
+    th = threading.Thread(target=consumer, daemon=True)
+    th.start()
+    t_start = time.perf_counter()
+    for _ in range(n):
+        q.put((time.perf_counter_ns(), block))
+        time.sleep(0)  # let the consumer run, like a capture callback returning
+    th.join()
+    total_s = time.perf_counter() - t_start
+    results["queue/cross_thread_handoff"] = {
+        "calls": n,
+        "total_s": round(total_s, 6),
+        "calls_per_s": round(n / total_s, 2),
+        "mean_us": round(float(handoff.mean()) / 1000.0, 3),
+        "p50_us": round(percentile_us(handoff, 50), 3),
+        "p90_us": round(percentile_us(handoff, 90), 3),
+        "p99_us": round(percentile_us(handoff, 99), 3),
+        "max_us": round(float(handoff.max()) / 1000.0, 3),
+    }
+    return results
+
+
+def bench_resample(n):
+    """Loopback capture runs at 44.1 kHz, CREPE resamples it to 16 kHz internally"""
+    results = {}
+    audio = synth_melody(1.0, LOOPBACK_RATE)
+    n_out = int(len(audio) * MODEL_RATE / LOOPBACK_RATE)
+    x_in = np.arange(len(audio)) / LOOPBACK_RATE
+    x_out = np.arange(n_out) / MODEL_RATE
+    results["resample/numpy_linear_44k_16k"] = measure(lambda: np.interp(x_out, x_in, audio), n, 1.0)
+    try:
+        import resampy  # what crepe.predict uses for sr != 16000
+        results["resample/resampy_44k_16k"] = measure(
+            lambda: resampy.resample(audio, LOOPBACK_RATE, MODEL_RATE), max(3, n // 20), 1.0)
+    except ImportError:
+        print("[SKIP] resampy not installed")
+    return results
+
+
+def bench_crepe(n_calls):
+    results = {}
+    if not rpd.CREPE_AVAILABLE:
+        print("[SKIP] CREPE not installed")
+        return results
+    det = make_detector('crepe')
+    audio = synth_melody(1.0, MODEL_RATE)
+    for capacity in CREPE_CAPACITIES:
+        for step in CREPE_STEPS_MS:
+            det.model_capacity = capacity
+            det.step_size = step
+            name = f"backend/crepe_{capacity}_step{step}ms"
+            print(f"  {name}...")
+            results[name] = measure(lambda: det.detect_pitches_crepe(audio), n_calls, 1.0,
+                                    warmup=1, alloc_calls=2)
+    return results
+
+
+def bench_aubio(n):
+    results = {}
+    if not rpd.AUBIO_AVAILABLE:
+        print("[SKIP] Aubio not installed")
+        return results
+    det = make_detector('aubio')
+    audio = synth_melody(1.0, MODEL_RATE)
+    for win, hop in AUBIO_WINDOWS:
+        det.aubio_pitch = rpd.aubio.pitch("yinfft", win, hop, MODEL_RATE)
+        det.aubio_pitch.set_unit("Hz")
+        det.aubio_pitch.set_silence(-40)
+        blocks = [audio[i:i + hop].reshape(-1, 1) for i in range(0, len(audio) - hop + 1, hop)]
+        it = iter(())
+
+        def one_block():
+            nonlocal it
+            block = next(it, None)
+            if block is None:
+                it = iter(blocks)
+                block = next(it)
+            det.detect_pitch_aubio(block)
+        results[f"backend/aubio_yinfft_win{win}_hop{hop}"] = measure(one_block, n, hop / MODEL_RATE)
+    return results
+
+
+def bench_analysis(n):
+    results = {}
+    det = make_detector('crepe' if rpd.USE_CREPE else 'aubio')
+    rng = np.random.default_rng(1)
+    freqs = 440.0 * 2 ** ((rng.integers(55, 72, 10) - 69) / 12.0)
+
+    results["analysis/hz_to_midi"] = measure(lambda: det.freq_to_midi_note(freqs[0]), n)
+
+    def histogram_update():
+        det.pitch_history = list(range(60, 110))
+        det.update_pitch_history(freqs, max_history=50)
+    results["analysis/histogram_update_10"] = measure(histogram_update, n)
+
+    history = [int(x) for x in rng.integers(55, 72, 50)]
+    results["analysis/key_scoring_50"] = measure(lambda: det.analyze_key_and_scale(history), n)
+    return results
+
+
+def bench_end_to_end(backend, seconds):
+    """Stream capture-sized blocks through the full detector path of one backend"""
+    available = rpd.CREPE_AVAILABLE if backend == 'crepe' else rpd.AUBIO_AVAILABLE
+    if not available:
+        return {}
+    det = make_detector(backend)
+    audio = synth_melody(seconds, det.sample_rate)
+    block = det.buffer_size
+    blocks = [audio[i:i + block].reshape(-1, 1) for i in range(0, len(audio) - block + 1, block)]
+    process = det.process_chunk_crepe if backend == 'crepe' else det.process_chunk_aubio
+    it = iter(blocks)
+
+    def one_block():
+        nonlocal it
+        chunk = next(it, None)
+        if chunk is None:
+            it = iter(blocks)
+            chunk = next(it)
+        process(chunk)
+    return {f"end_to_end/{backend}_block{block}": measure(
+        one_block, len(blocks), block / det.sample_rate, warmup=1, alloc_calls=len(blocks) // 4)}
+
+
+# --- Output ---
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return "unknown"
+
+
+def environment():
+    return {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "host": platform.node(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "commit": git_commit(),
+        "crepe": rpd.CREPE_AVAILABLE,
+        "aubio": rpd.AUBIO_AVAILABLE,
+    }
+
+
+def print_table(stages):
+    print(f"\n{'STAGE':<44} {'RTF':>9} {'p50 us':>11} {'p99 us':>11} {'MB/s alloc':>11}")
+    print("-" * 90)
+    for name, r in stages.items():
+        rtf = r.get("realtime_factor")
+        rtf_txt = f"{rtf:>8.1f}x" if rtf is not None else f"{'-':>9}"
+        alloc = r.get("alloc_mb_per_s")
+        alloc_txt = f"{alloc:>11.2f}" if alloc is not None else f"{'-':>11}"
+        print(f"{name:<44} {rtf_txt} {r['p50_us']:>11.1f} {r['p99_us']:>11.1f} {alloc_txt}")
+
+
+def compare(old_path, new_path):
+    with open(old_path, "r", encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, "r", encoding="utf-8") as f:
+        new = json.load(f)
+    print(f"OLD: {old['meta']['commit']} @ {old['meta']['host']} ({old['meta']['timestamp']})")
+    print(f"NEW: {new['meta']['commit']} @ {new['meta']['host']} ({new['meta']['timestamp']})")
+    print(f"\n{'STAGE':<44} {'p50 old':>10} {'p50 new':>10} {'ratio':>7}")
+    print("-" * 75)
+    for name, r_new in new["stages"].items():
+        r_old = old["stages"].get(name)
+        if not r_old:
+            print(f"{name:<44} {'-':>10} {r_new['p50_us']:>10.1f} {'new':>7}")
+            continue
+        ratio = r_new["p50_us"] / r_old["p50_us"] if r_old["p50_us"] else float('inf')
+        flag = "  <-- slower" if ratio > 1.10 else ""
+        print(f"{name:<44} {r_old['p50_us']:>10.1f} {r_new['p50_us']:>10.1f} {ratio:>6.2f}x{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the realtime pitch detection pipeline")
+    parser.add_argument("--quick", action="store_true", help="fewer iterations (smoke run)")
+    parser.add_argument("--stages", default="", help="comma-separated substrings of the stage groups to run (capture, queue, resample, "
+                             "backend/crepe, backend/aubio, analysis, end_to_end/crepe, end_to_end/aubio)")
+    parser.add_argument("--out", default=None, help="output JSON path (default: bench_results/...)")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="compare two result files")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    n = 200 if args.quick else 2000
+    n_model = 2 if args.quick else 5
+    e2e_seconds = 3.0 if args.quick else 10.0
+
+    groups = [
+        ("capture", lambda: bench_capture(n)),
+        ("queue", lambda: bench_queue(n)),
+        ("resample", lambda: bench_resample(max(10, n // 20))),
+        ("backend/crepe", lambda: bench_crepe(n_model)),
+        ("backend/aubio", lambda: bench_aubio(n)),
+        ("analysis", lambda: bench_analysis(n)),
+        ("end_to_end/crepe", lambda: bench_end_to_end('crepe', e2e_seconds)),
+        ("end_to_end/aubio", lambda: bench_end_to_end('aubio', e2e_seconds)),
+    ]
+    filters = [f.strip() for f in args.stages.split(",") if f.strip()]
+
+    stages = {}
+    for group, run in groups:
+        if filters and not any(f in group for f in filters):
+            continue
+        print(f"[BENCH] {group}")
+        stages.update(run())
+
+    print_table(stages)
+
+    meta = environment()
+    out_path = args.out
+    if out_path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        out_path = os.path.join(RESULTS_DIR, f"bench_{meta['host']}_{meta['commit']}_{stamp}.json")
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump({"meta": meta, "stages": stages}, f, indent=2)
+    print(f"\n[OK] Results written to {out_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+CC Ramps
+Interpolation of several CCs from their current to target values over a
+duration and a curve, for smooth scene transitions (MUSIC_VOL down while
+REVERB_LONG comes up, ...). MidiHandler.ramp() runs them on the sender
+thread from one fixed-rate clock; this module is the math only.
+
+Values are evaluated at the clock's scheduled step times, not at the time
+the sender thread actually woke up, so wake-up jitter never bends the curve.
+A step only sends the CCs whose integer value changed, so slow ramps send
+few messages and fast ones at most one message per CC per step.
+
+Usage:
+    ramp = Ramp({21: 100.0}, {21: 40}, t0=now, duration_s=3.0, curve="ease")
+    ramp.value(21, now + 1.5)        # -> 70.0
+"""
+
+import math
+
+# t in 0..1 -> progress in 0..1
+CURVES = {
+    "linear": lambda t: t,
+    "ease": lambda t: t * t * (3.0 - 2.0 * t),                 # smoothstep: slow start and end
+    "ease_in": lambda t: t * t,
+    "ease_out": lambda t: 1.0 - (1.0 - t) * (1.0 - t),
+    "cosine": lambda t: 0.5 - 0.5 * math.cos(math.pi * t),
+}
+DEFAULT_CURVE = "ease"
+
+
+class Ramp:
+    """One transition: {cc: start} -> {cc: target} from t0 over duration_s seconds"""
+
+    def __init__(self, starts, targets, t0, duration_s, curve=DEFAULT_CURVE, on_step=None, on_done=None):
+        if curve not in CURVES:
+            raise ValueError(f"unknown curve: {curve} (one of {', '.join(CURVES)})")
+        self.starts = dict(starts)
+        self.targets = {cc: max(0.0, min(127.0, float(v))) for cc, v in targets.items()}
+        self.ccs = set(self.targets)   # still ramping (a manual move removes its cc)
+        self.cancelled = set()
+        self.t0 = t0
+        self.duration_s = max(0.0, float(duration_s))
+        self.curve = curve
+        self._fn = CURVES[curve]
+        self.on_step = on_step         # callback({cc: float value}) after each step
+        self.on_done = on_done         # callback(ramp) once every cc finished or was cancelled
+        self.steps = 0
+
+    def progress(self, t):
+        if self.duration_s <= 0:
+            return 1.0
+        return max(0.0, min(1.0, (t - self.t0) / self.duration_s))
+
+    def value(self, cc, t):
+        """Interpolated (float) value of cc at time t"""
+        start = self.starts[cc]
+        return start + (self.targets[cc] - start) * self._fn(self.progress(t))
+
+    def finished(self, t):
+        return self.progress(t) >= 1.0
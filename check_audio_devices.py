@@ -8,6 +8,8 @@ import numpy as np
 import time
 import sys
 
+from device_registry import get_registry
+
 # Fix Windows console encoding
 try:
     sys.stdout.reconfigure(encoding='utf-8')
@@ -20,25 +22,26 @@ def list_devices():
     print("DANH SÁCH THIẾT BỊ AUDIO")
     print("="*60)
     
-    devices = sd.query_devices()
+    devices = get_registry().devices()
     
     print("\n📥 THIẾT BỊ INPUT (Microphone, Line In, etc.):")
     print("-" * 60)
-    for i, device in enumerate(devices):
-        if device['max_input_channels'] > 0:
-            default_marker = " [MẶC ĐỊNH]" if i == sd.default.device[0] else ""
-            print(f"[{i:2d}] {device['name']}{default_marker}")
-            print(f"     Channels: {device['max_input_channels']}, "
-                  f"Sample Rate: {device['default_samplerate']} Hz")
+    for device in devices:
+        if device.max_input_channels > 0:
+            default_marker = " [MẶC ĐỊNH]" if device.is_default_input else ""
+            print(f"[{device.index:2d}] {device.name}{default_marker}")
+            print(f"     Channels: {device.max_input_channels}, "
+                  f"Sample Rate: {device.default_samplerate} Hz")
     
     print("\n📤 THIẾT BỊ OUTPUT (Speakers, Headphones, etc.):")
     print("-" * 60)
-    for i, device in enumerate(devices):
-        if device['max_output_channels'] > 0:
-            default_marker = " [MẶC ĐỊNH]" if i == sd.default.device[1] else ""
-            print(f"[{i:2d}] {device['name']}{default_marker}")
-            print(f"     Channels: {device['max_output_channels']}, "
-                  f"Sample Rate: {device['default_samplerate']} Hz")
+    for device in devices:
+        if device.max_output_channels > 0:
+            default_marker = " [MẶC ĐỊNH]" if device.is_default_output else ""
+            loopback_marker = "" if device.loopback_id is None else " [LOOPBACK OK]"
+            print(f"[{device.index:2d}] {device.name}{default_marker}{loopback_marker}")
+            print(f"     Channels: {device.max_output_channels}, "
+                  f"Sample Rate: {device.default_samplerate} Hz")
     
     print("\n" + "="*60)
     return devices
@@ -109,17 +112,15 @@ def find_stereo_mix():
     """Try to find Stereo Mix or similar loopback device"""
     print("\n🔍 Searching for Stereo Mix / Loopback device...")
     
-    devices = sd.query_devices()
     loopback_keywords = ['stereo mix', 'wave out mix', 'loopback', 'what u hear']
     
     found_devices = []
-    for i, device in enumerate(devices):
-        if device['max_input_channels'] > 0:
-            name_lower = device['name'].lower()
-            for keyword in loopback_keywords:
-                if keyword in name_lower:
-                    found_devices.append((i, device['name']))
-                    break
+    for device in get_registry().inputs():
+        name_lower = device.name.lower()
+        for keyword in loopback_keywords:
+            if keyword in name_lower:
+                found_devices.append((device.index, device.name))
+                break
     
     if found_devices:
         print("✅ Found loopback device(s):")
@@ -168,7 +169,7 @@ if __name__ == "__main__":
                 print(f"❌ Invalid device number. Must be 0-{len(devices)-1}")
                 continue
             
-            if devices[device_idx]['max_input_channels'] == 0:
+            if devices[device_idx].max_input_channels == 0:
                 print("❌ This device has no input channels!")
                 continue
             
@@ -0,0 +1,295 @@
+"""
+Control API
+Drives a ControllerEngine over a local TCP socket (localhost only), so
+scripts and a phone-side proxy can run the rig without the GUI.
+
+Protocol: newline-delimited JSON (UTF-8), both directions.
+- The first line must be {"cmd": "hello", "token": "..."} with the shared
+  token (CUBASE_CONTROL_TOKEN, otherwise the random one kept in
+  TOKEN_FILE); a wrong token, a line that is not JSON or an HTTP request
+  line (a web page POSTing to localhost) closes the connection.
+- A request line is one command or a list of commands; a list runs as one
+  batch (one lock hold, one state event). The reply line is
+  {"results": [{"ok": true, "result": ...}, ...]}, one entry per command, in
+  request order, so clients can pipeline requests.
+- {"cmd": "subscribe"} turns on the event stream for this connection: the
+  reply carries the current state, then every engine event arrives as its
+  own line ({"event": "state", ...}). Each subscriber has a bounded queue
+  (EVENT_QUEUE_SIZE); a client that stops reading loses the oldest events,
+  it never slows the engine.
+
+    {"cmd": "set", "key": "MUSIC_VOL", "value": 90}
+    [{"cmd": "toggle", "key": "MUTE_MIC", "state": true}, {"cmd": "tone_step", "delta": -1}]
+    {"cmd": "genre", "genre": "BOLERO"}
+
+Commands: see controller_engine.COMMANDS.
+
+Usage:
+    start_control_server(engine, 9465)
+
+    with ControlClient() as client:                  # from a script (sends the hello line)
+        client.request([{"cmd": "set", "key": "MIC_VOL", "value": 80}])
+        client.subscribe()
+        print(client.next_event(timeout=5))
+
+Environment:
+    CUBASE_CONTROL_PORT=9465   start the API (controller_gui.py also accepts --control [PORT])
+    CUBASE_CONTROL_TOKEN=...   shared token for the hello line (default: TOKEN_FILE, created on first start)
+"""
+
+import hmac
+import json
+import os
+import queue
+import secrets
+import socket
+import socketserver
+import threading
+from collections import deque
+
+from metrics import CONTROL_CLIENTS, CONTROL_COMMANDS, CONTROL_EVENTS_DROPPED
+
+DEFAULT_PORT = 9465
+EVENT_QUEUE_SIZE = 1024
+TOKEN_FILE = "control_token.txt"
+# Request lines of a browser / HTTP client: never valid JSON, always the end of the connection
+HTTP_METHODS = (b"GET", b"POST", b"PUT", b"DELETE", b"HEAD", b"OPTIONS", b"PATCH", b"CONNECT", b"TRACE")
+
+_clients = set()
+CONTROL_CLIENTS.set_function(lambda: len(_clients))
+
+
+class _ControlHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._write_lock = threading.Lock()
+        self._events = None
+        _clients.add(self)
+
+    def handle(self):
+        engine = self.server.engine
+        authenticated = False
+        try:
+            for line in self.rfile:
+                if not line.strip():
+                    continue
+                if line.lstrip().split(b" ", 1)[0].upper() in HTTP_METHODS:
+                    return  # HTTP request (e.g. a web page POSTing to localhost): not our protocol
+                try:
+                    request = json.loads(line)
+                except ValueError as e:
+                    self._send({"results": [{"ok": False, "error": f"invalid JSON: {e}"}]})
+                    return
+                if not authenticated:
+                    if not self._hello(request):
+                        self._send({"results": [{"ok": False, "error": "expected {\"cmd\": \"hello\", \"token\": ...} "
+                                                                       "with the control token"}]})
+                        return
+                    authenticated = True
+                    self._send({"results": [{"ok": True, "result": True}]})
+                    continue
+                if isinstance(request, dict) and request.get("cmd") == "subscribe":
+                    self._subscribe(engine)
+                    self._send({"results": [{"ok": True, "result": engine.snapshot()}]})
+                    continue
+                if not isinstance(request, (dict, list)):
+                    self._send({"results": [{"ok": False, "error": "expected a command object or a list"}]})
+                    continue
+                CONTROL_COMMANDS.add(1 if isinstance(request, dict) else len(request))
+                self._send({"results": engine.execute(request, source="api")})
+        except (ConnectionError, OSError):
+            pass  # client went away
+
+    def _hello(self, request):
+        token = request.get("token") if isinstance(request, dict) and request.get("cmd") == "hello" else None
+        return isinstance(token, str) and hmac.compare_digest(token.encode("utf-8"), self.server.token.encode("utf-8"))
+
+    def finish(self):
+        if self._events is not None:
+            self.server.engine.unsubscribe(self._on_event)
+            self._events.put(None)
+        _clients.discard(self)
+        try:
+            super().finish()
+        except OSError:
+            pass
+
+    def _send(self, obj):
+        data = (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._write_lock:
+            self.wfile.write(data)
+
+    # --- event stream (one writer thread per subscribed client) ---
+    def _subscribe(self, engine):
+        if self._events is not None:
+            return
+        self._events = queue.Queue(EVENT_QUEUE_SIZE)
+        threading.Thread(target=self._write_events, name="control-events", daemon=True).start()
+        engine.subscribe(self._on_event)
+
+    def _on_event(self, event):
+        """Engine thread: never blocks, drops the oldest event if the client is behind"""
+        while True:
+            try:
+                self._events.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self._events.get_nowait()
+                    CONTROL_EVENTS_DROPPED.inc()
+                except queue.Empty:
+                    pass
+
+    def _write_events(self):
+        while True:
+            event = self._events.get()
+            if event is None:
+                return
+            try:
+                self._send(event)
+            except (ConnectionError, OSError):
+                return
+
+
+class _ControlServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+_server = None
+
+
+def control_token(create=False):
+    """The shared token: CUBASE_CONTROL_TOKEN, else TOKEN_FILE (created with a random token if create)"""
+    token = os.environ.get("CUBASE_CONTROL_TOKEN")
+    if token:
+        return token
+    try:
+        with open(TOKEN_FILE, encoding="utf-8") as f:
+            token = f.read().strip()
+    except FileNotFoundError:
+        token = None
+    if token or not create:
+        return token
+    token = secrets.token_urlsafe(24)
+    fd = os.open(TOKEN_FILE, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(token + "\n")
+    return token
+
+
+def start_control_server(engine, port=DEFAULT_PORT, host="127.0.0.1", token=None):
+    """Serve the control API from a daemon thread. Returns the server, or None if it could not bind."""
+    global _server
+    if _server is not None:
+        return _server
+    try:
+        token = token or control_token(create=True)
+    except OSError as e:
+        print(f"[ERROR] Control API token could not be written to {TOKEN_FILE}: {e}")
+        return None
+    try:
+        _server = _ControlServer((host, port), _ControlHandler)
+    except OSError as e:
+        print(f"[ERROR] Control API could not bind {host}:{port}: {e}")
+        return None
+    _server.engine = engine
+    _server.token = token
+    threading.Thread(target=_server.serve_forever, name="control-api", daemon=True).start()
+    where = "CUBASE_CONTROL_TOKEN" if os.environ.get("CUBASE_CONTROL_TOKEN") == token else TOKEN_FILE
+    print(f"[OK] Control API: {host}:{port} (JSON lines, token from {where})")
+    return _server
+
+
+def stop_control_server():
+    global _server
+    if _server is not None:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
+
+
+def start_from_env(engine):
+    """Start the API if CUBASE_CONTROL_PORT is set"""
+    port = os.environ.get("CUBASE_CONTROL_PORT")
+    if not port:
+        return None
+    try:
+        return start_control_server(engine, int(port))
+    except ValueError:
+        print("[WARN] CUBASE_CONTROL_PORT must be a port number")
+        return None
+
+
+class ControlClient:
+    """Blocking client for scripts: request() returns results, events received meanwhile are kept"""
+
+    def __init__(self, port=DEFAULT_PORT, host="127.0.0.1", timeout=5.0, token=None):
+        token = token or control_token()
+        if not token:
+            raise PermissionError(f"no control token: set CUBASE_CONTROL_TOKEN or start the API to create {TOKEN_FILE}")
+        self.sock = socket.create_connection((host, port), timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._buffer = b""
+        self.events = deque()
+        try:
+            result = self.request({"cmd": "hello", "token": token})[0]
+        except BaseException:
+            self.close()
+            raise
+        if not result["ok"]:
+            self.close()
+            raise PermissionError(result["error"])
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.sock.close()
+
+    def _read(self):
+        while b"\n" not in self._buffer:
+            data = self.sock.recv(65536)
+            if not data:
+                raise ConnectionError("control API closed the connection")
+            self._buffer += data
+        line, self._buffer = self._buffer.split(b"\n", 1)
+        return json.loads(line)
+
+    def send(self, commands):
+        """Send without waiting for the reply (pipelining; read it with reply())"""
+        self.sock.sendall((json.dumps(commands, ensure_ascii=False) + "\n").encode("utf-8"))
+
+    def reply(self):
+        while True:
+            message = self._read()
+            if "event" in message:
+                self.events.append(message)
+            else:
+                return message["results"]
+
+    def request(self, commands):
+        """One command or a list (one batch); returns the list of results"""
+        self.send(commands)
+        return self.reply()
+
+    def subscribe(self):
+        """Start the event stream; returns the current state"""
+        return self.request({"cmd": "subscribe"})[0]["result"]
+
+    def next_event(self, timeout=None):
+        """Next event (None on timeout)"""
+        if self.events:
+            return self.events.popleft()
+        previous = self.sock.gettimeout()
+        self.sock.settimeout(timeout)
+        try:
+            return self._read()
+        except socket.timeout:
+            return None
+        finally:
+            self.sock.settimeout(previous)
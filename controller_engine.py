@@ -0,0 +1,799 @@
+"""
+Controller Engine
+The rig's state model without a GUI: sliders, toggles, tone, genre presets,
+Cubase feedback and the realtime detector, driving Cubase through
+MidiHandler. The Tk app (controller_gui.py) and the local control API
+(control_server.py) are both clients of one engine.
+
+Commands are dicts, e.g. {"cmd": "set", "key": "MUSIC_VOL", "value": 90}
+(see COMMANDS). execute() runs a list of them as one batch under one lock
+and publishes one coalesced "state" event for the whole batch; commands
+that can take seconds (UNBATCHED_COMMANDS: starting the detector loads
+the model) run between batches, outside the lock. Events are
+dicts passed to subscriber callbacks on the thread that made the change,
+in order and after the engine lock is released; callbacks must not block
+(the GUI queues them for its Tk tick, the API queues per client):
+
+    {"event": "state", "source": "api", "changes": {"sliders": {"MUSIC_VOL": 90.0}, "tone": 2.0}}
+    {"event": "key", "key": "A", "scale": "minor"}
+    {"event": "detector", "running": true}           (+ "error": reason when capture was lost)
+    {"event": "status", "subsystem": "detector", "status": "ready"}
+
+Meters (input level, pitch, pitch-class histogram) are not events: they
+change every audio block, so readers poll detector_snapshot() at their own
+frame rate instead.
+
+Nothing is opened at import or in the constructor: start() opens MIDI,
+loads config.json, recalls the saved state and listens for Cubase feedback.
+The detector (numpy, sounddevice, the pitch backend) and the audio device
+scan are imported and built on a background thread ("detector-init"); their
+progress is in status ("loading" -> "ready" / "unavailable") and "status"
+events, and set_detector() waits for it.
+
+Usage:
+    engine = ControllerEngine()
+    engine.subscribe(print)
+    engine.start()
+    engine.execute([{"cmd": "set", "key": "MUSIC_VOL", "value": 90},
+                    {"cmd": "toggle", "key": "MUTE_MIC"}])
+    engine.close()
+
+    python controller_engine.py            # headless rig, control API on 127.0.0.1:9465
+
+Environment:
+    CUBASE_AUTOKEY_MAX_S=15    DÒ TONE: longest listen (see listen_for_key)
+    CUBASE_AUTOKEY_MIN_S=3     DÒ TONE: shortest listen (Auto-Key needs a few seconds too)
+    CUBASE_AUTOKEY_MARGIN=0.1  DÒ TONE: tonic share lead over the runner-up that ends the listen
+    CUBASE_AUTOKEY_CONFIDENCE=0.75   DÒ TONE: share of notes inside the detected scale
+    CUBASE_NOTE_STREAM=1       AUTO RT also streams the melody as MIDI notes (channel 2)
+    CUBASE_NOTE_BEND=1         add pitch bend to the note stream
+    CUBASE_FOLLOW_TUNING=1     AUTO RT drives TUNE (CC 27) from the detected reference tuning
+"""
+
+import importlib.util
+import collections
+import itertools
+import math
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import startup_trace
+
+if __name__ == "__main__":
+    startup_trace.begin()  # headless entry point: time the imports below (see startup_trace.py)
+
+from app_log import LOG
+from cc_ramp import CURVES, DEFAULT_CURVE
+from latency_trace import TRACER
+from metrics import AUTOKEY_LISTENS, AUTOKEY_LISTEN_SECONDS, MIDI_DROPPED
+from midi_handler import MidiHandler
+from preset_bank import PresetBank, diff_states
+from session_log import (EVENT_AUTOKEY, EVENT_CONTROL, EVENT_DETECTOR, EVENT_GENRE, EVENT_KEY, SESSION,
+                         key_code, scale_code, source_code)
+from settings_store import SettingsStore
+
+# Realtime Pitch Detection: imported on the detector-init thread (start()), only checked here
+PITCH_DETECTOR_AVAILABLE = (importlib.util.find_spec('sounddevice') is not None and
+                            (importlib.util.find_spec('crepe') or importlib.util.find_spec('aubio')) is not None)
+if not PITCH_DETECTOR_AVAILABLE:
+    print("Warning: Realtime pitch detector not available. Install: pip install crepe tensorflow sounddevice")
+DETECTOR_INIT_TIMEOUT_S = 30.0
+
+# DÒ TONE listen phase: ends once the detector's key is clear (listen_for_key)
+AUTOKEY_MAX_S = 15.0
+AUTOKEY_MIN_S = 3.0
+AUTOKEY_MARGIN = 0.10        # top tonic share minus the runner-up's (DetectorSnapshot.ranking)
+AUTOKEY_CONFIDENCE = 0.75    # DetectorSnapshot.confidence
+AUTOKEY_STABLE_S = 1.0       # the same key/scale for this long
+AUTOKEY_POLL_S = 0.05
+
+CC_MAP = {
+    "MUSIC_VOL": 21, "MIC_VOL": 20, "REVERB_LONG": 22, "REVERB_SHORT": 23, "TUNE": 27,
+    "DELAY": 26,
+    "MUTE_MUSIC": 25, "MUTE_MIC": 24, "TONE_VAL_SEND": 28,  # Single CC for Value
+    "DO_TONE": 30, "LAY_TONE": 31, "VANG_FX": 32, "FIX_MEO": 36,
+    "AUTO_TUNE_RT": 37  # Realtime Auto-Tune Detection
+    # REMOVED: LOFI (33), REMIX (34), SAVE (35) - Internal Python Logic Only
+    # TONE_DOWN (29) removed, we only use CC 28 for value
+}
+
+CC_KEYS = {cc: k for k, cc in CC_MAP.items()}
+
+# TUNE (CC 27) follows the detected reference tuning with --follow-tuning:
+# CC 64 = A4 440 Hz, 0 / 127 = -/+ TUNE_CC_RANGE_CENTS (match the plugin parameter range)
+TUNE_CC_RANGE_CENTS = 100
+
+GENRES = ["NHẠC TRẺ", "BOLERO", "REMIX"]
+SLIDERS = ["MUSIC_VOL", "MIC_VOL", "REVERB_LONG", "REVERB_SHORT", "DELAY", "TUNE"]
+PRESET_TOGGLES = ["MUTE_MUSIC", "MUTE_MIC", "VANG_FX", "REMIX"]  # toggles stored in presets / config.json
+BUTTONS = {"FIX_MEO": 0.1, "LAY_TONE": 0.1}  # momentary buttons: hold time of the pulse
+DEFAULT_RAMP_S = 2.0
+DEFAULT_SLIDERS = {"MUSIC_VOL": 100.0, "MIC_VOL": 100.0, "REVERB_LONG": 100.0, "REVERB_SHORT": 100.0,
+                   "DELAY": 100.0, "TUNE": 63.5}
+
+# Auto-Tune key: note number (octave 4), velocity 127 = major, 64 = minor
+KEY_TO_MIDI = {
+    'C': 60, 'C#': 61, 'Db': 61,
+    'D': 62, 'D#': 63, 'Eb': 63,
+    'E': 64,
+    'F': 65, 'F#': 66, 'Gb': 66,
+    'G': 67, 'G#': 68, 'Ab': 68,
+    'A': 69, 'A#': 70, 'Bb': 70,
+    'B': 71
+}
+
+# cmd -> (method, argument names); missing optional arguments use the method default
+COMMANDS = {
+    "set": ("set_slider", ("key", "value")),
+    "toggle": ("set_toggle", ("key", "state")),
+    "press": ("press", ("key",)),
+    "tone": ("set_tone", ("value",)),
+    "tone_step": ("step_tone", ("delta",)),
+    "genre": ("set_genre", ("genre", "duration")),
+    "apply": ("apply_state", ("state", "force", "duration")),
+    "ramp": ("ramp", ("targets", "duration", "curve")),
+    "stop_ramps": ("stop_ramps", ()),
+    "save": ("save", ()),
+    "detector": ("set_detector", ("running",)),
+    "meter": ("meter", ()),
+    "state": ("snapshot", ()),
+}
+# Commands that can block for seconds: run outside _batch()/_lock (they lock only around their state
+# update) and get the caller's source as an argument instead
+UNBATCHED_COMMANDS = {"detector"}
+# Argument types checked before a command runs (JSON from the API: "false" or true must not pass as a number/flag)
+FLAG_ARGUMENTS = {("toggle", "state"), ("apply", "force"), ("detector", "running")}   # true / false / null
+NUMBER_ARGUMENTS = {"value", "delta", "duration"}                                    # finite numbers
+NAME_ARGUMENTS = {"key", "genre", "curve"}                                           # strings
+
+
+def tone_to_cc(tone):
+    """Tone -12..12 -> CC 28 value 0..127 (0 -> 64)"""
+    return max(0, min(127, int(64 + tone * (63.5 / 12))))
+
+
+def cc_to_tone(value):
+    """CC 28 value -> nearest whole tone (inverse of tone_to_cc)"""
+    return float(max(-12, min(12, round((value - 64) / (63.5 / 12)))))
+
+
+def _env_flag(name):
+    return os.environ.get(name, "0") not in ("", "0")
+
+
+def _env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except ValueError:
+        print(f"[WARN] {name} must be a number")
+        return default
+
+
+def _is_unbatched(command):
+    return isinstance(command, dict) and command.get("cmd") in UNBATCHED_COMMANDS
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and math.isfinite(value)
+
+
+def _check_arguments(cmd, kwargs):
+    """Raise TypeError for an argument of the wrong JSON type (see FLAG_ARGUMENTS, NUMBER_ARGUMENTS)"""
+    for name, value in kwargs.items():
+        if (cmd, name) in FLAG_ARGUMENTS:
+            if value is not None and not isinstance(value, bool):
+                raise TypeError(f"{name} must be true, false or null, not {value!r}")
+        elif name in NUMBER_ARGUMENTS:
+            if not (_is_number(value) or (name == "duration" and value is None)):
+                raise TypeError(f"{name} must be a finite number, not {value!r}")
+        elif name in NAME_ARGUMENTS:
+            if not isinstance(value, str):
+                raise TypeError(f"{name} must be a string, not {value!r}")
+        elif name == "targets" and isinstance(value, dict):
+            for k, v in value.items():
+                if not _is_number(v):
+                    raise TypeError(f"targets.{k} must be a finite number, not {v!r}")
+
+
+def key_margin(snapshot):
+    """Share lead of the top tonic candidate over the runner-up (0 without a ranking)"""
+    ranking = snapshot.ranking
+    if not ranking:
+        return 0.0
+    return ranking[0][1] - (ranking[1][1] if len(ranking) > 1 else 0.0)
+
+
+class ControllerEngine:
+    def __init__(self, cc_rate=None, settings=None, preset_bank=None):
+        self.cc_rate = cc_rate
+        self.midi = None
+        self.settings = settings or SettingsStore()
+        self.preset_bank = preset_bank
+        self.state = {"sliders": dict(DEFAULT_SLIDERS), "toggles": {k: False for k in PRESET_TOGGLES},
+                      "tone": 0.0, "genre": GENRES[0]}
+        self.detected = None          # (key, scale) last sent to Auto-Tune
+        self.pitch_detector = None
+        self.detector_running = False
+        # Subsystem -> "loading" / "ready" / "unavailable" (status events on change)
+        self.status = {"midi": "loading", "detector": "loading" if PITCH_DETECTOR_AVAILABLE else "unavailable",
+                       "devices": "loading" if PITCH_DETECTOR_AVAILABLE else "unavailable"}
+        self._detector_ready = threading.Event()  # detector-init finished (ready or not)
+        self._listen_seconds = []                  # achieved DÒ TONE listen times (average in the log)
+        self._lock = threading.RLock()
+        self._detector_lock = threading.Lock()  # start/stop can take seconds (model load): not under _lock
+        self._depth = 0
+        self._source = None
+        self._changes = {}            # changes of the running batch, published when it ends
+        self._listeners = []
+        self._outbox = collections.deque()  # events published under _lock, delivered after it is released
+        self._deliver_lock = threading.Lock()
+
+    # --- lifecycle ---
+    def start(self):
+        """Open MIDI, load config.json + presets, recall the saved state, listen for Cubase feedback"""
+        with startup_trace.stage("engine: MIDI ports"):
+            self.midi = MidiHandler(self.cc_rate)
+        self._set_status("midi", "ready" if self.midi.is_connected else "unavailable")
+        with startup_trace.stage("engine: config + presets"):
+            if self.preset_bank is None:
+                self.preset_bank = PresetBank()
+            self.load()
+        self.midi.start_feedback(self._on_feedback)
+        if PITCH_DETECTOR_AVAILABLE:
+            threading.Thread(target=self._init_detector, name="detector-init", daemon=True).start()
+        else:
+            self._detector_ready.set()
+        return self
+
+    def _init_detector(self):
+        """detector-init thread: import and build the detector, then wait for the first device scan"""
+        try:
+            with startup_trace.stage("detector: import"):
+                from realtime_pitch_detector import RealtimePitchDetector
+                from device_registry import get_registry
+            # PortAudio is only rescanned (hotplug) while AUTO RT is not capturing
+            with startup_trace.stage("devices: start scan"):
+                registry = get_registry(can_reinitialize=lambda: not self.detector_running)
+            with startup_trace.stage("detector: init"):
+                self.pitch_detector = RealtimePitchDetector(
+                    midi_callback=self.on_pitch_detected,
+                    # Live melody note stream on MIDI channel 2 (--notes / CUBASE_NOTE_STREAM=1)
+                    note_callback=self._send_note_stream if _env_flag("CUBASE_NOTE_STREAM") else None,
+                    pitch_bend=_env_flag("CUBASE_NOTE_BEND"),
+                    tuning_callback=self.on_tuning_detected if _env_flag("CUBASE_FOLLOW_TUNING") else None,
+                    failure_callback=self._on_detector_failed
+                )
+        except Exception as e:  # ImportError, or OSError when PortAudio is missing
+            LOG.error("engine", "[ERROR] Realtime pitch detector not available: %s", e)
+            self._set_status("detector", "unavailable")
+            self._set_status("devices", "unavailable")
+            return
+        finally:
+            self._detector_ready.set()
+        self._set_status("detector", "ready")
+        with startup_trace.stage("devices: first scan"):
+            registry.devices()
+        self._set_status("devices", "ready")
+
+    def _set_status(self, subsystem, status):
+        with self._lock:
+            if self.status.get(subsystem) == status:
+                return
+            self.status[subsystem] = status
+            self._publish({"event": "status", "subsystem": subsystem, "status": status})
+        self._deliver()
+
+    def load(self):
+        try:
+            print("Đang tải cấu hình...")
+            data = self.settings.load()
+            if not data:
+                return
+            with self._batch("load"):
+                if data.get("genre") in GENRES:
+                    self._set("genre", data["genre"])
+                self.apply_state(data, force=True)
+        except Exception as e:
+            print(f"Lỗi load config: {e}")
+
+    def close(self):
+        """Stop the detector, deliver pending MIDI, write settings (call on exit)"""
+        if self.pitch_detector and self.detector_running:
+            LOG.info("engine", "Stopping pitch detector...")
+            self.pitch_detector.stop()
+            self.detector_running = False
+        if self.midi is not None:
+            self.midi.drain()
+            LOG.flush()
+            print(self.midi.format_cc_stats())
+        self.settings.close()
+
+    # --- events ---
+    def subscribe(self, callback):
+        """callback(event) for every state / key / detector event (called without the engine lock, from any thread)"""
+        self._listeners.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+
+    def _publish(self, event):
+        """Queue an event (called under _lock, so the order matches the state changes); _deliver() sends it"""
+        self._outbox.append(event)
+
+    def _deliver(self):
+        """Call the listeners for queued events, in order, never while holding _lock"""
+        if self._depth:
+            return  # inside a batch: the outermost batch delivers once the lock is released
+        while self._outbox and self._deliver_lock.acquire(blocking=False):
+            try:
+                while self._outbox:
+                    event = self._outbox.popleft()
+                    for callback in list(self._listeners):
+                        try:
+                            callback(event)
+                        except Exception as e:
+                            LOG.error("engine", "[ERROR] Event listener failed: %s", e)
+            finally:
+                self._deliver_lock.release()
+
+    @contextmanager
+    def _batch(self, source):
+        """One lock hold; the outermost batch publishes the collected changes as one event"""
+        try:
+            with self._lock:
+                if self._depth == 0:
+                    self._source = source
+                self._depth += 1
+                try:
+                    yield
+                finally:
+                    self._depth -= 1
+                    if self._depth == 0 and self._changes:
+                        changes, self._changes = self._changes, {}
+                        self._publish({"event": "state", "source": self._source, "changes": changes})
+        finally:
+            self._deliver()
+
+    def _set(self, path, value):
+        """Change one state value ("sliders/MUSIC_VOL", "tone", ...): record, autosave, collect the event"""
+        section, _, key = path.partition("/")
+        if key:
+            if self.state[section].get(key) == value:
+                return False
+            self.state[section][key] = value
+            self._changes.setdefault(section, {})[key] = value
+        else:
+            if self.state[section] == value:
+                return False
+            self.state[section] = value
+            self._changes[section] = value
+        self.settings.set(path, value)
+        if SESSION.enabled:
+            self._log_change(section, key, value)
+        return True
+
+    def _log_change(self, section, key, value):
+        """Session log record of one state change (REMIX has no CC: cc -1)"""
+        source = source_code(self._source)
+        if section == "genre":
+            SESSION.append(EVENT_GENRE, source, value=GENRES.index(value) if value in GENRES else -1)
+        elif section == "tone":
+            SESSION.append(EVENT_CONTROL, source, cc=CC_MAP["TONE_VAL_SEND"], value=value)
+        else:
+            SESSION.append(EVENT_CONTROL, source, cc=CC_MAP.get(key, -1), value=float(value))
+
+    # --- commands ---
+    def execute(self, commands, source="api"):
+        """
+        Run one command dict or a list of them as one batch (one state event).
+        Returns one {"ok": True, "result": ...} or {"ok": False, "error": ...} per command.
+        """
+        if isinstance(commands, dict):
+            commands = [commands]
+        results = []
+        for unbatched, group in itertools.groupby(commands, key=_is_unbatched):
+            if unbatched:
+                results.extend(self._execute_one(command, source=source) for command in group)
+            else:
+                with self._batch(source):
+                    results.extend(self._execute_one(command) for command in group)
+        return results
+
+    def _execute_one(self, command, **extra):
+        if not isinstance(command, dict):
+            return {"ok": False, "error": f"a command must be an object {{\"cmd\": ...}}, not {command!r}"}
+        try:
+            method, names = COMMANDS[command["cmd"]]
+            kwargs = {name: command[name] for name in names if name in command}
+            _check_arguments(command["cmd"], kwargs)
+            kwargs.update(extra)
+            return {"ok": True, "result": getattr(self, method)(**kwargs)}
+        except KeyError as e:
+            return {"ok": False, "error": f"unknown command or missing argument: {e}"}
+        except (TypeError, ValueError, RuntimeError) as e:
+            return {"ok": False, "error": str(e)}
+        except Exception as e:  # a bad argument must not end the client's session
+            LOG.error("engine", "[ERROR] Command %r failed: %s: %s", command, type(e).__name__, e)
+            return {"ok": False, "error": f"{type(e).__name__}: {e}"}
+
+    def set_slider(self, key, value):
+        if key not in SLIDERS:
+            raise ValueError(f"unknown slider: {key}")
+        value = max(0.0, min(127.0, float(value)))
+        with self._batch("local"):
+            self._set(f"sliders/{key}", value)
+            self.midi.send_cc(CC_MAP[key], value)
+        return value
+
+    def set_toggle(self, key, state=None):
+        """Switch a toggle (state None = flip); the Cubase button is pulsed on every change"""
+        if key not in PRESET_TOGGLES:
+            raise ValueError(f"unknown toggle: {key}")
+        with self._batch("local"):
+            state = (not self.state["toggles"][key]) if state is None else bool(state)
+            if self._set(f"toggles/{key}", state) and CC_MAP.get(key):
+                self.midi.pulse_cc(CC_MAP[key], 0.05)
+        return state
+
+    def press(self, key):
+        """Momentary button (FIX_MEO, ...)"""
+        if key not in BUTTONS:
+            raise ValueError(f"unknown button: {key}")
+        self.midi.pulse_cc(CC_MAP[key], BUTTONS[key])
+        return True
+
+    def set_tone(self, value):
+        tone = max(-12.0, min(12.0, float(value)))
+        with self._batch("local"):
+            self._set("tone", tone)
+            self.midi.send_cc(CC_MAP["TONE_VAL_SEND"], tone_to_cc(tone))
+        return tone
+
+    def step_tone(self, delta=1.0):
+        with self._batch("local"):
+            return self.set_tone(self.state["tone"] + float(delta))
+
+    def set_genre(self, genre, duration=None):
+        """
+        Select a genre and recall its active preset (only changed CCs are sent); returns CCs sent.
+        duration: morph the sliders there over this many seconds instead of jumping.
+        """
+        if genre not in GENRES:
+            raise ValueError(f"unknown genre: {genre}")
+        t0 = time.perf_counter()
+        with self._batch("local"):
+            self._set("genre", genre)
+            preset = self.preset_bank.get(genre)
+            if preset is None:
+                LOG.info("engine", "[PRESET] %s: chưa có preset, chỉnh xong nhấn LƯU để lưu", genre)
+                return 0
+            sent = self.apply_state(preset, duration=duration)
+        LOG.info("engine", "[PRESET] %s/%s: %d CC in %.1f ms", genre, self.preset_bank.active_name(genre), sent,
+                 (time.perf_counter() - t0) * 1000)
+        return sent
+
+    def apply_state(self, state, force=False, duration=None):
+        """
+        Move to state and send only what changed, as one MIDI burst.
+        force: send every slider/tone CC even if unchanged (startup, Cubase state unknown).
+        duration: ramp the sliders over this many seconds (toggles and tone still switch at once).
+        Returns the number of CC messages queued (ramping sliders not included).
+        """
+        if not isinstance(state, dict):
+            raise TypeError("state must be an object {\"sliders\": ..., \"toggles\": ..., \"tone\": ...}")
+        with self._batch("local"):
+            current = {"toggles": self.state["toggles"]} if force else self.state
+            changes = diff_states(current, state)
+            ccs = {}
+            sliders = {k: v for k, v in changes["sliders"].items() if k in SLIDERS}
+            if duration and not force:
+                if sliders:
+                    self.ramp(sliders, duration)
+            else:
+                for k, v in sliders.items():
+                    self._set(f"sliders/{k}", float(v))
+                    ccs[CC_MAP[k]] = v
+            pulses = []
+            for k, v in changes["toggles"].items():
+                if k in PRESET_TOGGLES and self._set(f"toggles/{k}", v) and CC_MAP.get(k):
+                    pulses.append(CC_MAP[k])
+            if changes["tone"] is not None:
+                self._set("tone", float(changes["tone"]))
+                ccs[CC_MAP["TONE_VAL_SEND"]] = tone_to_cc(changes["tone"])
+            return self.midi.send_burst(ccs, pulses, force=force)
+
+    def ramp(self, targets, duration=DEFAULT_RAMP_S, curve=DEFAULT_CURVE):
+        """
+        Scene transition: move sliders {key: target} over duration seconds along curve (cc_ramp.CURVES).
+        The state follows every ramp step; touching a ramping slider cancels its ramp.
+        """
+        if not isinstance(targets, dict):
+            raise TypeError("targets must be an object {slider: value}")
+        if curve not in CURVES:
+            raise ValueError(f"unknown curve: {curve}")
+        for k in targets:
+            if k not in SLIDERS:
+                raise ValueError(f"unknown slider: {k}")
+        with self._lock:
+            starts = {CC_MAP[k]: self.state["sliders"][k] for k in targets}
+        self.midi.ramp({CC_MAP[k]: float(v) for k, v in targets.items()}, float(duration), curve,
+                       starts=starts, on_step=self._on_ramp_step)
+        return float(duration)
+
+    def stop_ramps(self):
+        """Stop every running ramp where it is"""
+        self.midi.cancel_ramps()
+        return True
+
+    def _on_ramp_step(self, values):
+        """MIDI sender thread: ramp progress -> state (one event per step)"""
+        with self._batch("ramp"):
+            for cc, value in values.items():
+                self._set(f"sliders/{CC_KEYS[cc]}", round(value, 2))
+
+    def save(self):
+        """LƯU: snapshot config.json now and store the mix as the selected genre's preset"""
+        with self._lock:
+            state = self.preset_state()
+            genre = self.state["genre"]
+        self.settings.update(dict(state, genre=genre))
+        self.settings.save_now()
+        self.preset_bank.store(genre, state)
+        self.preset_bank.save(background=True)
+        LOG.info("engine", "[PRESET] Đã lưu preset %s/%s", genre, self.preset_bank.active_name(genre))
+        return True
+
+    def preset_state(self):
+        """Sliders, preset toggles and tone as a preset state dict"""
+        with self._lock:
+            return {"sliders": dict(self.state["sliders"]), "toggles": dict(self.state["toggles"]),
+                    "tone": self.state["tone"]}
+
+    def snapshot(self):
+        """The whole state (a copy), plus the detector status"""
+        with self._lock:
+            state = dict(self.preset_state(), genre=self.state["genre"])
+            state["status"] = dict(self.status)
+            state["detector"] = {"available": self.pitch_detector is not None, "running": self.detector_running,
+                                 "key": self.detected[0] if self.detected else None,
+                                 "scale": self.detected[1] if self.detected else None}
+            return state
+
+    # --- detector ---
+    def set_detector(self, running=None, source="local", error=None):
+        """
+        Start/stop realtime key detection (running None = flip); waits for detector-init.
+        error: why the detector stopped by itself (added to the "detector" event).
+        """
+        self._detector_ready.wait(DETECTOR_INIT_TIMEOUT_S)
+        if self.pitch_detector is None:
+            raise RuntimeError("Realtime Pitch Detector không khả dụng (pip install crepe tensorflow sounddevice)")
+        with self._detector_lock:
+            running = (not self.detector_running) if running is None else bool(running)
+            if running == self.detector_running:
+                return running
+            if running:
+                LOG.info("engine", "🎤 Starting realtime auto-tune detection...")
+                if self.pitch_detector.is_running:
+                    # Running for a DÒ TONE listen: keep it, detect afresh so the current key reaches Auto-Tune
+                    self.pitch_detector.enqueue_audio(self.pitch_detector.reset_history)
+                else:
+                    self.pitch_detector.start()
+                    if not self.pitch_detector.is_running:
+                        LOG.error("engine", "[ERROR] Realtime auto-tune not started (audio capture failed)")
+                        return False
+            else:
+                LOG.info("engine", "Stopping realtime auto-tune...")
+                self.pitch_detector.stop()
+            with self._lock:
+                self.detector_running = running
+                if not running:
+                    self.detected = None
+                event = {"event": "detector", "running": running}
+                if error:
+                    event["error"] = error
+                self._publish(event)
+            self._deliver()
+            SESSION.append(EVENT_DETECTOR, source_code(source), value=1.0 if running else 0.0)
+            self.midi.send_cc(CC_MAP["AUTO_TUNE_RT"], 127 if running else 0)
+        return running
+
+    def _on_detector_failed(self, reason):
+        """Detection thread: capture lost mid-run; switch AUTO RT off elsewhere (stop() joins this thread)"""
+        threading.Thread(target=self.set_detector, args=(False,), kwargs={"source": "detector", "error": reason},
+                         name="detector-failed", daemon=True).start()
+
+    def listen_for_key(self, max_s=None, min_s=None, margin=None, confidence=None):
+        """
+        DÒ TONE listen phase: run the detector on the selected audio until its key is
+        clear (margin and confidence over the thresholds, the same key for
+        AUTOKEY_STABLE_S, at least min_s), at most max_s. Blocks: call it from a worker
+        thread. Without AUTO RT the detector runs listen-only (no Auto-Tune notes).
+        Returns {"key", "scale", "seconds", "reason", "margin", "confidence"}.
+        """
+        max_s = _env_float("CUBASE_AUTOKEY_MAX_S", AUTOKEY_MAX_S) if max_s is None else max_s
+        min_s = _env_float("CUBASE_AUTOKEY_MIN_S", AUTOKEY_MIN_S) if min_s is None else min_s
+        margin = _env_float("CUBASE_AUTOKEY_MARGIN", AUTOKEY_MARGIN) if margin is None else margin
+        confidence = _env_float("CUBASE_AUTOKEY_CONFIDENCE", AUTOKEY_CONFIDENCE) if confidence is None else confidence
+        t0 = time.monotonic()
+        deadline = t0 + max_s
+        self._detector_ready.wait(max_s)
+        result = {"key": None, "scale": None, "seconds": 0.0, "reason": "timeout", "margin": 0.0, "confidence": 0.0}
+        detector = self.pitch_detector
+        if detector is None:
+            result["reason"] = "no_detector"
+            time.sleep(max(0.0, deadline - time.monotonic()))
+        else:
+            started = self._start_listening(detector)
+            start_ns = time.perf_counter_ns()  # snapshots from blocks captured after this use fresh history
+            try:
+                candidate, since = None, t0
+                while True:
+                    snap = detector.snapshot
+                    now = time.monotonic()
+                    if not detector.is_running:
+                        result["reason"] = "stopped"
+                        break
+                    if snap.key and snap.time_ns >= start_ns:
+                        if (snap.key, snap.scale) != candidate:
+                            candidate, since = (snap.key, snap.scale), now
+                        result.update(key=snap.key, scale=snap.scale, margin=key_margin(snap),
+                                      confidence=snap.confidence)
+                        if (now - t0 >= min_s and now - since >= AUTOKEY_STABLE_S
+                                and result["margin"] >= margin and snap.confidence >= confidence):
+                            result["reason"] = "confident"
+                            break
+                    if now >= deadline:
+                        break
+                    time.sleep(AUTOKEY_POLL_S)
+            finally:
+                if started:
+                    with self._detector_lock:
+                        if not self.detector_running:
+                            detector.stop()
+        result["seconds"] = time.monotonic() - t0
+        self._log_listen(result)
+        return result
+
+    def _start_listening(self, detector):
+        """Start the detector listen-only (no AUTO RT); True if this call started it"""
+        with self._detector_lock:
+            if detector.is_running:
+                detector.enqueue_audio(detector.reset_history)  # the key of this song, not the last one
+                return False
+            LOG.info("engine", "[AUTOKEY] Listening with the internal detector...")
+            detector.start()
+            return detector.is_running
+
+    def _log_listen(self, result):
+        AUTOKEY_LISTENS.labels(outcome=result["reason"]).inc()
+        AUTOKEY_LISTEN_SECONDS.add(result["seconds"])
+        self._listen_seconds.append(result["seconds"])
+        SESSION.append(EVENT_AUTOKEY, source_code("autokey"), key_code(result["key"]), scale_code(result["scale"]),
+                       result["confidence"], value=result["seconds"])
+        average = sum(self._listen_seconds) / len(self._listen_seconds)
+        LOG.info("engine", "[AUTOKEY] Listened %.1f s (%s): %s %s, margin %.2f, confidence %.0f%% "
+                 "(average %.1f s over %d song(s))", result["seconds"], result["reason"],
+                 result["key"] or "-", result["scale"] or "", result["margin"], result["confidence"] * 100,
+                 average, len(self._listen_seconds))
+
+    def detector_snapshot(self):
+        """Latest DetectorSnapshot of the running detector (lock-free), None without a detector"""
+        return self.pitch_detector.snapshot if self.pitch_detector is not None else None
+
+    def meter(self):
+        """The detector snapshot as a dict (control API)"""
+        snapshot = self.detector_snapshot()
+        return snapshot._asdict() if snapshot is not None else None
+
+    def switch_device(self, device_index, is_loopback):
+        """Switch the capture source in place (model, history and detected key are kept)"""
+        if self.pitch_detector is None:
+            return True
+        return self.pitch_detector.switch_device(device_index, is_loopback)
+
+    def on_pitch_detected(self, key, scale):
+        """Callback (detection thread): send the detected key/scale to Auto-Tune"""
+        SESSION.append(EVENT_KEY, source_code("detector" if self.detector_running else "autokey"),
+                       key_code(key), scale_code(scale), self.pitch_detector.key_confidence)
+        if not self.detector_running:
+            return  # DÒ TONE listen-only run: Auto-Key sends the key, the listen reads the snapshot
+        LOG.info("engine", "🎵 Detected: %s %s -> Sending to Auto-Tune...", key, scale)
+        midi_note = KEY_TO_MIDI.get(key)
+        if midi_note is None:
+            LOG.warn("engine", "⚠️ Unknown key: %s", key)
+            return
+        with self._lock:
+            self.detected = (key, scale)
+            self._publish({"event": "key", "key": key, "scale": scale})
+        self._deliver()
+        velocity = 127 if scale == 'major' else 64
+
+        # Note ON now, Note OFF 50 ms later (scheduled on the MIDI sender thread, never blocks detection)
+        if self.midi.is_connected:
+            self.midi.send_note(midi_note, velocity, 0.05, origin_ns=TRACER.origin())
+            LOG.info("engine", "✓ Sent MIDI: Note %d (%s), Velocity %d (%s)", midi_note, key, velocity, scale)
+        else:
+            MIDI_DROPPED.inc()
+
+    def on_tuning_detected(self, cents):
+        """Callback (detection thread) when the reference tuning estimate changes: drive TUNE (CC 27)"""
+        if not self.detector_running:
+            return
+        value = max(0, min(127, int(round(64 + cents * (63.5 / TUNE_CC_RANGE_CENTS)))))
+        LOG.info("engine", "🎚️ Tuning %+.0f cents -> TUNE %d", cents, value)
+        with self._batch("detector"):
+            self.set_slider("TUNE", value)
+
+    def _send_note_stream(self, message):
+        """Note stream callback (detection thread): only while AUTO RT is on, not during a DÒ TONE listen"""
+        if self.detector_running:
+            self.midi.send_message(message)
+
+    # --- Cubase feedback (MIDI sender thread) ---
+    def _on_feedback(self, batch):
+        """CC values changed in Cubase: update the state, never send MIDI back"""
+        applied = []
+        with self._batch("cubase"):
+            for cc, val in batch.items():
+                k = CC_KEYS.get(cc)
+                if k in SLIDERS:
+                    self._set(f"sliders/{k}", float(val))
+                elif k in PRESET_TOGGLES:
+                    self._set(f"toggles/{k}", val >= 64)
+                elif k == "TONE_VAL_SEND":
+                    self._set("tone", cc_to_tone(val))
+                else:
+                    continue
+                applied.append(f"{k}={val}")
+        if applied:
+            LOG.info("feedback", "[FEEDBACK] Cubase: %s", ", ".join(applied))
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import control_server
+    import metrics
+    import session_log
+
+    try:
+        sys.stdout.reconfigure(encoding='utf-8')
+    except Exception:
+        pass
+
+    parser = argparse.ArgumentParser(description="Headless controller: Cubase rig driven by the local control API")
+    parser.add_argument("--control", type=int, default=control_server.DEFAULT_PORT, metavar="PORT",
+                        help=f"control API port on 127.0.0.1 (default {control_server.DEFAULT_PORT})")
+    parser.add_argument("--metrics", nargs="?", type=int, const=metrics.DEFAULT_PORT, default=None,
+                        metavar="PORT", help="serve health metrics on http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--cc-rate", type=float, default=None, metavar="HZ",
+                        help="max CC messages per second per controller (0 = no limit)")
+    parser.add_argument("--session-log", nargs="?", const="sessions", default=None, metavar="DIR",
+                        help="write a session analytics file (keys, control changes) to DIR (default sessions)")
+    args = parser.parse_args()
+
+    if args.metrics:
+        metrics.start_metrics_server(args.metrics)
+    else:
+        metrics.start_from_env()
+    if args.session_log:
+        os.environ["CUBASE_SESSION_LOG"] = args.session_log
+    session_log.start_from_env()
+
+    engine = ControllerEngine(cc_rate=args.cc_rate).start()
+    if control_server.start_control_server(engine, args.control) is None:
+        engine.close()
+        sys.exit(1)
+    startup_trace.ready()  # the API answers from here on
+    print("Headless: Ctrl+C để thoát")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    engine.close()
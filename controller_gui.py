@@ -1,77 +1,64 @@
+import startup_trace  # first: times every import below (see startup_trace.py)
+startup_trace.begin()
 import customtkinter as ctk
-import rtmidi
 import threading
+import queue
 import time
 import os
-import json
 import ctypes
 import uuid
 import hashlib
 import datetime
 import tkinter.messagebox
 
-# Automation Libs
-try:
-    import pyautogui
-    import pygetwindow as gw
-except ImportError:
-    print("Warning: Automation libs not found. Auto-Key feature disabled.")
-
-# Realtime Pitch Detection
-try:
-    from realtime_pitch_detector import RealtimePitchDetector
-    PITCH_DETECTOR_AVAILABLE = True
-except ImportError:
-    print("Warning: Realtime pitch detector not available. Install: pip install crepe tensorflow sounddevice")
-    PITCH_DETECTOR_AVAILABLE = False
-
-MIDI_PORT_CHECK = "loopMIDI"
-CHANNEL = 0 
-
-CC_MAP = {
-    "MUSIC_VOL": 21, "MIC_VOL": 20, "REVERB_LONG": 22, "REVERB_SHORT": 23, "TUNE": 27,
-    "DELAY": 26,
-    "MUTE_MUSIC": 25, "MUTE_MIC": 24, "TONE_VAL_SEND": 28,  # Single CC for Value
-    "DO_TONE": 30, "LAY_TONE": 31, "VANG_FX": 32, "FIX_MEO": 36,
-    "AUTO_TUNE_RT": 37  # Realtime Auto-Tune Detection
-    # REMOVED: LOFI (33), REMIX (34), SAVE (35) - Internal Python Logic Only
-    # TONE_DOWN (29) removed, we only use CC 28 for value
-}
-
-class MidiHandler:
-    def __init__(self):
-        self.midiout = rtmidi.MidiOut()
-        self.port_name = None
-        self.is_connected = False
-        self.last_sent = {}
-        self.connect()
-
-    def connect(self):
-        ports = self.midiout.get_ports()
-        for i, name in enumerate(ports):
-            if MIDI_PORT_CHECK in name:
-                self.midiout.open_port(i)
-                self.port_name = name
-                self.is_connected = True
-                print(f"Connected to {name}")
-                return True
-        print(f"{MIDI_PORT_CHECK} not found!")
-        return False
-
-    def send_cc(self, cc, value):
-        if self.is_connected:
-            val = max(0, min(127, int(value)))
-            if self.last_sent.get(cc) == val:
-                return
-            self.last_sent[cc] = val
-            self.midiout.send_message([0xB0 | CHANNEL, cc, val])
-            print(f"MIDI Send: CC {cc} -> Value {val}")
+from app_log import LOG
+from latency_trace import TRACER
+import metrics
+import sampling_profiler
+import memory_report
+import control_server
+import session_log
+from controller_engine import ControllerEngine, CC_MAP, GENRES, PRESET_TOGGLES, BUTTONS
+
+# Automation libs (DÒ TONE): imported in the background once the window is up, see load_automation()
+pyautogui = None
+gw = None
+_automation_lock = threading.Lock()
+
+
+def load_automation():
+    """Import pyautogui / pygetwindow once (any thread); True when available"""
+    global pyautogui, gw
+    with _automation_lock:
+        if pyautogui is None:
+            try:
+                with startup_trace.stage("automation: import pyautogui"):
+                    import pyautogui as pyautogui_module
+                    import pygetwindow as gw_module
+            except Exception:  # ImportError, or no display / platform support
+                print("Warning: Automation libs not found. Auto-Key feature disabled.")
+                pyautogui = False
+                return False
+            pyautogui, gw = pyautogui_module, gw_module
+        return bool(pyautogui)
 
-midi = MidiHandler()
+# Startup status indicators: subsystem -> label; status -> (symbol, color)
+STATUS_LABELS = {"midi": "MIDI", "detector": "AUTO RT", "devices": "Audio", "automation": "DÒ TONE"}
+STATUS_STYLES = {"loading": ("⏳", "#fbc02d"), "ready": ("✓", "#4caf50"), "unavailable": ("✗", "#888888")}
+
+# Live meters: redrawn from the detector snapshot at a fixed frame rate, a
+# fixed set of canvas items per frame however fast the detector publishes
+METER_FPS = 30
+METER_W, METER_H = 180, 78
+METER_FLOOR_DB = -60.0
+NOTE_LABELS = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
 
 class App(ctk.CTk):
-    def __init__(self):
+    """Tk front end: one client of the ControllerEngine (commands in, state events out)"""
+
+    def __init__(self, engine):
         super().__init__()
+        self.engine = engine
         ctk.set_appearance_mode("Dark")
         self.col_bg = "#1a1a1a"
         self.col_btn_purple = "#6a4c9c"
@@ -149,7 +136,7 @@ class App(ctk.CTk):
     # --- MAIN APP LOGIC ---
     def init_main_app(self):
         self.title("BẢNG ĐIỀU KHIỂN TIẾNG VIỆT - Hậu Setup Live Studio")
-        self.geometry("850x350")
+        self.geometry("850x430")
         self.resizable(False, False)
         self.configure(fg_color=self.col_bg)
 
@@ -164,31 +151,47 @@ class App(ctk.CTk):
         self.slider_widgets = {}
         self.slider_labels = {}
         
-        # Realtime Pitch Detector
-        self.pitch_detector = None
-        self.is_auto_tune_running = False
+        # Genre change morphs the sliders over this many seconds (--morph, 0 = jump)
+        try:
+            self.morph_s = float(os.environ.get("CUBASE_MORPH_S", "0"))
+        except ValueError:
+            self.morph_s = 0.0
+        
+        # Audio source for AUTO RT (the detector itself lives in the engine)
         self.audio_device_index = None  # Will be set by user in settings
+        self.audio_device_uid = None  # Stable registry id of the selected device
         self.audio_device_name = "Default Device"  # Display name for current device
         self.is_loopback = False  # True if capturing from OUTPUT device
         
-        if PITCH_DETECTOR_AVAILABLE:
-            # Initially use default device (None)
-            # User can change via AUDIO button
-            self.pitch_detector = RealtimePitchDetector(
-                midi_callback=self.on_pitch_detected,
-                device_index=self.audio_device_index,
-                is_loopback=self.is_loopback
-            )
-        
-        # Detected key/scale display
+        # Detected key/scale display (from the detector snapshot, see draw_meters)
         self.detected_key = None
         self.detected_scale = None
+        self._meter_drawn = None
+        self._autokey_thread = None
+        self._devices_subscribed = False  # hotplug listener registered (once, on the first detector ready)
+        # UI calls from other threads, run by the meter tick: never call Tk (not even after()) off the Tk thread
+        self._tk_calls = queue.SimpleQueue()
 
-        self.setup_left_panel()
-        self.setup_center_panel()
-        self.setup_right_panel()
-        
-        self.load_settings()
+        with startup_trace.stage("gui: widgets"):
+            self.setup_left_panel()
+            self.setup_center_panel()
+            self.setup_right_panel()
+        
+        # Ctrl+M: print the memory report to the console
+        self.bind_all("<Control-m>", lambda e: print(memory_report.format_report()))
+        
+        # Every state change (GUI, control API, Cubase feedback, detector) comes back as an event
+        self.engine.subscribe(self.on_engine_event)
+        self.engine.start()
+        snapshot = self.engine.snapshot()
+        self.show_state(snapshot)
+        for subsystem, status in snapshot["status"].items():
+            self.show_status(subsystem, status)
+        control_server.start_from_env(self.engine)
+        self.after(1000 // METER_FPS, self.draw_meters)
+        
+        # Window up and idle: interactive. The automation libs load after that, off the Tk thread.
+        self.after_idle(self.on_interactive)
 
     def setup_left_panel(self):
         frame = ctk.CTkFrame(self, fg_color="transparent")
@@ -232,6 +235,27 @@ class App(ctk.CTk):
             c = i % 2
             btn.grid(row=r, column=c, padx=3, pady=4, sticky="ew")
 
+        # Startup status indicators (heavy subsystems load in the background)
+        self.status_labels = {}
+        for i, (subsystem, text) in enumerate(STATUS_LABELS.items()):
+            lbl = ctk.CTkLabel(frame, text="", font=("Arial", 9), anchor="w")
+            lbl.grid(row=len(btns) // 2 + i // 2, column=i % 2, padx=3, pady=(6 if i < 2 else 0, 0), sticky="w")
+            self.status_labels[subsystem] = lbl
+            self.show_status(subsystem, "loading")
+
+    def show_status(self, subsystem, status):
+        lbl = self.status_labels.get(subsystem)
+        if lbl is not None:
+            symbol, color = STATUS_STYLES.get(status, ("?", "#888888"))
+            lbl.configure(text=f"{symbol} {STATUS_LABELS[subsystem]}", text_color=color)
+
+    def on_interactive(self):
+        startup_trace.ready()
+        def preload():
+            ok = load_automation()
+            self.call_in_tk(self.show_status, "automation", "ready" if ok else "unavailable")
+        threading.Thread(target=preload, name="automation-init", daemon=True).start()
+
     def setup_center_panel(self):
         frame = ctk.CTkFrame(self, fg_color="transparent", border_width=1, border_color="#333")
         frame.grid(row=0, column=1, sticky="nsew", padx=2, pady=10)
@@ -264,8 +288,9 @@ class App(ctk.CTk):
         bottom_frame = ctk.CTkFrame(frame, fg_color="transparent")
         bottom_frame.grid(row=len(sliders), column=0, columnspan=3, pady=5)
         
-        opt = ctk.CTkOptionMenu(bottom_frame, values=["NHẠC TRẺ", "BOLERO", "REMIX"], fg_color="#1f77b4", height=24, font=("Arial", 11))
-        opt.pack(side="left", padx=5)
+        self.genre_menu = ctk.CTkOptionMenu(bottom_frame, values=GENRES, fg_color="#1f77b4", height=24, font=("Arial", 11),
+                                            command=self.on_genre_change)
+        self.genre_menu.pack(side="left", padx=5)
         
         btn_fix = ctk.CTkButton(bottom_frame, text="Fix Méo", fg_color="#d32f2f", width=60, height=24, font=("Arial", 11), command=lambda: self.on_btn_click("FIX_MEO"))
         btn_fix.pack(side="left", padx=5)
@@ -335,6 +360,8 @@ class App(ctk.CTk):
         )
         self.scale_display.pack(pady=(0, 2))
         
+        self.setup_meters(detect_frame)
+        
         # Audio device display
         self.audio_device_display = ctk.CTkLabel(
             detect_frame,
@@ -349,35 +376,103 @@ class App(ctk.CTk):
         ctk.CTkLabel(frame, text="BẢNG ĐIỀU KHIỂN TIẾNG VIỆT", font=("Arial", 11, "bold"), text_color=self.col_text_yellow).pack(side="bottom", pady=2)
         ctk.CTkLabel(frame, text="Hậu Setup Live Studio", font=("Arial", 10, "bold"), text_color=self.col_text_green).pack(side="bottom", pady=2)
 
+    def setup_meters(self, parent):
+        """Input meter, pitch needle and pitch-class histogram; items are created once, frames only move them"""
+        c = self.meter_canvas = ctk.CTkCanvas(parent, width=METER_W, height=METER_H, bg="#1a1a1a", highlightthickness=0)
+        c.pack(pady=(0, 2))
+        # Input level (dBFS)
+        c.create_rectangle(0, 2, METER_W, 8, fill="#2a2a2a", width=0)
+        self.meter_level = c.create_rectangle(0, 2, 0, 8, fill="#00e676", width=0)
+        # Pitch needle: +-50 cents around the nearest note
+        c.create_rectangle(0, 12, METER_W, 26, fill="#222", width=0)
+        c.create_line(METER_W / 2, 12, METER_W / 2, 26, fill="#555")
+        self.meter_needle = c.create_line(0, 12, 0, 26, fill="#fbc02d", width=2, state="hidden")
+        self.meter_note = c.create_text(3, 19, anchor="w", text="", fill="#ffffff", font=("Arial", 8, "bold"))
+        self.meter_cents = c.create_text(METER_W - 3, 19, anchor="e", text="", fill="#888888", font=("Arial", 8))
+        # 12-bin histogram (C..B)
+        bar_w = METER_W / 12
+        self.meter_bars = []
+        for i, name in enumerate(NOTE_LABELS):
+            x0, x1 = i * bar_w + 1, (i + 1) * bar_w - 1
+            self.meter_bars.append((c.create_rectangle(x0, 56, x1, 56, fill="#2196f3", width=0), x0, x1))
+            c.create_text((i + 0.5) * bar_w, 62, text=name, fill="#666", font=("Arial", 6))
+        # Key ranking and confidence
+        self.meter_ranking = c.create_text(METER_W / 2, 73, text="", fill="#888888", font=("Arial", 7))
+        self._meter_colors = {}
+
+    def _meter_fill(self, item, color):
+        if self._meter_colors.get(item) != color:
+            self._meter_colors[item] = color
+            self.meter_canvas.itemconfigure(item, fill=color)
+
+    def draw_meters(self):
+        """Tk frame tick: run the queued UI calls, redraw from the latest detector snapshot (skipped when unchanged)"""
+        self.after(1000 // METER_FPS, self.draw_meters)
+        self.run_tk_calls()
+        snap = self.engine.detector_snapshot()
+        if snap is None or snap is self._meter_drawn:
+            return
+        t0 = time.perf_counter_ns()
+        self._meter_drawn = snap
+        c = self.meter_canvas
+        
+        level = max(0.0, min(1.0, (snap.level_db - METER_FLOOR_DB) / -METER_FLOOR_DB))
+        c.coords(self.meter_level, 0, 2, level * METER_W, 8)
+        self._meter_fill(self.meter_level, "#d32f2f" if snap.level_db > -3 else "#fbc02d" if snap.level_db > -12 else "#00e676")
+        
+        if snap.pitch is not None:
+            note = int(round(snap.pitch))
+            cents = (snap.pitch - note) * 100
+            x = METER_W / 2 + cents / 50 * (METER_W / 2 - 2)
+            c.coords(self.meter_needle, x, 12, x, 26)
+            c.itemconfigure(self.meter_needle, state="normal")
+            c.itemconfigure(self.meter_note, text=f"{NOTE_LABELS[note % 12]}{note // 12 - 1}")
+            c.itemconfigure(self.meter_cents, text=f"{cents:+.0f}c")
+            self._meter_fill(self.meter_needle, "#00e676" if abs(cents) < 10 else "#fbc02d")
+        else:
+            c.itemconfigure(self.meter_needle, state="hidden")
+            c.itemconfigure(self.meter_note, text="")
+            c.itemconfigure(self.meter_cents, text="")
+        
+        top = max(snap.histogram) or 1.0
+        tonic = NOTE_LABELS.index(snap.key) if snap.key in NOTE_LABELS else None
+        for i, ((bar, x0, x1), share) in enumerate(zip(self.meter_bars, snap.histogram)):
+            c.coords(bar, x0, 56 - 28 * share / top, x1, 56)
+            self._meter_fill(bar, "#00e676" if i == tonic else "#2196f3")
+        
+        ranking = "  ".join(f"{k} {share:.0%}" for k, share in snap.ranking)
+        if snap.key:
+            ranking += f"  | {snap.confidence:.0%}"
+        c.itemconfigure(self.meter_ranking, text=ranking)
+        
+        if snap.key and (snap.key, snap.scale) != (self.detected_key, self.detected_scale):
+            self.detected_key, self.detected_scale = snap.key, snap.scale
+            self.update_key_display(snap.key, snap.scale)
+        TRACER.record('gui_meter_frame', time.perf_counter_ns() - t0)
+
     def adjust_color(self, hex_color, factor=0.8):
         return hex_color
 
     def on_btn_toggle(self, key):
-        cur_state = self.btn_states.get(key, False)
-        new_state = not cur_state
-        self.btn_states[key] = new_state
-        
+        if key in PRESET_TOGGLES:
+            self.engine.set_toggle(key)
+
+    def show_toggle(self, key, state):
+        """Show a toggle's state and colour (False if there is no such button)"""
+        self.btn_states[key] = state
         btn = self.btn_widgets.get(key)
-        orig_color = self.btn_colors.get(key)
-        
-        if btn:
-            if new_state: # ON
-                btn.configure(fg_color="#F0F0F0", text_color="#000000")
-            else: # OFF
-                btn.configure(fg_color=orig_color, text_color="#FFFFFF")
-                
-            cc = CC_MAP.get(key)
-            if cc:
-                midi.send_cc(cc, 127)
-                self.after(50, lambda: midi.send_cc(cc, 0))
+        if not btn:
+            return False
+        if state: # ON
+            btn.configure(fg_color="#F0F0F0", text_color="#000000")
+        else: # OFF
+            btn.configure(fg_color=self.btn_colors.get(key), text_color="#FFFFFF")
+        return True
 
     def on_btn_click(self, key):
         # Default behavior: Flash but NO MIDI for TONE_UP/TONE_DOWN here
-        if key not in ["TONE_UP", "TONE_DOWN"]:
-            cc = CC_MAP.get(key)
-            if cc:
-                midi.send_cc(cc, 127)
-                self.after(100, lambda: midi.send_cc(cc, 0))
+        if key in BUTTONS:
+            self.engine.press(key)
             
         btn = self.btn_widgets.get(key)
         if btn:
@@ -385,38 +480,21 @@ class App(ctk.CTk):
             btn.configure(fg_color="#ffffff", text_color="black")
             self.after(150, lambda: btn.configure(fg_color=orig, text_color="white"))
 
+        # Tone VALUE goes to CC 28 (the display follows the state event)
         if key == "TONE_UP":
-            try:
-                cur = float(self.tone_val.cget("text"))
-                new_val = min(12.0, cur + 1.0)
-                self.tone_val.configure(text=f"{new_val:.1f}")
-                
-                # Send VALUE to CC 28
-                # Map -12..12 -> 0..127
-                midi_val = int(64 + new_val * (63.5/12)) # 0 -> 64, 12 -> 127.5, -12 -> 0.5
-                midi_val = max(0, min(127, midi_val))
-                midi.send_cc(CC_MAP.get("TONE_VAL_SEND"), midi_val)
-            except: pass
+            self.engine.step_tone(1.0)
         elif key == "TONE_DOWN":
-            try:
-                cur = float(self.tone_val.cget("text"))
-                new_val = max(-12.0, cur - 1.0)
-                self.tone_val.configure(text=f"{new_val:.1f}")
-                
-                # Send VALUE to CC 28
-                midi_val = int(64 + new_val * (63.5/12))
-                midi_val = max(0, min(127, midi_val))
-                midi.send_cc(CC_MAP.get("TONE_VAL_SEND"), midi_val)
-            except: pass
+            self.engine.step_tone(-1.0)
 
     def on_slider_change(self, value, key):
-        cc = CC_MAP.get(key)
-        if cc:
-            midi.send_cc(cc, value)
-        
-        if key in self.slider_labels:
-            percent = int((value / 127) * 100)
-            self.slider_labels[key].configure(text=f"{percent}%")
+        self.engine.set_slider(key, value)
+
+    def set_tone_display(self, tone):
+        self.tone_val.configure(text=f"{tone:.1f}")
+
+    def on_genre_change(self, genre):
+        """Genre selector: recall the genre's active preset (only changed CCs are sent)"""
+        self.engine.set_genre(genre, duration=self.morph_s)
 
     def save_settings(self):
         # Trigger visual feedback (Flash) but NO MIDI
@@ -426,51 +504,85 @@ class App(ctk.CTk):
             btn.configure(fg_color="#ffffff", text_color="black")
             self.after(150, lambda: btn.configure(fg_color=orig, text_color="white"))
         
-        data = {
-            "toggles": self.btn_states,
-            "sliders": {k: v.get() for k, v in self.slider_widgets.items()}
-        }
-        try:
-            with open("config.json", "w", encoding='utf-8') as f:
-                json.dump(data, f, indent=4)
-            print("Đã lưu cấu hình vào config.json")
-        except Exception as e:
-            print(f"Lỗi lưu file: {e}")
+        # Changes are already autosaved; LƯU writes the snapshot now and stores the genre preset
+        self.engine.save()
 
-    def load_settings(self):
-        if not os.path.exists("config.json"): return
-        try:
-            print("Đang tải cấu hình...")
-            with open("config.json", "r", encoding='utf-8') as f:
-                data = json.load(f)
-            
-            sliders_data = data.get("sliders", {})
-            for k, v in sliders_data.items():
-                if k in self.slider_widgets:
-                    self.slider_widgets[k].set(v)
-                    self.on_slider_change(v, k)
-
-            toggles_data = data.get("toggles", {})
-            for k, v in toggles_data.items():
-                if k in self.btn_widgets and k not in ["DO_TONE", "SAVE"]:
-                    if self.btn_states.get(k, False) != v:
-                         self.on_btn_toggle(k)
-        except Exception as e:
-            print(f"Lỗi load config: {e}")
+    # --- engine events ---
+    def call_in_tk(self, fn, *args):
+        """fn(*args) on the Tk thread: at once there, otherwise queued for the next meter tick"""
+        if threading.current_thread() is threading.main_thread():
+            fn(*args)
+        else:
+            self._tk_calls.put((fn, args))
+
+    def run_tk_calls(self):
+        while True:
+            try:
+                fn, args = self._tk_calls.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                fn(*args)
+            except Exception as e:
+                print(f"[ERROR] UI update failed: {e}")
+
+    def on_engine_event(self, event):
+        """Engine listener (any thread, engine lock not held): apply on the Tk thread"""
+        if event["event"] == "key":
+            return  # drawn from the detector snapshot at the meter frame rate (draw_meters)
+        self.call_in_tk(self.apply_event, event)
+
+    def apply_event(self, event):
+        kind = event["event"]
+        if kind == "state":
+            self.show_state(event["changes"])
+        elif kind == "detector":
+            self.show_detector(event["running"])
+            if event.get("error"):
+                tkinter.messagebox.showwarning("AUTO RT", f"AUTO RT đã tắt: {event['error']}. Kiểm tra thiết bị audio rồi bật lại.")
+        elif kind == "status":
+            self.show_status(event["subsystem"], event["status"])
+            if event["subsystem"] == "detector" and event["status"] == "ready" and not self._devices_subscribed:
+                # Device list rescanned (hotplug): follow the selected device
+                self._devices_subscribed = True
+                from device_registry import get_registry
+                get_registry().subscribe(lambda devices: self.call_in_tk(self.on_audio_devices_changed))
+
+    def show_state(self, state):
+        """Move the widgets to a (partial) state; never sends MIDI"""
+        for k, v in state.get("sliders", {}).items():
+            slider = self.slider_widgets.get(k)
+            if slider is not None and slider.get() != v:
+                slider.set(v)
+            if k in self.slider_labels:
+                self.slider_labels[k].configure(text=f"{int((v / 127) * 100)}%")
+        for k, v in state.get("toggles", {}).items():
+            if self.btn_states.get(k) != v:
+                self.show_toggle(k, v)
+        if state.get("tone") is not None:
+            self.set_tone_display(state["tone"])
+        if state.get("genre") in GENRES and self.genre_menu.get() != state["genre"]:
+            self.genre_menu.set(state["genre"])
 
     def start_autokey(self):
+        if self._autokey_thread is not None and self._autokey_thread.is_alive():
+            return  # one DÒ TONE at a time
         print("Bắt đầu Dò Tone...")
         # Gửi CC ON (127)
         cc = CC_MAP.get("DO_TONE")
-        if cc: midi.send_cc(cc, 127)
+        if cc: self.engine.midi.send_cc(cc, 127)
         
         btn = self.btn_widgets.get("DO_TONE")
         if btn: btn.configure(text="ĐANG DÒ...", fg_color="#F0F0F0", text_color="black")
         
-        threading.Thread(target=self.auto_detect_tone_thread, daemon=True).start()
+        self._autokey_thread = threading.Thread(target=self.auto_detect_tone_thread, name="autokey", daemon=True)
+        self._autokey_thread.start()
 
     def auto_detect_tone_thread(self):
         try:
+            if not load_automation():  # normally preloaded after startup; waits if still importing
+                print("❌ Thiếu pyautogui / pygetwindow: pip install pyautogui pygetwindow")
+                return
             original_pos = pyautogui.position()
 
             print("[1/3] Focus Cubase...")
@@ -514,8 +626,10 @@ class App(ctk.CTk):
             print(f"Click Listen ({cx}, {cy})...")
             pyautogui.click(cx, cy)
             
-            print("Đang nghe (15s)...")
-            time.sleep(15)
+            # Listen until our detector hears a clear key (same audio as Auto-Key), not a fixed 15 s
+            print("Đang nghe (dừng khi đã rõ tone)...")
+            result = self.engine.listen_for_key()
+            print(f"Nghe {result['seconds']:.1f}s ({result['reason']}): {result['key'] or '?'} {result['scale'] or ''}")
 
             print(f"Click Send ({cx}, {sy})...")
             pyautogui.click(cx, sy)
@@ -527,15 +641,17 @@ class App(ctk.CTk):
             print(f"Lỗi: {e}")
         finally:
             cc = CC_MAP.get("DO_TONE")
-            if cc: midi.send_cc(cc, 0)
+            if cc: self.engine.midi.send_cc(cc, 0)
             
             btn = self.btn_widgets.get("DO_TONE")
             orig_col = self.btn_colors.get("DO_TONE", self.col_btn_purple)
-            if btn: btn.configure(text="DÒ TONE", fg_color=orig_col, text_color="white")
+            if btn: self.call_in_tk(lambda: btn.configure(text="DÒ TONE", fg_color=orig_col, text_color="white"))
     
     def show_audio_settings(self):
         """Show dialog to select audio input/output device"""
-        import sounddevice as sd
+        if not self.detector_loaded():
+            return
+        from device_registry import get_registry
         
         # Create popup window
         dialog = ctk.CTkToplevel(self)
@@ -579,33 +695,11 @@ class App(ctk.CTk):
             wraplength=650
         ).pack(pady=5)
         
-        # Get all devices
-        devices = sd.query_devices()
-        
-        # Separate INPUT and OUTPUT devices
-        input_devices = []
+        # Device lists come from the registry cache (scanned in the background at startup)
+        registry = get_registry()
+        input_devices = []   # (uid, is_loopback, name)
         output_devices = []
         
-        # Process devices
-        for i, device in enumerate(devices):
-            device_name = device['name']
-            
-            # INPUT devices
-            if device['max_input_channels'] > 0:
-                if i == sd.default.device[0]:
-                    device_name_input = device_name + " [MẶC ĐỊNH]"
-                else:
-                    device_name_input = device_name
-                input_devices.append((i, False, device_name_input))  # (index, is_loopback, name)
-            
-            # OUTPUT devices  
-            if device['max_output_channels'] > 0:
-                if i == sd.default.device[1]:
-                    device_name_output = device_name + " [MẶC ĐỊNH]"
-                else:
-                    device_name_output = device_name
-                output_devices.append((i, True, device_name_output))  # (index, is_loopback, name)
-        
         # Scrollable frame for devices
         scroll_frame = ctk.CTkScrollableFrame(
             dialog,
@@ -614,73 +708,113 @@ class App(ctk.CTk):
         )
         scroll_frame.pack(fill="both", expand=True, padx=10, pady=5)
         
-        # Variable to store selected device (value = (device_index, is_loopback))
-        # We use a string to encode both values: "index_loopback"
-        current_value = f"{self.audio_device_index if self.audio_device_index is not None else -1}_{1 if self.is_loopback else 0}"
+        # Variable to store selected device (value = (device uid, is_loopback))
+        # We use a string to encode both values: "uid|loopback"
+        current_value = f"{self.audio_device_uid or ''}|{1 if self.is_loopback else 0}"
         selected_device = ctk.StringVar(value=current_value)
         
-        # === OUTPUT DEVICES SECTION ===
-        output_label_frame = ctk.CTkFrame(scroll_frame, fg_color="#2a2a2a")
-        output_label_frame.pack(fill="x", padx=5, pady=5)
-        
-        ctk.CTkLabel(
-            output_label_frame,
-            text="🔊 OUTPUT DEVICES (Speakers/Headphones) - Để bắt nhạc từ Cubase/Browser",
-            font=("Arial", 11, "bold"),
-            text_color="#ff9800",
-            anchor="w"
-        ).pack(fill="x", padx=10, pady=5)
-        
-        for device_idx, is_loopback, device_name in output_devices:
-            radio_value = f"{device_idx}_1"  # is_loopback = True = 1
+        def populate(devices):
+            """(Re)build the device list from a registry snapshot"""
+            for child in scroll_frame.winfo_children():
+                child.destroy()
+            input_devices.clear()
+            output_devices.clear()
+            
+            if devices is None:
+                ctk.CTkLabel(
+                    scroll_frame,
+                    text="⏳ Đang quét thiết bị audio...",
+                    font=("Arial", 11),
+                    text_color="#fbc02d"
+                ).pack(pady=20)
+                return
             
-            radio_frame = ctk.CTkFrame(scroll_frame, fg_color="#1a1a1a", corner_radius=5)
-            radio_frame.pack(fill="x", padx=5, pady=2)
+            # Separate INPUT and OUTPUT devices
+            for device in devices:
+                if device.max_input_channels > 0:
+                    name = device.name + (" [MẶC ĐỊNH]" if device.is_default_input else "")
+                    input_devices.append((device.uid, False, name))
+                if device.max_output_channels > 0:
+                    name = device.name + (" [MẶC ĐỊNH]" if device.is_default_output else "")
+                    output_devices.append((device.uid, True, name))
             
-            radio = ctk.CTkRadioButton(
-                radio_frame,
-                text=f"🔊 {device_name}",
-                variable=selected_device,
-                value=radio_value,
-                font=("Arial", 10),
-                text_color="#ffffff",
-                fg_color="#ff9800",
-                hover_color="#ffb74d"
-            )
-            radio.pack(anchor="w", padx=10, pady=6)
-        
-        # Separator
-        ctk.CTkFrame(scroll_frame, height=2, fg_color="#444").pack(fill="x", padx=20, pady=10)
+            # === OUTPUT DEVICES SECTION ===
+            output_label_frame = ctk.CTkFrame(scroll_frame, fg_color="#2a2a2a")
+            output_label_frame.pack(fill="x", padx=5, pady=5)
+            
+            ctk.CTkLabel(
+                output_label_frame,
+                text="🔊 OUTPUT DEVICES (Speakers/Headphones) - Để bắt nhạc từ Cubase/Browser",
+                font=("Arial", 11, "bold"),
+                text_color="#ff9800",
+                anchor="w"
+            ).pack(fill="x", padx=10, pady=5)
+            
+            for device_uid, is_loopback, device_name in output_devices:
+                radio_value = f"{device_uid}|1"  # is_loopback = True = 1
+                
+                radio_frame = ctk.CTkFrame(scroll_frame, fg_color="#1a1a1a", corner_radius=5)
+                radio_frame.pack(fill="x", padx=5, pady=2)
+                
+                radio = ctk.CTkRadioButton(
+                    radio_frame,
+                    text=f"🔊 {device_name}",
+                    variable=selected_device,
+                    value=radio_value,
+                    font=("Arial", 10),
+                    text_color="#ffffff",
+                    fg_color="#ff9800",
+                    hover_color="#ffb74d"
+                )
+                radio.pack(anchor="w", padx=10, pady=6)
+            
+            # Separator
+            ctk.CTkFrame(scroll_frame, height=2, fg_color="#444").pack(fill="x", padx=20, pady=10)
+            
+            # === INPUT DEVICES SECTION ===
+            input_label_frame = ctk.CTkFrame(scroll_frame, fg_color="#2a2a2a")
+            input_label_frame.pack(fill="x", padx=5, pady=5)
+            
+            ctk.CTkLabel(
+                input_label_frame,
+                text="🎤 INPUT DEVICES (Microphone/Line In) - Để bắt giọng hát/nhạc cụ",
+                font=("Arial", 11, "bold"),
+                text_color="#2196f3",
+                anchor="w"
+            ).pack(fill="x", padx=10, pady=5)
+            
+            for device_uid, is_loopback, device_name in input_devices:
+                radio_value = f"{device_uid}|0"  # is_loopback = False = 0
+                
+                radio_frame = ctk.CTkFrame(scroll_frame, fg_color="#1a1a1a", corner_radius=5)
+                radio_frame.pack(fill="x", padx=5, pady=2)
+                
+                radio = ctk.CTkRadioButton(
+                    radio_frame,
+                    text=f"🎤 {device_name}",
+                    variable=selected_device,
+                    value=radio_value,
+                    font=("Arial", 10),
+                    text_color="#ffffff",
+                    fg_color="#2196f3",
+                    hover_color="#42a5f5"
+                )
+                radio.pack(anchor="w", padx=10, pady=6)
         
-        # === INPUT DEVICES SECTION ===
-        input_label_frame = ctk.CTkFrame(scroll_frame, fg_color="#2a2a2a")
-        input_label_frame.pack(fill="x", padx=5, pady=5)
+        # Rebuild whenever the registry publishes a new list (first scan, rescan, hotplug)
+        shown = [registry.snapshot()]
+        populate(shown[0])
         
-        ctk.CTkLabel(
-            input_label_frame,
-            text="🎤 INPUT DEVICES (Microphone/Line In) - Để bắt giọng hát/nhạc cụ",
-            font=("Arial", 11, "bold"),
-            text_color="#2196f3",
-            anchor="w"
-        ).pack(fill="x", padx=10, pady=5)
+        def watch_registry():
+            if not dialog.winfo_exists():
+                return
+            devices = registry.snapshot()
+            if devices is not shown[0]:
+                shown[0] = devices
+                populate(devices)
+            dialog.after(300, watch_registry)
         
-        for device_idx, is_loopback, device_name in input_devices:
-            radio_value = f"{device_idx}_0"  # is_loopback = False = 0
-            
-            radio_frame = ctk.CTkFrame(scroll_frame, fg_color="#1a1a1a", corner_radius=5)
-            radio_frame.pack(fill="x", padx=5, pady=2)
-            
-            radio = ctk.CTkRadioButton(
-                radio_frame,
-                text=f"🎤 {device_name}",
-                variable=selected_device,
-                value=radio_value,
-                font=("Arial", 10),
-                text_color="#ffffff",
-                fg_color="#2196f3",
-                hover_color="#42a5f5"
-            )
-            radio.pack(anchor="w", padx=10, pady=6)
+        dialog.after(300, watch_registry)
         
         # Button frame
         btn_frame = ctk.CTkFrame(dialog, fg_color="transparent")
@@ -690,51 +824,36 @@ class App(ctk.CTk):
             """Apply the selected device"""
             selected_value = selected_device.get()
             
-            # Parse "index_loopback"
-            parts = selected_value.split("_")
-            device_idx = int(parts[0])
-            is_loopback = bool(int(parts[1]))
-            
-            # Store device index
-            self.audio_device_index = None if device_idx == -1 else device_idx
-            self.is_loopback = is_loopback
-            
-            # Find device name
-            all_devices = output_devices if is_loopback else input_devices
-            for idx, loop, name in all_devices:
-                if idx == device_idx:
-                    self.audio_device_name = name.replace(" [MẶC ĐỊNH]", "")
-                    break
+            # Parse "uid|loopback" (the uid survives device reordering, the index is looked up now)
+            device_uid, _, loop_flag = selected_value.rpartition("|")
+            is_loopback = bool(int(loop_flag))
+            device = registry.by_uid(device_uid)
+            if device is None:
+                if device_uid:
+                    tkinter.messagebox.showerror("Lỗi", "Thiết bị không còn kết nối. Hãy chọn thiết bị khác.")
+                return
+            new_index = device.index
+            device_name = device.name
             
             # Add mode prefix
             mode_prefix = "[OUTPUT] " if is_loopback else "[INPUT] "
-            display_name = mode_prefix + self.audio_device_name
+            display_name = mode_prefix + device_name
             
-            # If auto-tune is running, restart with new device
-            if self.is_auto_tune_running and PITCH_DETECTOR_AVAILABLE:
-                print(f"🔄 Đang chuyển sang: {display_name}")
-                
-                # Stop current detector
-                self.pitch_detector.stop()
-                
-                # Create new detector with selected device
-                self.pitch_detector = RealtimePitchDetector(
-                    midi_callback=self.on_pitch_detected,
-                    device_index=self.audio_device_index,
-                    is_loopback=self.is_loopback
-                )
-                
-                # Start new detector
-                self.pitch_detector.start()
-                print(f"✅ Đã chuyển sang: {display_name}")
-            else:
-                # Just update the detector instance for next time
-                if PITCH_DETECTOR_AVAILABLE:
-                    self.pitch_detector = RealtimePitchDetector(
-                        midi_callback=self.on_pitch_detected,
-                        device_index=self.audio_device_index,
-                        is_loopback=self.is_loopback
-                    )
+            # Switch the capture source in place (model, history and detected key are kept)
+            if self.engine.pitch_detector:
+                if self.engine.detector_running:
+                    print(f"🔄 Đang chuyển sang: {display_name}")
+                if not self.engine.switch_device(new_index, is_loopback):
+                    tkinter.messagebox.showerror("Lỗi", f"Không mở được thiết bị: {display_name}\nĐã giữ thiết bị cũ.")
+                    return
+                if self.engine.detector_running:
+                    print(f"✅ Đã chuyển sang: {display_name}")
+            
+            # Store device index
+            self.audio_device_index = new_index
+            self.audio_device_uid = device_uid
+            self.is_loopback = is_loopback
+            self.audio_device_name = device_name
             
             # Update audio device display label
             if hasattr(self, 'audio_device_display'):
@@ -763,6 +882,17 @@ class App(ctk.CTk):
             command=apply_selection
         ).pack(side="left", padx=5)
         
+        ctk.CTkButton(
+            btn_frame,
+            text="⟳ QUÉT LẠI",
+            fg_color="#2196f3",
+            hover_color="#42a5f5",
+            font=("Arial", 13, "bold"),
+            height=38,
+            width=120,
+            command=lambda: registry.refresh(reinitialize=True)
+        ).pack(side="left", padx=5)
+        
         ctk.CTkButton(
             btn_frame,
             text="✕ HỦY",
@@ -774,114 +904,61 @@ class App(ctk.CTk):
             command=dialog.destroy
         ).pack(side="right", padx=5)
     
+    def on_audio_devices_changed(self):
+        """Device list rescanned: indices may have moved, follow the selected device by uid"""
+        if not self.audio_device_uid or not self.engine.pitch_detector:
+            return
+        from device_registry import get_registry
+        device = get_registry().by_uid(self.audio_device_uid)
+        if device is None:
+            print(f"[WARN] Thiết bị audio đã ngắt kết nối: {self.audio_device_name}")
+        elif device.index != self.audio_device_index:
+            self.audio_device_index = device.index
+            if not self.engine.detector_running:
+                self.engine.switch_device(device.index, self.is_loopback)
+    
     def toggle_auto_tune_rt(self):
         """Toggle realtime auto-tune detection"""
-        if not PITCH_DETECTOR_AVAILABLE or not self.pitch_detector:
+        if not self.detector_loaded():
+            return
+        self.engine.set_detector(not self.engine.detector_running)
+    
+    def detector_loaded(self):
+        """True once the detector is built; otherwise tell the user why not (still loading / not installed)"""
+        status = self.engine.status["detector"]
+        if status == "loading":
+            tkinter.messagebox.showinfo("Đang tải", "Realtime Pitch Detector đang khởi động, thử lại sau vài giây.")
+            return False
+        if status != "ready" or not self.engine.pitch_detector:
             tkinter.messagebox.showerror(
                 "Lỗi", 
                 "Realtime Pitch Detector không khả dụng!\n\n"
                 "Cài đặt: pip install crepe tensorflow sounddevice"
             )
-            return
-        
-        if self.is_auto_tune_running:
-            # Stop detection
-            print("Stopping realtime auto-tune...")
-            self.pitch_detector.stop()
-            self.is_auto_tune_running = False
-            
-            # Update button
-            btn = self.btn_widgets.get("AUTO_TUNE_RT")
-            if btn:
-                btn.configure(
-                    text="AUTO RT", 
-                    fg_color=self.col_btn_purple, 
-                    text_color="white"
-                )
-            
-            # Reset display
-            if hasattr(self, 'key_display') and hasattr(self, 'scale_display'):
-                self.key_display.configure(text="---", text_color="#888888")
-                self.scale_display.configure(text="Waiting...", text_color="#888888")
-            
-            # Send MIDI OFF
-            cc = CC_MAP.get("AUTO_TUNE_RT")
-            if cc:
-                midi.send_cc(cc, 0)
-        else:
-            # Start detection
-            print("🎤 Starting realtime auto-tune detection...")
-            self.pitch_detector.start()
-            self.is_auto_tune_running = True
-            
-            # Update button
-            btn = self.btn_widgets.get("AUTO_TUNE_RT")
+            return False
+        return True
+    
+    def show_detector(self, running):
+        """AUTO RT button (and key display reset) for the detector state"""
+        btn = self.btn_widgets.get("AUTO_TUNE_RT")
+        if running:
             if btn:
                 btn.configure(
                     text="ĐANG DÒ RT", 
                     fg_color="#00e676", 
                     text_color="black"
                 )
-            
-            # Send MIDI ON
-            cc = CC_MAP.get("AUTO_TUNE_RT")
-            if cc:
-                midi.send_cc(cc, 127)
-    
-    def on_pitch_detected(self, key, scale):
-        """
-        Callback when pitch detector detects a key/scale
-        Sends MIDI to Auto-Tune plugin
-        
-        Args:
-            key: Musical key (e.g., 'C', 'D#', 'A')
-            scale: Scale type ('major' or 'minor')
-        """
-        print(f"🎵 Detected: {key} {scale} -> Sending to Auto-Tune...")
-        
-        # Update GUI display (thread-safe)
-        self.detected_key = key
-        self.detected_scale = scale
-        
-        # Update labels (use after() for thread-safety)
-        self.after(0, self.update_key_display, key, scale)
-        
-        # Auto-Tune accepts MIDI notes to set the key
-        # We'll send MIDI note-on messages
-        # MIDI Note format: C4 = 60, C#4 = 61, etc.
-        
-        # Map key to MIDI note (using octave 4 as reference)
-        key_to_midi = {
-            'C': 60, 'C#': 61, 'Db': 61,
-            'D': 62, 'D#': 63, 'Eb': 63,
-            'E': 64, 
-            'F': 65, 'F#': 66, 'Gb': 66,
-            'G': 67, 'G#': 68, 'Ab': 68,
-            'A': 69, 'A#': 70, 'Bb': 70,
-            'B': 71
-        }
-        
-        midi_note = key_to_midi.get(key)
-        if midi_note is None:
-            print(f"⚠️ Unknown key: {key}")
             return
-        
-        # For Auto-Tune, we can:
-        # 1. Send MIDI note to set the key
-        # 2. Use velocity to indicate major (127) vs minor (64)
-        velocity = 127 if scale == 'major' else 64
-        
-        # Send Note ON
-        try:
-            if midi.is_connected:
-                # Note ON: 0x90 | channel, note, velocity
-                midi.midiout.send_message([0x90 | CHANNEL, midi_note, velocity])
-                time.sleep(0.05)  # Short delay
-                # Note OFF: 0x80 | channel, note, 0
-                midi.midiout.send_message([0x80 | CHANNEL, midi_note, 0])
-                print(f"✓ Sent MIDI: Note {midi_note} ({key}), Velocity {velocity} ({scale})")
-        except Exception as e:
-            print(f"❌ MIDI send error: {e}")
+        if btn:
+            btn.configure(
+                text="AUTO RT", 
+                fg_color=self.col_btn_purple, 
+                text_color="white"
+            )
+        self.detected_key = self.detected_scale = None
+        if hasattr(self, 'key_display') and hasattr(self, 'scale_display'):
+            self.key_display.configure(text="---", text_color="#888888")
+            self.scale_display.configure(text="Waiting...", text_color="#888888")
     
     def update_key_display(self, key, scale):
         """
@@ -908,15 +985,76 @@ class App(ctk.CTk):
             self.after(100, lambda: self.key_display.configure(text_color="#ffffff"))
 
     def on_closing(self):
-        # Stop pitch detector if running
-        if hasattr(self, 'pitch_detector') and self.pitch_detector and self.is_auto_tune_running:
-            print("Stopping pitch detector...")
-            self.pitch_detector.stop()
+        # Stop the detector, deliver pending MIDI, write settings
+        self.engine.close()
+        
+        if TRACER.summary():
+            print("\n=== Latency trace ===\n" + TRACER.format_summary())
         
+        # os._exit below skips atexit, so dump the profile here
+        profiler = sampling_profiler.get_profiler()
+        if profiler:
+            profiler.stop()
+        
+        # os._exit skips atexit: write the queued log records now, compact the session file
+        LOG.close()
+        session_log.SESSION.close()
         self.destroy()
         os._exit(0)
 
 if __name__ == "__main__":
-    app = App()
+    import argparse
+    parser = argparse.ArgumentParser(description="Bảng điều khiển Cubase - Hậu Setup Live Studio")
+    parser.add_argument("--metrics", nargs="?", type=int, const=metrics.DEFAULT_PORT, default=None,
+                        metavar="PORT", help="serve health metrics on http://127.0.0.1:PORT/metrics")
+    parser.add_argument("--profile", nargs="?", type=float, const=sampling_profiler.DEFAULT_HZ, default=None,
+                        metavar="HZ", help="sample all thread stacks, dump collapsed stacks to profiles/")
+    parser.add_argument("--notes", action="store_true",
+                        help="AUTO RT also streams the sung melody as MIDI notes (channel 2)")
+    parser.add_argument("--pitch-bend", action="store_true", help="add pitch bend to the --notes stream")
+    parser.add_argument("--follow-tuning", action="store_true",
+                        help="AUTO RT drives the TUNE knob (CC 27) from the detected A4 reference tuning")
+    parser.add_argument("--cc-rate", type=float, default=None, metavar="HZ",
+                        help="max CC messages per second per controller while dragging (0 = no limit)")
+    parser.add_argument("--morph", type=float, default=None, metavar="SECONDS",
+                        help="genre change morphs the sliders to the preset over SECONDS (default: jump)")
+    parser.add_argument("--control", nargs="?", type=int, const=control_server.DEFAULT_PORT, default=None,
+                        metavar="PORT", help="control API (JSON lines) on 127.0.0.1:PORT for scripts / phone")
+    parser.add_argument("--lean", action="store_true",
+                        help="lean memory mode: smallest pitch backend, capped audio queue, model freed on stop")
+    parser.add_argument("--session-log", nargs="?", const="sessions", default=None, metavar="DIR",
+                        help="write a session analytics file (keys, control changes) to DIR (default sessions)")
+    args = parser.parse_args()
+    
+    if args.lean:
+        os.environ["CUBASE_LEAN"] = "1"
+    if args.notes:
+        os.environ["CUBASE_NOTE_STREAM"] = "1"
+    if args.pitch_bend:
+        os.environ["CUBASE_NOTE_BEND"] = "1"
+    if args.follow_tuning:
+        os.environ["CUBASE_FOLLOW_TUNING"] = "1"
+    memory_report.start_from_env()
+    
+    if args.profile:
+        sampling_profiler.install(args.profile)
+    else:
+        sampling_profiler.start_from_env()
+    
+    if args.metrics:
+        metrics.start_metrics_server(args.metrics)
+    else:
+        metrics.start_from_env()
+    
+    if args.morph is not None:
+        os.environ["CUBASE_MORPH_S"] = str(args.morph)
+    if args.control:
+        os.environ["CUBASE_CONTROL_PORT"] = str(args.control)
+    if args.session_log:
+        os.environ["CUBASE_SESSION_LOG"] = args.session_log
+    session_log.start_from_env()
+    
+    # The engine opens MIDI when the main window starts (after the license check)
+    app = App(ControllerEngine(cc_rate=args.cc_rate))
     app.protocol("WM_DELETE_WINDOW", app.on_closing)
     app.mainloop()
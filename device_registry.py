@@ -0,0 +1,241 @@
+"""
+Audio Device Registry
+Enumerates audio devices once, in the background, and caches the result for
+the GUI, the detector and the command line tools.
+
+- Stable identities: every device gets a uid ("<host API>:<name>[#n]") that
+  survives index reordering after a hotplug or a PortAudio rescan.
+- Loopback mapping: output devices are matched to soundcard speakers by
+  name, so loopback capture can use the selected output instead of the
+  default speaker.
+- Hotplug: when soundcard is installed a watcher thread polls its (cheap,
+  always fresh) device list and re-enumerates when it changes. PortAudio
+  only sees new devices after a re-initialisation, which is done only while
+  no stream is open (can_reinitialize callback).
+
+Usage:
+    from device_registry import get_registry
+    registry = get_registry()          # starts enumerating in the background
+    devices = registry.snapshot()      # cached list, or None while the first scan runs
+    devices = registry.devices()       # same, but waits for the first scan
+"""
+
+import importlib.util
+import threading
+import time
+from collections import namedtuple
+
+import sounddevice as sd
+
+# soundcard (loopback capture) is optional and imported on first use, off the Tk thread
+SOUNDCARD_AVAILABLE = importlib.util.find_spec('soundcard') is not None
+
+HOTPLUG_POLL_S = 3.0
+
+# PortAudio is terminated/re-initialised on rescan: streams must not be opened meanwhile
+PORTAUDIO_LOCK = threading.Lock()
+
+AudioDevice = namedtuple('AudioDevice', [
+    'uid', 'index', 'name', 'hostapi', 'max_input_channels', 'max_output_channels',
+    'default_samplerate', 'is_default_input', 'is_default_output', 'loopback_id',
+])
+
+
+def _normalize(name):
+    return " ".join(name.lower().replace("(", " ").replace(")", " ").split())
+
+
+def match_speaker(device_name, speakers):
+    """soundcard speaker id for a sounddevice output name (MME truncates names to 31 chars)"""
+    wanted = _normalize(device_name)
+    for speaker in speakers:
+        if _normalize(speaker.name) == wanted:
+            return speaker.id
+    for speaker in speakers:
+        name = _normalize(speaker.name)
+        if name.startswith(wanted) or wanted.startswith(name):
+            return speaker.id
+    return None
+
+
+def enumerate_devices(reinitialize=False):
+    """Query PortAudio (optionally after a rescan) and build the device list"""
+    with PORTAUDIO_LOCK:
+        if reinitialize and hasattr(sd, '_terminate'):
+            sd._terminate()
+            sd._initialize()
+        raw = sd.query_devices()
+        hostapis = sd.query_hostapis()
+        default_in, default_out = sd.default.device
+
+    speakers = []
+    if SOUNDCARD_AVAILABLE:
+        try:
+            import soundcard
+            speakers = soundcard.all_speakers()
+        except Exception as e:
+            print(f"[WARN] soundcard speaker list failed: {e}")
+
+    devices = []
+    seen = {}
+    for index, info in enumerate(raw):
+        hostapi = hostapis[info['hostapi']]['name'] if info['hostapi'] < len(hostapis) else "?"
+        uid = f"{hostapi}:{info['name']}"
+        seen[uid] = seen.get(uid, 0) + 1
+        if seen[uid] > 1:
+            uid = f"{uid}#{seen[uid]}"
+        loopback_id = None
+        if info['max_output_channels'] > 0 and speakers:
+            loopback_id = match_speaker(info['name'], speakers)
+        devices.append(AudioDevice(
+            uid=uid,
+            index=index,
+            name=info['name'],
+            hostapi=hostapi,
+            max_input_channels=info['max_input_channels'],
+            max_output_channels=info['max_output_channels'],
+            default_samplerate=info['default_samplerate'],
+            is_default_input=index == default_in,
+            is_default_output=index == default_out,
+            loopback_id=loopback_id,
+        ))
+    return devices
+
+
+def _hotplug_fingerprint():
+    """Cheap, always-fresh device list from soundcard (None when unavailable)"""
+    try:
+        import soundcard
+        return (tuple(sorted(s.id for s in soundcard.all_speakers())),
+                tuple(sorted(m.id for m in soundcard.all_microphones(include_loopback=False))))
+    except Exception:
+        return None
+
+
+class DeviceRegistry:
+    """Background-enumerated, cached audio device list"""
+
+    def __init__(self, can_reinitialize=None, poll_interval=HOTPLUG_POLL_S):
+        self.can_reinitialize = can_reinitialize or (lambda: False)
+        self.poll_interval = poll_interval
+        self._devices = None
+        self._ready = threading.Event()
+        self._lock = threading.Lock()
+        self._scan_thread = None
+        self._rescan_pending = None  # None, or the reinitialize flag of a queued rescan
+        self._listeners = []
+        self._watch_thread = None
+        self._watch_stop = threading.Event()
+        self.last_scan_ms = None
+
+    # --- scanning ---
+    def refresh(self, reinitialize=False):
+        """Re-enumerate in the background (reinitialize: rescan PortAudio if allowed)"""
+        with self._lock:
+            if self._scan_thread and self._scan_thread.is_alive():
+                self._rescan_pending = bool(self._rescan_pending) or reinitialize  # one more scan after this one
+                return
+            self._scan_thread = threading.Thread(target=self._scan, args=(reinitialize,),
+                                                 name="device-scan", daemon=True)
+            self._scan_thread.start()
+
+    def _scan(self, reinitialize):
+        while True:
+            t0 = time.perf_counter()
+            try:
+                devices = enumerate_devices(reinitialize and self.can_reinitialize())
+            except Exception as e:
+                print(f"[ERROR] Audio device scan failed: {e}")
+                devices = self._devices or []
+            self.last_scan_ms = (time.perf_counter() - t0) * 1000
+            changed = devices != self._devices
+            self._devices = devices
+            self._ready.set()
+            if changed:
+                for callback in list(self._listeners):
+                    try:
+                        callback(devices)
+                    except Exception as e:
+                        print(f"[WARN] Device listener failed: {e}")
+            with self._lock:
+                if self._rescan_pending is None:
+                    return
+                reinitialize, self._rescan_pending = self._rescan_pending, None
+
+    def start(self):
+        """First scan plus the hotplug watcher (idempotent)"""
+        if self._devices is None and not (self._scan_thread and self._scan_thread.is_alive()):
+            self.refresh()
+        if SOUNDCARD_AVAILABLE and self.poll_interval and not (self._watch_thread and self._watch_thread.is_alive()):
+            self._watch_stop.clear()
+            self._watch_thread = threading.Thread(target=self._watch, name="device-hotplug", daemon=True)
+            self._watch_thread.start()
+        return self
+
+    def _watch(self):
+        last = _hotplug_fingerprint()
+        while not self._watch_stop.wait(self.poll_interval):
+            current = _hotplug_fingerprint()
+            if current is not None and current != last:
+                last = current
+                print("[DEVICE] Audio devices changed, rescanning...")
+                self.refresh(reinitialize=True)
+
+    def stop(self):
+        self._watch_stop.set()
+
+    def is_scanning(self):
+        return bool(self._scan_thread and self._scan_thread.is_alive())
+
+    def subscribe(self, callback):
+        """callback(devices) after every scan that changed the list (runs on the scan thread)"""
+        self._listeners.append(callback)
+
+    # --- queries ---
+    def snapshot(self):
+        """Cached device list, or None while the first scan is still running (never blocks)"""
+        return self._devices
+
+    def devices(self, timeout=None):
+        """Device list, waiting for the first scan if needed"""
+        if self._devices is None:
+            self.start()
+            self._ready.wait(timeout)
+        return self._devices or []
+
+    def inputs(self, timeout=None):
+        return [d for d in self.devices(timeout) if d.max_input_channels > 0]
+
+    def outputs(self, timeout=None):
+        return [d for d in self.devices(timeout) if d.max_output_channels > 0]
+
+    def by_uid(self, uid):
+        return next((d for d in self._devices or [] if d.uid == uid), None)
+
+    def by_index(self, index):
+        return next((d for d in self._devices or [] if d.index == index), None)
+
+    def loopback_speaker(self, device_index=None):
+        """soundcard speaker for an output device index (default speaker if unmapped)"""
+        import soundcard
+        device = self.by_index(device_index) if device_index is not None else None
+        if device is not None and device.loopback_id is not None:
+            try:
+                return soundcard.get_speaker(device.loopback_id)
+            except Exception as e:
+                print(f"[WARN] Loopback speaker for '{device.name}' not found ({e}), using default")
+        return soundcard.default_speaker()
+
+
+_registry = None
+
+
+def get_registry(can_reinitialize=None):
+    """Global registry, started on first use"""
+    global _registry
+    if _registry is None:
+        _registry = DeviceRegistry(can_reinitialize)
+        _registry.start()
+    elif can_reinitialize is not None:
+        _registry.can_reinitialize = can_reinitialize
+    return _registry
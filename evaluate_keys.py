@@ -0,0 +1,224 @@
+"""
+Key Detection Evaluation Harness
+Streams the labeled synthetic corpus (key_corpus.py) through
+RealtimePitchDetector configurations and reports, per configuration:
+key accuracy, time to first correct key, wrong MIDI sends and CPU seconds.
+The accuracy/CPU Pareto front tells which backend, window and threshold
+settings are worth shipping.
+
+Usage:
+    python evaluate_keys.py                          # default grid, all conditions
+    python evaluate_keys.py --quick                  # short items, 2 conditions
+    python evaluate_keys.py --configs aubio          # only configs whose name contains 'aubio'
+    python evaluate_keys.py --plot pareto.png        # also draw the Pareto front (needs matplotlib)
+"""
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+# Fix Windows console encoding
+try:
+    sys.stdout.reconfigure(encoding='utf-8')
+except:
+    pass
+
+import realtime_pitch_detector as rpd
+from realtime_pitch_detector import RealtimePitchDetector
+from key_corpus import CONDITIONS, generate_corpus
+
+RESULTS_DIR = "eval_results"
+
+
+def default_configs():
+    """Grid of detector settings to compare (only for installed backends)"""
+    configs = []
+    if rpd.AUBIO_AVAILABLE:
+        for buffer_size in (1024, 2048):
+            for window in (3.0, 5.0, 8.0):
+                configs.append({
+                    'name': f"aubio_buf{buffer_size}_win{window:g}",
+                    'backend': 'aubio', 'buffer_size': buffer_size, 'analysis_window': window,
+                })
+    if rpd.CREPE_AVAILABLE:
+        for capacity in ('tiny', 'small'):
+            for step in (50, 100):
+                for window in (3.0, 5.0):
+                    for threshold in (0.3, 0.5, 0.7):
+                        configs.append({
+                            'name': f"crepe_{capacity}_step{step}_win{window:g}_thr{threshold:g}",
+                            'backend': 'crepe', 'model_capacity': capacity, 'step_size': step,
+                            'analysis_window': window, 'confidence_threshold': threshold,
+                        })
+    return configs
+
+
+def build_detector(config, on_detect):
+    detector = RealtimePitchDetector(midi_callback=on_detect, backend=config['backend'])
+    for attr in ('model_capacity', 'step_size', 'analysis_window', 'confidence_threshold'):
+        if attr in config:
+            setattr(detector, attr, config[attr])
+    if config['backend'] == 'aubio' and config.get('buffer_size', detector.buffer_size) != detector.buffer_size:
+        detector.buffer_size = config['buffer_size']
+        detector.init_aubio()
+    return detector
+
+
+def run_item(config, audio, label):
+    """Stream one corpus item through a fresh detector, in capture-sized blocks"""
+    sends = []  # (time_s, key, scale)
+    position = [0]
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        detector = build_detector(config, None)
+    sample_rate = detector.sample_rate
+    detector.midi_callback = lambda key, scale: sends.append((position[0] / sample_rate, key, scale))
+    process = detector.process_chunk_crepe if detector.backend == 'crepe' else detector.process_chunk_aubio
+    block = detector.buffer_size
+
+    cpu_start = time.process_time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for start in range(0, len(audio) - block + 1, block):
+            position[0] = start + block
+            process(audio[start:start + block].reshape(-1, 1))
+    cpu = time.process_time() - cpu_start
+
+    truth = (label['key'], label['scale'])
+    first_correct = next((t for t, key, scale in sends if (key, scale) == truth), None)
+    final = (detector.last_detected_key, detector.last_detected_scale)
+    return {
+        'condition': label['condition'],
+        'key': label['key'],
+        'scale': label['scale'],
+        'correct': final == truth,
+        'time_to_correct_s': first_correct,
+        'wrong_sends': sum(1 for _, key, scale in sends if (key, scale) != truth),
+        'total_sends': len(sends),
+        'cpu_s': cpu,
+    }
+
+
+def summarize(config, items, audio_seconds):
+    ttck = [r['time_to_correct_s'] for r in items if r['time_to_correct_s'] is not None]
+    per_condition = {}
+    for r in items:
+        per_condition.setdefault(r['condition'], []).append(r['correct'])
+    cpu = sum(r['cpu_s'] for r in items)
+    return {
+        'config': config,
+        'items': len(items),
+        'accuracy': float(np.mean([r['correct'] for r in items])),
+        'accuracy_by_condition': {c: float(np.mean(v)) for c, v in per_condition.items()},
+        'found_key_ratio': len(ttck) / len(items),
+        'time_to_correct_median_s': float(np.median(ttck)) if ttck else None,
+        'time_to_correct_p90_s': float(np.percentile(ttck, 90)) if ttck else None,
+        'wrong_sends': int(sum(r['wrong_sends'] for r in items)),
+        'cpu_s': round(cpu, 3),
+        'cpu_per_audio_s': round(cpu / audio_seconds, 5),
+    }
+
+
+def pareto_front(results):
+    """Configs not beaten on both accuracy (higher) and CPU (lower) by any other"""
+    front = []
+    for r in results:
+        dominated = any(
+            o['accuracy'] >= r['accuracy'] and o['cpu_s'] <= r['cpu_s']
+            and (o['accuracy'] > r['accuracy'] or o['cpu_s'] < r['cpu_s'])
+            for o in results)
+        if not dominated:
+            front.append(r)
+    return sorted(front, key=lambda r: r['cpu_s'])
+
+
+def plot_pareto(results, front, path):
+    try:
+        import matplotlib
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt
+    except ImportError:
+        print("[SKIP] matplotlib not installed, no plot written")
+        return
+    fig, ax = plt.subplots(figsize=(9, 6))
+    for r in results:
+        color = "#d32f2f" if r in front else "#888888"
+        ax.scatter(r['cpu_per_audio_s'], r['accuracy'], color=color)
+        if r in front:
+            ax.annotate(r['config']['name'], (r['cpu_per_audio_s'], r['accuracy']), fontsize=7)
+    ax.plot([r['cpu_per_audio_s'] for r in front], [r['accuracy'] for r in front], color="#d32f2f")
+    ax.set_xscale("log")
+    ax.set_xlabel("CPU seconds per audio second")
+    ax.set_ylabel("Key accuracy")
+    ax.set_title("Key detection: accuracy vs CPU (red = Pareto front)")
+    fig.tight_layout()
+    fig.savefig(path, dpi=120)
+    print(f"[OK] Pareto plot written to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate key detection accuracy vs speed")
+    parser.add_argument("--quick", action="store_true", help="8 s items, clean + live conditions only")
+    parser.add_argument("--seconds", type=float, default=None, help="length of each corpus item")
+    parser.add_argument("--conditions", default=None, help="comma-separated corpus conditions")
+    parser.add_argument("--configs", default="", help="comma-separated substrings of config names to run")
+    parser.add_argument("--out", default=None, help="output JSON path (default: eval_results/...)")
+    parser.add_argument("--plot", default=None, help="write the Pareto front plot to this PNG")
+    args = parser.parse_args()
+
+    seconds = args.seconds or (8.0 if args.quick else 12.0)
+    if args.conditions:
+        conditions = [c.strip() for c in args.conditions.split(",") if c.strip()]
+    else:
+        conditions = ['clean', 'live'] if args.quick else list(CONDITIONS)
+
+    filters = [f.strip() for f in args.configs.split(",") if f.strip()]
+    configs = [c for c in default_configs() if not filters or any(f in c['name'] for f in filters)]
+    if not configs:
+        print("[ERROR] No configurations to run (is a pitch backend installed?)")
+        return
+
+    print(f"Generating corpus: {len(conditions)} conditions x 24 keys x {seconds:g}s ...")
+    corpus = list(generate_corpus(conditions, seconds))
+    audio_seconds = sum(len(a) / l['sample_rate'] for a, l in corpus)
+
+    results = []
+    for config in configs:
+        items = [run_item(config, audio, label) for audio, label in corpus]
+        summary = summarize(config, items, audio_seconds)
+        results.append(summary)
+        ttck = summary['time_to_correct_median_s']
+        print(f"{config['name']:<40} acc={summary['accuracy']:.2f}  "
+              f"ttck={'-' if ttck is None else f'{ttck:.1f}s':>6}  "
+              f"wrong={summary['wrong_sends']:<4} cpu={summary['cpu_s']:.1f}s")
+
+    front = pareto_front(results)
+    print("\n=== Pareto front (accuracy vs CPU) ===")
+    for r in front:
+        print(f"  {r['config']['name']:<40} acc={r['accuracy']:.2f}  cpu/audio-s={r['cpu_per_audio_s']:.4f}")
+
+    out_path = args.out
+    if out_path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        out_path = os.path.join(RESULTS_DIR, f"eval_{stamp}.json")
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump({
+            'corpus': {'conditions': conditions, 'seconds': seconds, 'items': len(corpus)},
+            'results': results,
+            'pareto_front': [r['config']['name'] for r in front],
+        }, f, indent=2)
+    print(f"\n[OK] Results written to {out_path}")
+
+    if args.plot:
+        plot_pareto(results, front, args.plot)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""
+Labeled Synthetic Key Corpus
+Generates sung-melody test material in each of the 24 keys (12 tonics x
+major/minor) with controllable vibrato, glide, octave jumps, noise and
+accompaniment, for evaluating key detection accuracy.
+
+Usage:
+    python key_corpus.py --out corpus            # write WAV files + manifest.json
+    python key_corpus.py --out corpus --seconds 8 --conditions clean,noisy
+"""
+
+import argparse
+import json
+import os
+import sys
+import wave
+
+import numpy as np
+
+# Fix Windows console encoding
+try:
+    sys.stdout.reconfigure(encoding='utf-8')
+except:
+    pass
+
+NOTE_NAMES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+
+SCALE_INTERVALS = {
+    'major': [0, 2, 4, 5, 7, 9, 11],
+    'minor': [0, 2, 3, 5, 7, 8, 10],  # natural minor
+}
+
+# How often each scale degree is sung (tonic, 5th and 3rd dominate a tonal melody)
+DEGREE_WEIGHTS = [5.0, 1.0, 2.5, 1.2, 3.0, 1.0, 0.8]
+
+# Chord roots (scale degrees) of the accompaniment progression: I - IV - V - I
+PROGRESSION = [0, 3, 4, 0]
+
+# Named recording conditions. Every parameter not listed uses the 'clean' value.
+CONDITIONS = {
+    'clean': {'vibrato_cents': 0.0, 'vibrato_hz': 5.5, 'glide_ms': 0.0,
+              'octave_jump_prob': 0.0, 'snr_db': None, 'accomp_level': 0.0},
+    'vibrato': {'vibrato_cents': 60.0},
+    'glide': {'glide_ms': 120.0},
+    'octave_jumps': {'octave_jump_prob': 0.2},
+    'noisy': {'snr_db': 10.0},
+    'accompaniment': {'accomp_level': 0.6},
+    'live': {'vibrato_cents': 40.0, 'glide_ms': 80.0, 'octave_jump_prob': 0.1,
+             'snr_db': 15.0, 'accomp_level': 0.4},
+}
+
+
+def condition_params(condition):
+    params = dict(CONDITIONS['clean'])
+    params.update(CONDITIONS[condition])
+    return params
+
+
+def midi_to_hz(midi):
+    return 440.0 * 2.0 ** ((np.asarray(midi, dtype=np.float64) - 69.0) / 12.0)
+
+
+def _melody_notes(tonic_pc, scale, duration, rng, octave_jump_prob):
+    """Random-walk melody over the scale, phrases start and end on the tonic"""
+    intervals = SCALE_INTERVALS[scale]
+    base = 48 + tonic_pc
+    if base < 53:
+        base += 12  # keep the tonic in a comfortable vocal range (F3..E4)
+
+    notes = []  # (midi_note or None for rest, seconds)
+    t = 0.0
+    degree = 0
+    phrase_len = 0
+    while t < duration:
+        if phrase_len >= 6 and rng.random() < 0.3:
+            # End the phrase on the tonic, then breathe
+            notes.append((base, 0.75))
+            notes.append((None, 0.25))
+            t += 1.0
+            degree = 0
+            phrase_len = 0
+            continue
+
+        distance = np.abs(np.arange(7) - degree)
+        prob = np.array(DEGREE_WEIGHTS) * np.exp(-distance / 2.0)
+        degree = int(rng.choice(7, p=prob / prob.sum()))
+        note = base + intervals[degree]
+        if rng.random() < octave_jump_prob:
+            note += 12 if rng.random() < 0.5 else -12
+        length = float(rng.choice([0.25, 0.5, 0.5, 0.75]))
+        notes.append((note, length))
+        t += length
+        phrase_len += 1
+    return notes
+
+
+def generate_item(tonic_pc, scale, condition='clean', duration=12.0, sample_rate=16000, seed=0):
+    """
+    Render one labeled melody.
+
+    Returns:
+        (audio, label): float32 mono samples in [-1, 1] and a dict with
+        key, scale, tonic_pc, condition, seed, duration and sample_rate.
+    """
+    params = condition_params(condition)
+    rng = np.random.default_rng(seed)
+    notes = _melody_notes(tonic_pc, scale, duration, rng, params['octave_jump_prob'])
+
+    n_samples = int(duration * sample_rate)
+    pitch = np.zeros(n_samples)      # MIDI pitch contour (0 where silent)
+    amp = np.zeros(n_samples)
+    attack = int(0.02 * sample_rate)
+    release = int(0.03 * sample_rate)
+    glide = int(params['glide_ms'] / 1000.0 * sample_rate)
+
+    pos = 0
+    prev_note = None
+    for note, length in notes:
+        n = int(length * sample_rate)
+        end = min(n_samples, pos + n)
+        if pos >= n_samples:
+            break
+        if note is not None:
+            seg = np.full(end - pos, float(note))
+            if glide and prev_note is not None and len(seg) > glide:
+                seg[:glide] = np.linspace(prev_note, note, glide)
+            pitch[pos:end] = seg
+            env = np.ones(end - pos)
+            a = min(attack, len(env))
+            r = min(release, len(env))
+            env[:a] = np.linspace(0, 1, a)
+            env[len(env) - r:] = np.linspace(1, 0, r)
+            amp[pos:end] = env
+            prev_note = note
+        pos = end
+
+    t = np.arange(n_samples) / sample_rate
+    if params['vibrato_cents']:
+        pitch += (params['vibrato_cents'] / 100.0) * np.sin(2 * np.pi * params['vibrato_hz'] * t) * (amp > 0)
+
+    freq = np.where(amp > 0, midi_to_hz(pitch), 0.0)
+    phase = 2 * np.pi * np.cumsum(freq) / sample_rate
+    voice = amp * (np.sin(phase) + 0.5 * np.sin(2 * phase) + 0.25 * np.sin(3 * phase)) / 1.75
+
+    mix = voice.copy()
+    if params['accomp_level']:
+        mix += params['accomp_level'] * _accompaniment(tonic_pc, scale, n_samples, sample_rate)
+
+    if params['snr_db'] is not None:
+        voice_rms = np.sqrt(np.mean(voice[amp > 0] ** 2)) if np.any(amp > 0) else 0.1
+        noise_rms = voice_rms / (10 ** (params['snr_db'] / 20.0))
+        mix += rng.normal(0, noise_rms, n_samples)
+
+    peak = np.max(np.abs(mix))
+    if peak > 0:
+        mix = 0.8 * mix / peak
+
+    label = {
+        'key': NOTE_NAMES[tonic_pc], 'scale': scale, 'tonic_pc': tonic_pc,
+        'condition': condition, 'seed': seed, 'duration': duration, 'sample_rate': sample_rate,
+    }
+    return mix.astype(np.float32), label
+
+
+def _accompaniment(tonic_pc, scale, n_samples, sample_rate):
+    """Soft sustained triads (I - IV - V - I) one octave below the melody"""
+    intervals = SCALE_INTERVALS[scale]
+    out = np.zeros(n_samples)
+    chord_len = 2 * sample_rate
+    t = np.arange(chord_len) / sample_rate
+    env = np.minimum(1.0, np.minimum(t, t[::-1]) * 10.0)
+    pos = 0
+    i = 0
+    while pos < n_samples:
+        root = PROGRESSION[i % len(PROGRESSION)]
+        chord = [36 + tonic_pc + intervals[(root + k) % 7] + 12 * ((root + k) // 7) for k in (0, 2, 4)]
+        seg = sum(np.sin(2 * np.pi * f * t) for f in midi_to_hz(chord)) / 3.0
+        end = min(n_samples, pos + chord_len)
+        out[pos:end] = (seg * env)[:end - pos]
+        pos = end
+        i += 1
+    return out
+
+
+def generate_corpus(conditions=None, duration=12.0, sample_rate=16000, keys=None, base_seed=1000):
+    """Yield (audio, label) for every key in every condition"""
+    conditions = conditions or list(CONDITIONS)
+    keys = keys or [(pc, scale) for scale in ('major', 'minor') for pc in range(12)]
+    for c_idx, condition in enumerate(conditions):
+        for k_idx, (pc, scale) in enumerate(keys):
+            seed = base_seed + c_idx * 100 + k_idx
+            yield generate_item(pc, scale, condition, duration, sample_rate, seed)
+
+
+def write_wav(path, audio, sample_rate):
+    with wave.open(path, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(sample_rate)
+        wf.writeframes((np.clip(audio, -1, 1) * 32767).astype(np.int16).tobytes())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate the labeled synthetic key corpus")
+    parser.add_argument("--out", default="corpus", help="output directory")
+    parser.add_argument("--seconds", type=float, default=12.0, help="length of each item")
+    parser.add_argument("--rate", type=int, default=16000, help="sample rate")
+    parser.add_argument("--conditions", default=",".join(CONDITIONS), help="comma-separated condition names")
+    args = parser.parse_args()
+
+    conditions = [c.strip() for c in args.conditions.split(",") if c.strip()]
+    os.makedirs(args.out, exist_ok=True)
+    manifest = []
+    for audio, label in generate_corpus(conditions, args.seconds, args.rate):
+        name = f"{label['condition']}_{label['key'].replace('#', 's')}_{label['scale']}.wav"
+        write_wav(os.path.join(args.out, name), audio, args.rate)
+        manifest.append(dict(label, file=name))
+    with open(os.path.join(args.out, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    print(f"[OK] Wrote {len(manifest)} items to {args.out}/")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+"""
+Latency Tracing
+Low-overhead per-stage latency histograms for the capture -> detection -> MIDI path.
+
+Every audio block is stamped with time.perf_counter_ns() at capture; the
+detector and the MIDI sender record how long each stage took (or how long
+since capture) into HDR-style log-linear histograms. Recording is one
+bucket increment, and stages that run on every audio chunk are only traced
+for one chunk in `sample_every`, so tracing stays below 1% of the pipeline
+cost even with the cheap Aubio backend.
+
+Usage:
+    from latency_trace import TRACER
+    TRACER.record('inference', duration_ns)
+    TRACER.record_since('capture_to_key', captured_ns)
+    print(TRACER.format_summary())
+
+Environment:
+    CUBASE_TRACE=0             disable tracing
+    CUBASE_TRACE_SAMPLE=16     trace per-chunk stages for 1 chunk in 16 (default)
+    CUBASE_TRACE_SUMMARY=30    print a summary every 30 seconds
+"""
+
+import os
+import threading
+import time
+
+# Pipeline stages in path order, [thread] = the one thread that records it. Every stage
+# recorded anywhere is listed: readers iterate the histograms while hot threads record,
+# so none may be created on the fly (_hist() is for scripts and benchmarks)
+STAGES = [
+    'queue_wait',            # [detection] capture -> dequeued by the detection thread
+    'batch_fill',            # [detection] first sample of a CREPE batch captured -> batch complete
+    'inference',             # [detection] pitch backend call
+    'history_fill',          # [detection] detection start -> 20 pitch samples collected (once per start)
+    'key_analysis',          # [detection] key/scale scoring
+    'midi_callback',         # [detection] detector -> GUI callback duration
+    'midi_queue_wait',       # [midi port] MIDI message queued -> handed to the port by the sender thread
+    'midi_send',             # [midi port] midiout.send_message duration
+    'capture_to_key',        # [detection] capture of the block completing the analysis -> key change emitted
+    'capture_to_midi_send',  # [midi port] same origin -> MIDI message sent
+    'process_chunk',         # [detection] detection thread busy time per audio chunk
+    'note_on',               # [detection] note stream: onset audio captured -> note-on sent
+    'idle_wake',             # [detection] first loud block captured in idle mode -> full detection resumed
+    'midi_timer_late',       # [midi-out] scheduled MIDI message (note-off, pulse release) sent after its due time
+    'midi_ramp_step_late',   # [midi-out] CC ramp clock step run after its scheduled time
+    'midi_ramp_period',      # [midi-out] achieved time between two CC ramp steps
+    'device_switch',         # [switch_device caller, under the stream lock] old capture stopped -> new capturing
+    'gui_meter_frame',       # [tk] Tk thread time to redraw the live meters from one detector snapshot
+]
+
+SUB_BUCKET_BITS = 7  # 128 linear sub-buckets per power of two -> < 1.6% relative error
+_SUB_COUNT = 1 << SUB_BUCKET_BITS
+_HALF_COUNT = _SUB_COUNT >> 1
+
+
+class LatencyHistogram:
+    """
+    HDR-style histogram of microsecond values: exact below 128 us, then
+    64 buckets per power of two. record() is O(1) and allocation-free.
+    Meant to be written by one thread (see STAGES); readers may see a value in flight.
+    """
+
+    def __init__(self, max_us=120_000_000):
+        max_shift = max(1, max_us.bit_length() - SUB_BUCKET_BITS)
+        self.counts = [0] * (_SUB_COUNT + max_shift * _HALF_COUNT)
+        self.max_index = len(self.counts) - 1
+        self.count = 0
+        self.total_us = 0
+        self.max_us = 0
+
+    @staticmethod
+    def _value_at(index):
+        """Upper bound (us) of the values stored in bucket index"""
+        if index < _SUB_COUNT:
+            return index
+        shift = index // _HALF_COUNT - 1
+        top = index % _HALF_COUNT + _HALF_COUNT
+        return ((top + 1) << shift) - 1
+
+    def record(self, value_us):
+        """Add one integer microsecond value"""
+        if value_us < _SUB_COUNT:
+            index = value_us if value_us > 0 else 0
+        else:
+            # bucket = shift * 64 + top 7 bits (top is in 64..127)
+            shift = value_us.bit_length() - SUB_BUCKET_BITS
+            index = (shift << (SUB_BUCKET_BITS - 1)) + (value_us >> shift)
+            if index > self.max_index:
+                index = self.max_index
+        self.counts[index] += 1
+        self.count += 1
+        self.total_us += value_us
+        if value_us > self.max_us:
+            self.max_us = value_us
+
+    def percentile(self, q):
+        """Value (us) at percentile q (0-100)"""
+        if self.count == 0:
+            return 0
+        target = max(1, int(round(self.count * q / 100.0)))
+        seen = 0
+        for index, c in enumerate(self.counts):
+            if c:
+                seen += c
+                if seen >= target:
+                    return min(self._value_at(index), self.max_us)
+        return self.max_us
+
+    def reset(self):
+        self.counts = [0] * len(self.counts)
+        self.count = 0
+        self.total_us = 0
+        self.max_us = 0
+
+
+class LatencyTracer:
+    """Named stage histograms plus the per-thread origin stamp of the current detection"""
+
+    def __init__(self, enabled=True, sample_every=16):
+        self.enabled = enabled
+        self.sample_every = max(1, sample_every)
+        self._ticks = 0
+        self.histograms = {name: LatencyHistogram() for name in STAGES}
+        self._local = threading.local()
+        self._summary_thread = None
+        self._summary_stop = threading.Event()
+        self.record_cost_ns = self._calibrate()
+
+    def _calibrate(self, n=20000):
+        """Measure the cost of one record() call, used for the overhead estimate"""
+        hist = LatencyHistogram()
+        perf = time.perf_counter_ns
+        t0 = perf()
+        for _ in range(n):
+            hist.record((perf() - t0) // 1000)
+        return (perf() - t0) / n
+
+    def _hist(self, stage):
+        """Histogram of a stage missing from STAGES (scripts, benchmarks)"""
+        return self.histograms.setdefault(stage, LatencyHistogram())
+
+    def record(self, stage, duration_ns):
+        if self.enabled:
+            (self.histograms.get(stage) or self._hist(stage)).record(duration_ns // 1000)
+
+    def record_since(self, stage, start_ns):
+        if self.enabled and start_ns is not None:
+            (self.histograms.get(stage) or self._hist(stage)).record((time.perf_counter_ns() - start_ns) // 1000)
+
+    def tick(self):
+        """Advance the per-chunk counter; True when this chunk's per-chunk stages should be traced"""
+        self._ticks += 1
+        return self.enabled and self._ticks % self.sample_every == 0
+
+    # The capture stamp of the audio that triggered the current detection, so
+    # code downstream of midi_callback (same thread) can measure end to end.
+    def set_origin(self, captured_ns):
+        self._local.origin_ns = captured_ns
+
+    def origin(self):
+        return getattr(self._local, 'origin_ns', None)
+
+    def summary(self):
+        """
+        {stage: {count, mean_ms, p50_ms, p90_ms, p99_ms, max_ms}} for stages with data.
+        Counts of per-chunk stages are sample counts (1 in sample_every chunks).
+        """
+        out = {}
+        for name, hist in list(self.histograms.items()):
+            if hist.count == 0:
+                continue
+            out[name] = {
+                'count': hist.count,
+                'mean_ms': round(hist.total_us / hist.count / 1000.0, 3),
+                'p50_ms': round(hist.percentile(50) / 1000.0, 3),
+                'p90_ms': round(hist.percentile(90) / 1000.0, 3),
+                'p99_ms': round(hist.percentile(99) / 1000.0, 3),
+                'max_ms': round(hist.max_us / 1000.0, 3),
+            }
+        return out
+
+    def overhead_pct(self):
+        """Estimated tracing cost as a percentage of detection thread busy time"""
+        busy = self.histograms['process_chunk']
+        if busy.total_us == 0:
+            return 0.0
+        records = sum(h.count for h in list(self.histograms.values()))
+        busy_ns = busy.total_us * 1000.0 * self.sample_every  # process_chunk itself is sampled
+        return 100.0 * records * self.record_cost_ns / busy_ns
+
+    def format_summary(self):
+        stats = self.summary()
+        lines = [f"{'STAGE':<22} {'count':>7} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}"]
+        for name, s in stats.items():
+            lines.append(f"{name:<22} {s['count']:>7} {s['p50_ms']:>9.2f} {s['p90_ms']:>9.2f} "
+                         f"{s['p99_ms']:>9.2f} {s['max_ms']:>9.2f}")
+        lines.append(f"tracing overhead ~{self.overhead_pct():.3f}% of detection time")
+        return "\n".join(lines)
+
+    def reset(self):
+        for hist in list(self.histograms.values()):
+            hist.reset()
+
+    def start_periodic_summary(self, interval=30.0):
+        """Print the summary every interval seconds from a daemon thread"""
+        if self._summary_thread and self._summary_thread.is_alive():
+            return
+        self._summary_stop.clear()
+
+        def loop():
+            while not self._summary_stop.wait(interval):
+                if self.summary():
+                    print("\n=== Latency trace ===\n" + self.format_summary())
+
+        self._summary_thread = threading.Thread(target=loop, daemon=True)
+        self._summary_thread.start()
+
+    def stop_periodic_summary(self):
+        self._summary_stop.set()
+
+
+try:
+    _sample_every = int(os.environ.get("CUBASE_TRACE_SAMPLE", "16"))
+except ValueError:
+    _sample_every = 16
+
+TRACER = LatencyTracer(enabled=os.environ.get("CUBASE_TRACE", "1") != "0", sample_every=_sample_every)
+
+if os.environ.get("CUBASE_TRACE_SUMMARY"):
+    try:
+        TRACER.start_periodic_summary(float(os.environ["CUBASE_TRACE_SUMMARY"]))
+    except ValueError:
+        print("[WARN] CUBASE_TRACE_SUMMARY must be a number of seconds")
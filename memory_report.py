@@ -0,0 +1,175 @@
+"""
+Memory Accounting
+On-demand memory report for the controller / detector process: RSS, pitch
+backend (TensorFlow / CREPE model) memory, and tracemalloc top allocators
+grouped by subsystem.
+
+Lean mode target (CUBASE_LEAN=1 or --lean, see README):
+    RSS <= LEAN_RSS_TARGET_MB with the Aubio backend (TensorFlow never imported).
+    With CREPE tiny as the only backend TensorFlow itself stays resident
+    (~250-400 MB); the model is released on AUTO RT stop and reloaded lazily.
+
+Usage:
+    import memory_report
+    memory_report.start_tracing()                 # optional, enables per-subsystem allocators
+    print(memory_report.format_report())
+
+Environment:
+    CUBASE_TRACEMALLOC=1    start tracemalloc at launch (adds CPU/memory overhead, debugging only)
+"""
+
+import ctypes
+import os
+import sys
+import tracemalloc
+
+from metrics import METRICS
+
+LEAN_RSS_TARGET_MB = 150
+
+# First matching path fragment wins (checked against the lower-cased filename)
+SUBSYSTEMS = [
+    ('detector', ('realtime_pitch_detector', 'latency_trace')),
+    ('gui', ('controller_gui', 'customtkinter', 'tkinter')),
+    ('midi', ('rtmidi', 'midi_')),
+    ('audio', ('sounddevice', 'soundcard', '_cffi')),
+    ('tensorflow', ('tensorflow', 'keras', 'crepe', 'h5py')),
+    ('numpy', ('numpy',)),
+    ('automation', ('pyautogui', 'pygetwindow', 'pyscreeze', 'pymsgbox')),
+    ('metrics', ('metrics', 'sampling_profiler', 'memory_report')),
+]
+
+
+def rss_bytes():
+    """Current resident set size of this process (0 if it cannot be read)"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+
+    if sys.platform == "win32":
+        class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+            _fields_ = [("cb", ctypes.c_ulong), ("PageFaultCount", ctypes.c_ulong),
+                        ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+        try:
+            counters = PROCESS_MEMORY_COUNTERS()
+            counters.cb = ctypes.sizeof(counters)
+            handle = ctypes.windll.kernel32.GetCurrentProcess()
+            if ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+                return counters.WorkingSetSize
+        except Exception:
+            pass
+        return 0
+
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024  # peak, not current
+    except ImportError:
+        return 0
+
+
+def backend_memory():
+    """TensorFlow / CREPE memory, without importing anything that is not loaded yet"""
+    info = {'tensorflow_loaded': 'tensorflow' in sys.modules, 'crepe_models': {}}
+    crepe_core = sys.modules.get('crepe.core')
+    if crepe_core is not None:
+        for capacity, model in getattr(crepe_core, 'models', {}).items():
+            if model is not None:
+                try:
+                    info['crepe_models'][capacity] = model.count_params() * 4  # float32 weights
+                except Exception:
+                    info['crepe_models'][capacity] = None
+    tf = sys.modules.get('tensorflow')
+    if tf is not None:
+        for device in ('GPU:0', 'CPU:0'):
+            try:
+                mem = tf.config.experimental.get_memory_info(device)
+                info[f'tf_{device}_current'] = mem.get('current')
+                info[f'tf_{device}_peak'] = mem.get('peak')
+            except Exception:
+                pass  # not supported for this device / TF version
+    return info
+
+
+def subsystem_of(filename):
+    name = filename.replace("\\", "/").lower()
+    for subsystem, fragments in SUBSYSTEMS:
+        if any(fragment in name for fragment in fragments):
+            return subsystem
+    return 'other'
+
+
+def start_tracing(nframes=1):
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(nframes)
+        print("[OK] tracemalloc started (memory report will list allocators per subsystem)")
+
+
+def subsystem_allocations(top=5):
+    """{subsystem: {'bytes': n, 'top': [(file:line, bytes)]}} from a tracemalloc snapshot"""
+    if not tracemalloc.is_tracing():
+        return {}
+    stats = tracemalloc.take_snapshot().statistics('lineno')
+    out = {}
+    for stat in stats:
+        frame = stat.traceback[0]
+        entry = out.setdefault(subsystem_of(frame.filename), {'bytes': 0, 'top': []})
+        entry['bytes'] += stat.size
+        if len(entry['top']) < top:
+            entry['top'].append((f"{os.path.basename(frame.filename)}:{frame.lineno}", stat.size))
+    return dict(sorted(out.items(), key=lambda kv: -kv[1]['bytes']))
+
+
+def memory_report(top=5):
+    rss = rss_bytes()
+    return {
+        'rss_bytes': rss,
+        'lean_mode': os.environ.get('CUBASE_LEAN', '0') not in ('', '0'),
+        'lean_target_bytes': LEAN_RSS_TARGET_MB * 1024 * 1024,
+        'within_lean_target': rss <= LEAN_RSS_TARGET_MB * 1024 * 1024,
+        'backend': backend_memory(),
+        'subsystems': subsystem_allocations(top),
+    }
+
+
+def format_report(top=5):
+    report = memory_report(top)
+    mb = 1024 * 1024
+    lines = ["=== Memory report ===",
+             f"RSS: {report['rss_bytes'] / mb:.1f} MB "
+             f"(lean target {LEAN_RSS_TARGET_MB} MB: {'OK' if report['within_lean_target'] else 'OVER'}"
+             f"{', lean mode ON' if report['lean_mode'] else ''})"]
+    backend = report['backend']
+    lines.append(f"TensorFlow loaded: {backend['tensorflow_loaded']}")
+    for capacity, size in backend['crepe_models'].items():
+        lines.append(f"  CREPE model '{capacity}': {size / mb:.1f} MB weights" if size else f"  CREPE model '{capacity}' loaded")
+    for key, value in backend.items():
+        if key.startswith('tf_') and value is not None:
+            lines.append(f"  {key}: {value / mb:.1f} MB")
+    if report['subsystems']:
+        lines.append("Python allocations by subsystem (tracemalloc):")
+        for subsystem, entry in report['subsystems'].items():
+            lines.append(f"  {subsystem:<12} {entry['bytes'] / mb:8.2f} MB")
+            for where, size in entry['top']:
+                lines.append(f"      {size / 1024:9.1f} KB  {where}")
+    else:
+        lines.append("(tracemalloc off: set CUBASE_TRACEMALLOC=1 for per-subsystem allocators)")
+    return "\n".join(lines)
+
+
+METRICS.gauge('process_rss_bytes', 'Resident set size of the controller process', fn=rss_bytes)
+
+
+def start_from_env():
+    if os.environ.get("CUBASE_TRACEMALLOC", "0") not in ("", "0"):
+        start_tracing()
@@ -0,0 +1,332 @@
+"""
+Health Metrics
+Counters and gauges for the detector and MIDI output, served in Prometheus
+text format on a small local HTTP endpoint (off by default, localhost only).
+
+Hot threads never take a lock: Counter.inc()/add() update a cell owned by
+the calling thread (only that thread writes it, a scrape sums the cells),
+and gauges are plain attribute stores.
+
+Usage:
+    from metrics import MIDI_CC_MESSAGES
+    MIDI_CC_MESSAGES.labels(cc=21).inc()
+
+    start_metrics_server(9464)    # then open http://127.0.0.1:9464/metrics
+
+Environment:
+    CUBASE_METRICS_PORT=9464   start the endpoint (controller_gui.py also accepts --metrics [PORT])
+"""
+
+import os
+import threading
+import time
+
+DEFAULT_PORT = 9464
+
+
+class Counter:
+    """Monotonic counter, lock-free: one cell per writer thread, summed when read"""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._cells = []
+        self._cells_lock = threading.Lock()
+
+    def _cell(self):
+        """This thread's cell (the lock is only taken on a thread's first write)"""
+        cell = [0]
+        with self._cells_lock:
+            self._cells.append(cell)
+        self._local.cell = cell
+        return cell
+
+    def inc(self):
+        try:
+            self._local.cell[0] += 1
+        except AttributeError:
+            self._cell()[0] += 1
+
+    def add(self, n):
+        try:
+            self._local.cell[0] += n
+        except AttributeError:
+            self._cell()[0] += n
+
+    @property
+    def value(self):
+        return sum(cell[0] for cell in list(self._cells))
+
+
+class Gauge:
+    """Last-value gauge, or a function evaluated at scrape time"""
+
+    def __init__(self, fn=None):
+        self.fn = fn
+        self._value = 0.0
+
+    def set(self, value):
+        self._value = value
+
+    @property
+    def value(self):
+        if self.fn is not None:
+            try:
+                return self.fn()
+            except Exception:
+                return float('nan')
+        return self._value
+
+
+class Family:
+    """A named metric with optional labels: family.labels(cc=21).inc()"""
+
+    def __init__(self, name, help_text, kind, factory):
+        self.name = name
+        self.help = help_text
+        self.kind = kind
+        self._factory = factory
+        self.children = {}
+        self._default = None
+
+    def labels(self, **labels):
+        key = tuple(sorted((k, str(v)) for k, v in labels.items()))
+        child = self.children.get(key)
+        if child is None:
+            child = self.children.setdefault(key, self._factory())
+        return child
+
+    # Unlabeled use: family.inc(), family.set(v), family.value
+    def _unlabeled(self):
+        if self._default is None:
+            self._default = self.labels()
+        return self._default
+
+    def inc(self):
+        self._unlabeled().inc()
+
+    def add(self, n):
+        self._unlabeled().add(n)
+
+    def set(self, value):
+        self._unlabeled().set(value)
+
+    def set_function(self, fn):
+        self._unlabeled().fn = fn
+
+    @property
+    def value(self):
+        return self._unlabeled().value
+
+    def clear(self):
+        self.children = {}
+        self._default = None
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.families = {}
+
+    def counter(self, name, help_text):
+        return self.families.setdefault(name, Family(name, help_text, 'counter', Counter))
+
+    def gauge(self, name, help_text, fn=None):
+        family = self.families.setdefault(name, Family(name, help_text, 'gauge', Gauge))
+        if fn is not None:
+            family.set_function(fn)
+        return family
+
+    def render(self):
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        for family in list(self.families.values()):
+            children = list(family.children.items())
+            if not children:
+                continue
+            lines.append(f"# HELP {family.name} {_escape_help(family.help)}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            for key, child in children:
+                label_txt = ""
+                if key:
+                    label_txt = "{" + ",".join(f'{k}="{_escape_label(v)}"' for k, v in key) + "}"
+                lines.append(f"{family.name}{label_txt} {_format_value(child.value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape_label(value):
+    """Label value escaping of the text format: backslash, double quote, newline (port/device names)"""
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _escape_help(text):
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _format_value(value):
+    if value is None:
+        return "NaN"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, int):
+        return str(value)
+    return repr(float(value))
+
+
+METRICS = MetricsRegistry()
+
+# --- Detector ---
+AUDIO_BLOCKS = METRICS.counter('detector_audio_blocks_total', 'Audio blocks captured')
+AUDIO_OVERRUNS = METRICS.counter('detector_audio_overruns_total', 'Input overflows reported by the audio driver, plus blocks dropped from a full (lean) capture queue')
+AUDIO_QUEUE_DEPTH = METRICS.gauge('detector_audio_queue_depth', 'Audio blocks waiting for the detection thread')
+FRAMES = METRICS.counter('detector_pitch_frames_total', 'Pitch frames produced by the backend')
+GATED_FRAMES = METRICS.counter('detector_gated_frames_total', 'Pitch frames dropped (unvoiced or below confidence)')
+GATED_RATIO = METRICS.gauge('detector_gated_frame_ratio', 'Share of pitch frames gated out since start',
+                            fn=lambda: GATED_FRAMES.value / FRAMES.value if FRAMES.value else 0.0)
+FRAMES_PER_SECOND = METRICS.gauge('detector_pitch_frames_per_second', 'Pitch frames per second (1 s window)')
+INFERENCE_LAST = METRICS.gauge('detector_inference_seconds_last', 'Duration of the last backend call')
+INFERENCE_SUM = METRICS.counter('detector_inference_seconds_sum', 'Total backend inference time')
+INFERENCE_COUNT = METRICS.counter('detector_inference_count', 'Number of backend calls')
+DETECTIONS = METRICS.counter('detector_detections_total', 'Key/scale changes sent to MIDI')
+CURRENT_KEY = METRICS.gauge('detector_current_key', 'Currently detected key (1 for the active key/scale label)')
+KEY_CONFIDENCE = METRICS.gauge('detector_key_confidence', 'Share of recent notes inside the detected scale (0-1)')
+DETECTOR_RUNNING = METRICS.gauge('detector_running', '1 while realtime detection is running')
+DETECTOR_IDLE = METRICS.gauge('detector_idle', '1 while the detector is idle (silence, level monitor only)')
+DETECTOR_WAKEUPS = METRICS.counter('detector_wakeups_total', 'Detection thread wakeups, by mode (active/idle)')
+DETECTOR_WAKEUPS_PER_SECOND = METRICS.gauge('detector_wakeups_per_second', 'Detection thread wakeups per second, by mode')
+DETECTOR_CPU_SECONDS = METRICS.counter('detector_cpu_seconds_total', 'Detection thread CPU time, by mode (active/idle)')
+DETECTOR_CPU_PERCENT = METRICS.gauge('detector_cpu_percent', 'Detection thread CPU usage (1 s window), by mode')
+
+# --- MIDI ---
+MIDI_CC_MESSAGES = METRICS.counter('midi_cc_messages_total', 'CC messages sent, by controller number')
+MIDI_CC_PER_SECOND = METRICS.gauge('midi_cc_messages_per_second', 'CC messages per second (1 s window)')
+MIDI_NOTE_MESSAGES = METRICS.counter('midi_note_messages_total', 'Note on/off messages sent')
+MIDI_SUPPRESSED = METRICS.counter('midi_suppressed_total', 'CC sends skipped because the value was unchanged')
+MIDI_CC_COALESCED = METRICS.counter('midi_cc_coalesced_total', 'CC values replaced by a newer value before the rate limit let them out')
+MIDI_DROPPED = METRICS.counter('midi_dropped_total', 'MIDI messages dropped (port not connected or send error)')
+MIDI_PORT_MESSAGES = METRICS.counter('midi_port_messages_total', 'MIDI messages written, by output port')
+MIDI_PORT_PER_SECOND = METRICS.gauge('midi_port_messages_per_second', 'MIDI messages written per second, by output port')
+MIDI_PORT_DROPPED = METRICS.counter('midi_port_dropped_total', 'MIDI messages an output port dropped (not connected, queue full or send error)')
+MIDI_PORT_QUEUE_DEPTH = METRICS.gauge('midi_port_queue_depth', 'Messages waiting in an output port queue')
+MIDI_PORT_CONNECTED = METRICS.gauge('midi_port_connected', '1 while an output port is open')
+MIDI_FEEDBACK = METRICS.counter('midi_feedback_total', 'CC values received from Cubase, by kind (applied / echo of our own send)')
+MIDI_RAMP_STEPS = METRICS.counter('midi_ramp_steps_total', 'CC ramp clock steps run')
+MIDI_RAMP_CANCELLED = METRICS.counter('midi_ramp_cancelled_total', 'Ramping CCs cancelled by a manual move')
+MIDI_RAMPS_ACTIVE = METRICS.gauge('midi_ramps_active', 'CCs currently ramping')
+LOG_DROPPED = METRICS.counter('log_records_dropped_total', 'Log records dropped because the log ring buffer was full')
+CONTROL_COMMANDS = METRICS.counter('control_commands_total', 'Commands received on the local control API')
+CONTROL_CLIENTS = METRICS.gauge('control_clients', 'Connected control API clients')
+CONTROL_EVENTS_DROPPED = METRICS.counter('control_events_dropped_total', 'State events dropped for control API clients that fell behind')
+AUTOKEY_LISTENS = METRICS.counter('autokey_listens_total', 'DÒ TONE listen phases, by outcome (confident / timeout / stopped / no_detector)')
+AUTOKEY_LISTEN_SECONDS = METRICS.counter('autokey_listen_seconds_total', 'Time spent in DÒ TONE listen phases')
+SESSION_LOG_RECORDS = METRICS.gauge('session_log_records', 'Records written to the session analytics log')
+SESSION_LOG_DROPPED = METRICS.counter('session_log_dropped_total', 'Session log records dropped because the preallocated file was full')
+STARTUP_SECONDS = METRICS.gauge('startup_interactive_seconds', 'Time from launch to an interactive window')
+
+
+def set_current_key(key, scale):
+    """Expose the active key as a single labeled gauge"""
+    CURRENT_KEY.clear()
+    CURRENT_KEY.labels(key=key, scale=scale).set(1)
+
+
+class _RateSampler:
+    """Turns counters into per-second gauges once a second (only while the server runs)"""
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self._last = {}
+        self._stop = threading.Event()
+
+    def _rate(self, key, value, now):
+        prev = self._last.get(key)
+        self._last[key] = (now, value)
+        if prev is None or now <= prev[0]:
+            return 0.0
+        return (value - prev[1]) / (now - prev[0])
+
+    def sample(self):
+        now = time.monotonic()
+        FRAMES_PER_SECOND.set(self._rate('frames', FRAMES.value, now))
+        for key, child in list(MIDI_CC_MESSAGES.children.items()):
+            labels = dict(key)
+            MIDI_CC_PER_SECOND.labels(**labels).set(self._rate(('cc', key), child.value, now))
+        for key, child in list(MIDI_PORT_MESSAGES.children.items()):
+            MIDI_PORT_PER_SECOND.labels(**dict(key)).set(self._rate(('port', key), child.value, now))
+        for key, child in list(DETECTOR_WAKEUPS.children.items()):
+            DETECTOR_WAKEUPS_PER_SECOND.labels(**dict(key)).set(self._rate(('wakeups', key), child.value, now))
+        for key, child in list(DETECTOR_CPU_SECONDS.children.items()):
+            DETECTOR_CPU_PERCENT.labels(**dict(key)).set(100.0 * self._rate(('cpu', key), child.value, now))
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self._stop.set()
+
+
+def _metrics_handler():
+    """Request handler class (http.server is imported only when the endpoint starts)"""
+    from http.server import BaseHTTPRequestHandler
+
+    class _MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = METRICS.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # keep the console quiet during a show
+
+    return _MetricsHandler
+
+
+_server = None
+_sampler = None
+
+
+def start_metrics_server(port=DEFAULT_PORT, host="127.0.0.1"):
+    """Serve /metrics from a daemon thread. Returns the server, or None if it could not bind."""
+    global _server, _sampler
+    if _server is not None:
+        return _server
+    from http.server import ThreadingHTTPServer
+    try:
+        _server = ThreadingHTTPServer((host, port), _metrics_handler())
+    except OSError as e:
+        print(f"[ERROR] Metrics endpoint could not bind {host}:{port}: {e}")
+        return None
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
+    _sampler = _RateSampler()
+    threading.Thread(target=_sampler.run, daemon=True).start()
+    print(f"[OK] Metrics endpoint: http://{host}:{port}/metrics")
+    return _server
+
+
+def stop_metrics_server():
+    global _server, _sampler
+    if _server is not None:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
+    if _sampler is not None:
+        _sampler.stop()
+        _sampler = None
+
+
+def start_from_env():
+    """Start the endpoint if CUBASE_METRICS_PORT is set"""
+    port = os.environ.get("CUBASE_METRICS_PORT")
+    if not port:
+        return None
+    try:
+        return start_metrics_server(int(port))
+    except ValueError:
+        print("[WARN] CUBASE_METRICS_PORT must be a port number")
+        return None
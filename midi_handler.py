@@ -0,0 +1,755 @@
+"""
+MIDI Output
+loopMIDI connection and all MIDI sending for the controller.
+
+Every message goes through one sender thread ("midi-out"); callers on the
+GUI and detection threads only append to a queue and never block on a
+port or the console. Delayed messages (note-offs, the release half of a
+button pulse, rate-limited CC flushes) sit in a timer wheel on the sender
+thread: 1 ms ticks, O(1) to schedule and to expire. Each scheduled
+message's lateness is traced ('midi_timer_late').
+
+The sender thread routes each message to one or more output ports. Every
+port has its own bounded queue and writer thread ("midi-out:<name>"), so a
+slow or disconnected port never delays the others: its queue drops the
+oldest message when full, and a missing port drops and retries the
+connection every RECONNECT_S. The first port ("main", loopMIDI) is the
+primary one: its enqueue -> write time is traced as 'midi_queue_wait'.
+Extra ports and routing rules come from midi_ports.json:
+
+    {"ports": [
+        {"name": "cubase2", "match": "rtpMIDI"},
+        {"name": "lights", "match": "Lights", "types": ["cc"], "ccs": [24, 25, 32, 36]}
+    ]}
+
+types: any of "cc", "note", "pitch_bend", "other" (default: all);
+ccs: only these controllers (default: all). An entry named "main"
+changes the primary port's rule.
+
+CC sends are coalesced per controller: a controller is sent at most
+`cc_rate` times per second, and values arriving faster than that only
+replace the pending value (latest value wins). The pending value is sent
+as soon as its controller is due again, so the final value of a slider
+drag is always delivered, at most 1 / cc_rate late. The first value after
+a pause goes out immediately.
+
+Usage:
+    midi = MidiHandler()
+    midi.send_cc(21, 100)                 # never blocks on a fast slider drag
+    midi.pulse_cc(30, 0.1)                # 127 now, 0 after 100 ms
+    midi.send_note(60, 127, 0.05)         # note-on now, note-off after 50 ms
+    midi.send_burst({21: 90, 22: 40})     # preset recall, written back to back
+    midi.ramp({21: 40, 22: 90}, 3.0)      # scene transition over 3 s
+    midi.drain()                          # deliver pending/scheduled messages (before exit)
+
+Ramps: ramp({cc: target}, seconds, curve) moves several CCs to targets on
+one fixed-rate clock (CUBASE_RAMP_RATE steps/s), evaluated at the scheduled
+step times (see cc_ramp.py); only changed integer values are sent. A manual
+send of a ramping CC cancels its ramp; a new ramp of the same CC continues
+from where the old one is. Step lateness and the achieved period are traced
+('midi_ramp_step_late', 'midi_ramp_period').
+
+Cubase feedback: start_feedback() listens on the loopMIDI input for the
+Quick Control values CustomController.js echoes back, keeps last_sent (the
+dedupe cache) in sync with what Cubase really holds and hands the values to
+the GUI in batches. Echoes of values we sent ourselves are ignored.
+
+Environment:
+    CUBASE_CC_RATE=50          max messages per second per CC (0 = no coalescing)
+    CUBASE_RAMP_RATE=50        ramp clock steps per second
+    CUBASE_MIDI_FEEDBACK_PORT  MIDI input carrying Cubase feedback (default: the loopMIDI match)
+    CUBASE_MIDI_PORTS=path     port/routing file (default midi_ports.json)
+"""
+
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+
+import rtmidi
+
+from app_log import LOG
+from cc_ramp import Ramp, DEFAULT_CURVE
+from latency_trace import TRACER
+from metrics import (MIDI_CC_MESSAGES, MIDI_NOTE_MESSAGES, MIDI_SUPPRESSED, MIDI_DROPPED, MIDI_CC_COALESCED,
+                     MIDI_PORT_MESSAGES, MIDI_PORT_DROPPED, MIDI_PORT_QUEUE_DEPTH, MIDI_PORT_CONNECTED,
+                     MIDI_FEEDBACK, MIDI_RAMP_STEPS, MIDI_RAMP_CANCELLED, MIDI_RAMPS_ACTIVE)
+
+MIDI_PORT_CHECK = "loopMIDI"
+CHANNEL = 0
+
+DEFAULT_CC_RATE = 50.0
+DEFAULT_RAMP_RATE = 50.0  # ramp clock steps per second
+
+WHEEL_TICK_S = 0.001
+WHEEL_SLOTS = 512  # one revolution ~0.5 s; longer delays stay in their slot for extra rounds
+
+FEEDBACK_INTERVAL_S = 0.05  # Cubase feedback reaches the GUI in batches, at most 20 per second
+ECHO_WINDOW_S = 0.5         # an incoming value we sent this recently is our own echo
+ECHO_HISTORY = 16
+
+PORTS_FILE = "midi_ports.json"
+PORT_QUEUE_SIZE = 1024
+RECONNECT_S = 5.0
+MESSAGE_KINDS = ("cc", "note", "pitch_bend", "other")
+
+
+def cc_rate_from_env():
+    try:
+        return float(os.environ.get("CUBASE_CC_RATE", DEFAULT_CC_RATE))
+    except ValueError:
+        print("[WARN] CUBASE_CC_RATE must be a number")
+        return DEFAULT_CC_RATE
+
+
+def ramp_rate_from_env():
+    try:
+        return max(1.0, float(os.environ.get("CUBASE_RAMP_RATE", DEFAULT_RAMP_RATE)))
+    except ValueError:
+        print("[WARN] CUBASE_RAMP_RATE must be a number")
+        return DEFAULT_RAMP_RATE
+
+
+def message_kind(message):
+    status = message[0] & 0xF0
+    if status == 0xB0:
+        return "cc"
+    if status in (0x80, 0x90):
+        return "note"
+    if status == 0xE0:
+        return "pitch_bend"
+    return "other"
+
+
+def load_routes(port_match=MIDI_PORT_CHECK, path=None):
+    """Output port rules, primary ("main") first: [{'name', 'match', 'types', 'ccs'}]"""
+    routes = [{"name": "main", "match": port_match}]
+    path = path or os.environ.get("CUBASE_MIDI_PORTS", PORTS_FILE)
+    if not os.path.exists(path):
+        return routes
+    try:
+        with open(path, "r", encoding='utf-8') as f:
+            extra = json.load(f).get("ports", [])
+    except (ValueError, OSError, AttributeError) as e:
+        print(f"[ERROR] {path} could not be read ({e}), using {port_match} only")
+        return routes
+    for route in extra:
+        if not isinstance(route, dict) or not route.get("name"):
+            print(f"[WARN] {path}: ignoring port entry without a name: {route}")
+        elif route["name"] == "main":
+            routes[0] = dict(routes[0], **route)
+        elif not route.get("match"):
+            print(f"[WARN] {path}: port '{route['name']}' has no \"match\", ignored")
+        else:
+            routes.append(route)
+    return routes
+
+
+class OutputPort:
+    """One MIDI output with its own queue and writer thread"""
+
+    def __init__(self, name, match, types=None, ccs=None, primary=False, queue_size=PORT_QUEUE_SIZE):
+        self.name = name
+        self.match = match
+        self.types = set(types) if types else set(MESSAGE_KINDS)
+        self.ccs = set(ccs) if ccs else None
+        self.primary = primary
+        self.queue_size = queue_size
+        self.midiout = rtmidi.MidiOut()
+        self.port_name = None
+        self.is_connected = False
+        self._queue = deque()   # (message, origin_ns, enqueued_ns)
+        self._wake = threading.Event()
+        self._thread = None
+        self._sent = MIDI_PORT_MESSAGES.labels(port=name)
+        self._dropped = MIDI_PORT_DROPPED.labels(port=name)
+        MIDI_PORT_QUEUE_DEPTH.labels(port=name).fn = lambda: len(self._queue)
+        MIDI_PORT_CONNECTED.labels(port=name).fn = lambda: self.is_connected
+
+    def accepts(self, kind, message):
+        if kind not in self.types:
+            return False
+        return self.ccs is None or kind != "cc" or message[1] in self.ccs
+
+    def connect(self, quiet=False):
+        try:
+            ports = self.midiout.get_ports()
+            for i, name in enumerate(ports):
+                if self.match in name:
+                    self.midiout.open_port(i)
+                    self.port_name = name
+                    self.is_connected = True
+                    LOG.info("midi", "Connected to %s%s", name, "" if self.primary else f" (port '{self.name}')")
+                    return True
+        except Exception as e:
+            if not quiet:
+                LOG.error("midi", "[ERROR] MIDI port '%s': %s", self.name, e)
+            return False
+        if not quiet:
+            if self.primary:
+                LOG.warn("midi", "%s not found!", self.match)
+            else:
+                LOG.warn("midi", "[WARN] MIDI port '%s': %s not found, retrying every %g s",
+                         self.name, self.match, RECONNECT_S)
+        return False
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"midi-out:{self.name}", daemon=True)
+            self._thread.start()
+
+    def put(self, message, origin_ns=None, enqueued_ns=None):
+        """Queue a message (never blocks); False if it was dropped"""
+        if not self.is_connected:
+            self._dropped.inc()
+            return False
+        if len(self._queue) >= self.queue_size:
+            try:
+                self._queue.popleft()  # a stalled port keeps only the newest messages
+            except IndexError:
+                pass
+            self._dropped.inc()
+        self._queue.append((message, origin_ns, enqueued_ns))
+        self._wake.set()
+        return True
+
+    def _run(self):
+        queue = self._queue
+        while True:
+            if not self.is_connected:
+                queue.clear()
+                self._wake.wait(RECONNECT_S)
+                self._wake.clear()
+                if self.connect(quiet=True):
+                    LOG.info("midi", "[OK] MIDI port '%s' reconnected", self.name)
+                continue
+            while queue:
+                try:
+                    message, origin_ns, enqueued_ns = queue.popleft()
+                except IndexError:
+                    break
+                self._write(message, origin_ns, enqueued_ns)
+            self._wake.wait()
+            self._wake.clear()
+
+    def _write(self, message, origin_ns, enqueued_ns):
+        t0 = time.perf_counter_ns()
+        try:
+            self.midiout.send_message(message)
+        except Exception as e:
+            self._dropped.inc()
+            LOG.warn("midi", "[WARN] MIDI port '%s' failed (%s), reconnecting", self.name, e)
+            self.is_connected = False
+            try:
+                self.midiout.close_port()
+            except Exception:
+                pass
+            return
+        self._sent.inc()
+        if self.primary:
+            TRACER.record('midi_send', time.perf_counter_ns() - t0)
+            if enqueued_ns is not None:
+                TRACER.record_since('midi_queue_wait', enqueued_ns)
+            if origin_ns is not None:
+                TRACER.record_since('capture_to_midi_send', origin_ns)
+            if message[0] & 0xF0 == 0xB0:
+                LOG.debug("midi", "MIDI Send: CC %d -> Value %d", message[1], message[2])
+
+    def stats(self):
+        return {'connected': self.is_connected, 'port': self.port_name, 'sent': self._sent.value,
+                'dropped': self._dropped.value, 'queued': len(self._queue)}
+
+
+class TimerWheel:
+    """Hashed timer wheel, used by one thread only. Items never fire before their due time."""
+
+    def __init__(self, tick_s=WHEEL_TICK_S, slots=WHEEL_SLOTS):
+        self.tick_s = tick_s
+        self.slots = [[] for _ in range(slots)]
+        self.origin = time.perf_counter()
+        self.current = 0   # next tick to expire
+        self.count = 0
+
+    def schedule(self, due, item):
+        tick = max(self.current, math.ceil((due - self.origin) / self.tick_s))
+        self.slots[tick % len(self.slots)].append((tick, due, item))
+        self.count += 1
+
+    def advance(self, now):
+        """[(due, item)] of every entry whose tick has passed"""
+        target = int((now - self.origin) / self.tick_s)
+        if self.count == 0:
+            self.current = max(self.current, target + 1)
+            return []
+        expired = []
+        n = len(self.slots)
+        # Walk at most one revolution: after that every slot has been visited
+        stop = min(target, self.current + n - 1)
+        while self.current <= stop:
+            slot = self.slots[self.current % n]
+            if slot:
+                keep = []
+                for entry in slot:
+                    if entry[0] <= target:
+                        expired.append(entry[1:])
+                    else:
+                        keep.append(entry)
+                self.slots[self.current % n] = keep
+            self.current += 1
+        self.current = max(self.current, target + 1)
+        self.count -= len(expired)
+        return expired
+
+    def next_due(self):
+        """Due time of the earliest entry, or None when empty"""
+        if self.count == 0:
+            return None
+        n = len(self.slots)
+        for offset in range(n):
+            tick = self.current + offset
+            for entry in self.slots[tick % n]:
+                if entry[0] == tick:
+                    return entry[1]
+        return min(entry[1] for slot in self.slots for entry in slot)
+
+
+class MidiHandler:
+    def __init__(self, cc_rate=None, port_match=MIDI_PORT_CHECK, routes=None):
+        """
+        Args:
+            cc_rate: Max messages per second per CC (default CUBASE_CC_RATE or 50)
+            port_match: Primary output = first port whose name contains this
+            routes: Output port rules (default: primary + midi_ports.json), see load_routes()
+        """
+        self.port_match = port_match
+        routes = load_routes(port_match) if routes is None else routes
+        self.ports = [OutputPort(r["name"], r["match"], r.get("types"), r.get("ccs"), primary=(i == 0))
+                      for i, r in enumerate(routes)]
+        self.midiout = self.ports[0].midiout
+        self.last_sent = {}
+        self.cc_rate = 0.0
+        self._interval = 0.0
+        self._lock = threading.Lock()   # CC coalescing state only, never held while sending
+        self._pending = {}              # cc -> latest value not sent yet
+        self._next_due = {}             # cc -> perf_counter() time the cc may be sent again
+        self._flush_scheduled = set()
+        self._recent = {}               # cc -> deque of (time, value) we sent, to recognise Cubase's echoes
+        self._feedback = {}             # cc -> value received from Cubase, not delivered yet
+        self._feedback_callback = None
+        self.midiin = None
+        self._ramps = {}                # cc -> Ramp moving it
+        self._ramp_list = []            # active Ramps, in start order
+        self._ramp_clock = None         # scheduled time of the next ramp step (None = clock stopped)
+        self._ramp_last = None          # when the previous step actually ran
+        self.ramp_period = 1.0 / ramp_rate_from_env()
+        MIDI_RAMPS_ACTIVE.set_function(lambda: len(self._ramps))
+        self._inbox = deque()           # (due or None, message or callable, origin_ns, enqueued_ns)
+        self._wake = threading.Event()
+        self._wheel = TimerWheel()
+        self._sender = None
+        self.set_cc_rate(cc_rate_from_env() if cc_rate is None else cc_rate)
+        self.connect()
+
+    def set_cc_rate(self, cc_rate):
+        """Max messages per second per CC (0 = send every value)"""
+        with self._lock:
+            self.cc_rate = cc_rate
+            self._interval = 1.0 / cc_rate if cc_rate > 0 else 0.0
+
+    def connect(self):
+        """Open every output port (missing ones keep retrying in the background)"""
+        for port in self.ports:
+            port.connect()
+            port.start()
+        self._start_sender()
+        return self.is_connected
+
+    @property
+    def is_connected(self):
+        """True while at least one output port is open"""
+        return any(port.is_connected for port in self.ports)
+
+    @property
+    def port_name(self):
+        return self.ports[0].port_name
+
+    # --- non-blocking API (any thread) ---
+    def _enqueue(self, item, delay=None, origin_ns=None):
+        due = time.perf_counter() + delay if delay else None
+        self._inbox.append((due, item, origin_ns, time.perf_counter_ns()))
+        self._wake.set()
+
+    def send_cc(self, cc, value):
+        if not self.is_connected:
+            MIDI_DROPPED.inc()
+            return
+        val = max(0, min(127, int(value)))
+        with self._lock:
+            if cc in self._ramps:
+                self._cancel_ramp_locked(cc)  # the user grabbed the control: manual value wins
+            if cc in self._pending:
+                # Still rate limited: replace the pending value (or drop it if we are back at the sent value)
+                if val == self.last_sent.get(cc):
+                    del self._pending[cc]
+                else:
+                    self._pending[cc] = val
+                MIDI_CC_COALESCED.inc()
+                return
+            if self.last_sent.get(cc) == val:
+                MIDI_SUPPRESSED.inc()
+                return
+            now = time.perf_counter()
+            due = self._next_due.get(cc, 0.0)
+            if now >= due:
+                self._mark_sent_locked(cc, val, now)
+            else:
+                self._pending[cc] = val
+                if cc in self._flush_scheduled:
+                    return
+                self._flush_scheduled.add(cc)
+        if now >= due:
+            self._enqueue([0xB0 | CHANNEL, cc, val])
+        else:
+            self._enqueue(lambda: self._flush_cc(cc), delay=due - now)
+
+    def send_burst(self, ccs, pulses=(), hold_s=0.05, force=False):
+        """
+        Preset recall: CC values written back to back in one sender-thread pass.
+        ccs: {cc: value}, skipped when unchanged unless force; pulses: ccs to pulse 127 -> 0.
+        Returns the number of messages queued.
+        """
+        if not self.is_connected:
+            for _ in range(len(ccs) + len(pulses)):
+                MIDI_DROPPED.inc()
+            return 0
+        messages = []
+        with self._lock:
+            now = time.perf_counter()
+            for cc, value in list(ccs.items()) + [(cc, 127) for cc in pulses]:
+                if cc in self._ramps:
+                    self._cancel_ramp_locked(cc)
+                val = max(0, min(127, int(value)))
+                self._pending.pop(cc, None)  # the recalled value replaces one still waiting for its rate limit
+                if not force and cc not in pulses and self.last_sent.get(cc) == val:
+                    MIDI_SUPPRESSED.inc()
+                    continue
+                self._mark_sent_locked(cc, val, now)
+                messages.append([0xB0 | CHANNEL, cc, val])
+        if messages:
+            self._enqueue(messages)
+        for cc in pulses:
+            self._enqueue(lambda cc=cc: self.send_cc(cc, 0), delay=hold_s)
+        return len(messages)
+
+    def pulse_cc(self, cc, hold_s):
+        """Momentary button: 127 now (always, even if Cubase echoed 127 last), 0 after hold_s"""
+        self.send_burst({}, pulses=[cc], hold_s=hold_s)
+
+    def send_note(self, note, velocity, duration_s, channel=CHANNEL, origin_ns=None):
+        """Note-on now, note-off after duration_s"""
+        if not self.is_connected:
+            for _ in range(2):
+                MIDI_DROPPED.inc()
+            return
+        self._enqueue([0x90 | channel, note, velocity], origin_ns=origin_ns)
+        self._enqueue([0x80 | channel, note, 0], delay=duration_s)
+
+    def send_message(self, message):
+        """Raw MIDI message (live note stream), dropped when not connected"""
+        if self.is_connected:
+            self._enqueue(message)
+        else:
+            MIDI_DROPPED.inc()
+
+    def schedule(self, delay_s, message):
+        """Raw MIDI message after delay_s"""
+        if self.is_connected:
+            self._enqueue(message, delay=delay_s)
+        else:
+            MIDI_DROPPED.inc()
+
+    def flush(self):
+        """Queue every pending CC value now, ignoring the rate limit"""
+        with self._lock:
+            now = time.perf_counter()
+            pending, self._pending = self._pending, {}
+            for cc, val in pending.items():
+                self._mark_sent_locked(cc, val, now)
+        for cc, val in pending.items():
+            self._enqueue([0xB0 | CHANNEL, cc, val])
+
+    def drain(self, timeout=0.5):
+        """flush(), then wait (up to timeout) until queued and scheduled messages are sent"""
+        self.flush()
+        deadline = time.perf_counter() + timeout
+        while ((self._inbox or self._wheel.count or any(p._queue for p in self.ports if p.is_connected))
+               and time.perf_counter() < deadline):
+            time.sleep(0.005)
+
+    # --- sender thread ---
+    def _start_sender(self):
+        if self._sender is None:
+            self._sender = threading.Thread(target=self._run, name="midi-out", daemon=True)
+            self._sender.start()
+
+    def _run(self):
+        inbox = self._inbox
+        wheel = self._wheel
+        while True:
+            while inbox:
+                due, item, origin_ns, enqueued_ns = inbox.popleft()
+                if due is None:
+                    self._fire(item, origin_ns, enqueued_ns)
+                else:
+                    wheel.schedule(due, item)
+            now = time.perf_counter()
+            for due, item in wheel.advance(now):
+                TRACER.record('midi_timer_late', int((time.perf_counter() - due) * 1e9))
+                self._fire(item)
+            next_due = wheel.next_due()
+            if inbox:
+                continue
+            self._wake.wait(None if next_due is None else max(0.0, next_due - time.perf_counter()))
+            self._wake.clear()
+
+    def _fire(self, item, origin_ns=None, enqueued_ns=None):
+        if callable(item):
+            try:
+                item()
+            except Exception as e:
+                LOG.error("midi", "[ERROR] Scheduled MIDI task failed: %s", e)
+            return
+        if isinstance(item[0], list):  # burst
+            for message in item:
+                self._fire(message, origin_ns, enqueued_ns)
+            return
+        # Route to every port whose rule matches (each put is a non-blocking append)
+        kind = message_kind(item)
+        if enqueued_ns is None:
+            enqueued_ns = time.perf_counter_ns()
+        routed = False
+        for port in self.ports:
+            if port.accepts(kind, item) and port.put(item, origin_ns, enqueued_ns):
+                routed = True
+        if not routed:
+            MIDI_DROPPED.inc()
+        elif kind == "cc":
+            MIDI_CC_MESSAGES.labels(cc=item[1]).inc()
+        else:
+            MIDI_NOTE_MESSAGES.inc()
+
+    def _mark_sent_locked(self, cc, val, now):
+        self.last_sent[cc] = val
+        self._next_due[cc] = now + self._interval
+        recent = self._recent.get(cc)
+        if recent is None:
+            recent = self._recent[cc] = deque(maxlen=ECHO_HISTORY)
+        recent.append((now, val))
+
+    def _flush_cc(self, cc):
+        """Send the pending value of cc (sender thread, when its rate limit expires)"""
+        with self._lock:
+            self._flush_scheduled.discard(cc)
+            if cc not in self._pending:
+                return
+            val = self._pending.pop(cc)
+            self._mark_sent_locked(cc, val, time.perf_counter())
+        self._fire([0xB0 | CHANNEL, cc, val])
+
+    # --- ramps (scene transitions) ---
+    def ramp(self, targets, duration_s, curve=DEFAULT_CURVE, starts=None, on_step=None, on_done=None):
+        """
+        Move CCs {cc: target} from their current values over duration_s along curve, on the fixed-rate
+        ramp clock (sender thread, ramp_period). Start values: a ramp already moving the CC (it continues
+        from where it is), else starts[cc], else the pending / last sent value. A manual send_cc /
+        send_burst of a CC (or a move in Cubase) cancels its ramp. on_step({cc: value}) runs after each
+        step and on_done(ramp) at the end, both on the sender thread. Returns the Ramp.
+        """
+        now = time.perf_counter()
+        with self._lock:
+            begin = {}
+            for cc, target in targets.items():
+                current = self._ramps.pop(cc, None)
+                if current is not None:
+                    begin[cc] = current.value(cc, now)
+                    current.ccs.discard(cc)  # superseded by the new ramp
+                elif starts and cc in starts:
+                    begin[cc] = float(starts[cc])
+                elif cc in self._pending:
+                    begin[cc] = float(self._pending[cc])
+                elif cc in self.last_sent:
+                    begin[cc] = float(self.last_sent[cc])
+                else:
+                    begin[cc] = float(target)
+                self._pending.pop(cc, None)  # the ramp replaces a value waiting for its rate limit
+            ramp = Ramp(begin, targets, now, duration_s, curve, on_step, on_done)
+            for cc in ramp.ccs:
+                self._ramps[cc] = ramp
+            self._ramp_list.append(ramp)
+            start_clock = self._ramp_clock is None
+            if start_clock:
+                self._ramp_clock = now
+        if start_clock:
+            self._enqueue(self._ramp_step)
+        return ramp
+
+    def cancel_ramps(self, ccs=None):
+        """Stop ramping ccs (default: all) where they are"""
+        with self._lock:
+            for cc in list(self._ramps) if ccs is None else ccs:
+                if cc in self._ramps:
+                    self._cancel_ramp_locked(cc)
+
+    def _cancel_ramp_locked(self, cc):
+        ramp = self._ramps.pop(cc)
+        ramp.ccs.discard(cc)
+        ramp.cancelled.add(cc)
+        MIDI_RAMP_CANCELLED.inc()
+
+    def _ramp_step(self):
+        """Sender thread: one clock step of every active ramp, evaluated at the scheduled step time"""
+        now = time.perf_counter()
+        messages = []
+        stepped = []
+        finished = []
+        with self._lock:
+            t = self._ramp_clock
+            if t is None:
+                return
+            TRACER.record('midi_ramp_step_late', int((now - t) * 1e9))
+            if self._ramp_last is not None:
+                TRACER.record('midi_ramp_period', int((now - self._ramp_last) * 1e9))
+            self._ramp_last = now
+            for ramp in self._ramp_list:
+                values = {}
+                for cc in ramp.ccs:
+                    values[cc] = ramp.value(cc, t)
+                    val = int(round(values[cc]))
+                    if self.last_sent.get(cc) != val:  # only integer changes go out
+                        self._mark_sent_locked(cc, val, now)
+                        messages.append([0xB0 | CHANNEL, cc, val])
+                ramp.steps += 1
+                if values:
+                    stepped.append((ramp, values))
+                if not ramp.ccs or ramp.finished(t):
+                    finished.append(ramp)
+            for ramp in finished:
+                self._ramp_list.remove(ramp)
+                for cc in ramp.ccs:
+                    if self._ramps.get(cc) is ramp:
+                        del self._ramps[cc]
+            # Next step on the fixed grid; after a stall, skip to the next grid point (no catch-up burst)
+            due = None
+            if self._ramp_list:
+                due = t + self.ramp_period
+                if due <= now:
+                    due += math.ceil((now - due) / self.ramp_period) * self.ramp_period
+            self._ramp_clock = due
+            if due is None:
+                self._ramp_last = None
+        MIDI_RAMP_STEPS.inc()
+        if messages:
+            self._fire(messages)
+        for ramp, values in stepped:
+            if ramp.on_step is not None:
+                self._call(ramp.on_step, values)
+        for ramp in finished:
+            if ramp.on_done is not None:
+                self._call(ramp.on_done, ramp)
+        if due is not None:
+            self._wheel.schedule(due, self._ramp_step)
+
+    @staticmethod
+    def _call(callback, arg):
+        try:
+            callback(arg)
+        except Exception as e:
+            LOG.error("midi", "[ERROR] Ramp callback failed: %s", e)
+
+    # --- feedback from Cubase ---
+    def start_feedback(self, callback, port_match=None):
+        """
+        Listen for CC feedback (Quick Control values echoed by CustomController.js) on the first MIDI
+        input whose name contains port_match (default CUBASE_MIDI_FEEDBACK_PORT or the output match).
+        Values keep last_sent in sync with Cubase; callback({cc: value}) gets them in batches at most
+        every FEEDBACK_INTERVAL_S, on the sender thread. Echoes of our own recent sends are ignored.
+        """
+        self._feedback_callback = callback
+        match = port_match or os.environ.get("CUBASE_MIDI_FEEDBACK_PORT", self.port_match)
+        try:
+            midiin = rtmidi.MidiIn()
+            for i, name in enumerate(midiin.get_ports()):
+                if match in name:
+                    midiin.ignore_types(sysex=True, timing=True, active_sense=True)
+                    midiin.set_callback(self._on_input)
+                    midiin.open_port(i)
+                    self.midiin = midiin
+                    LOG.info("feedback", "[OK] MIDI feedback from %s", name)
+                    return True
+        except Exception as e:
+            LOG.error("feedback", "[ERROR] MIDI feedback input could not be opened: %s", e)
+            return False
+        LOG.warn("feedback", "[WARN] No MIDI input matching '%s': Cubase feedback disabled", match)
+        return False
+
+    def _on_input(self, event, data=None):
+        """rtmidi input thread: one incoming message"""
+        message = event[0]
+        if len(message) != 3 or message[0] != (0xB0 | CHANNEL):
+            return
+        cc, val = message[1], message[2]
+        now = time.perf_counter()
+        with self._lock:
+            if self.last_sent.get(cc) == val or any(
+                    now - t < ECHO_WINDOW_S and v == val for t, v in self._recent.get(cc, ())):
+                MIDI_FEEDBACK.labels(kind="echo").inc()
+                return
+            self.last_sent[cc] = val
+            if cc in self._ramps:
+                self._cancel_ramp_locked(cc)  # moved in Cubase
+            first = not self._feedback
+            self._feedback[cc] = val
+        MIDI_FEEDBACK.labels(kind="applied").inc()
+        if first:
+            self._enqueue(self._deliver_feedback, delay=FEEDBACK_INTERVAL_S)
+
+    def _deliver_feedback(self):
+        with self._lock:
+            batch, self._feedback = self._feedback, {}
+        if batch and self._feedback_callback is not None:
+            self._feedback_callback(batch)
+
+    # --- stats ---
+    def cc_stats(self):
+        """{'sent', 'coalesced', 'suppressed', 'pending'} CC message counts"""
+        return {
+            'sent': sum(child.value for child in list(MIDI_CC_MESSAGES.children.values())),
+            'coalesced': MIDI_CC_COALESCED.value,
+            'suppressed': MIDI_SUPPRESSED.value,
+            'pending': len(self._pending),
+        }
+
+    def format_cc_stats(self):
+        stats = self.cc_stats()
+        line = (f"[MIDI] CC sent {stats['sent']}, coalesced {stats['coalesced']}, "
+                f"unchanged {stats['suppressed']} (max {self.cc_rate:g}/s per CC)")
+        if len(self.ports) > 1:
+            for port in self.ports:
+                st = port.stats()
+                line += (f"\n[MIDI] Port '{port.name}' ({st['port'] or port.match + ' - not connected'}): "
+                         f"sent {st['sent']}, dropped {st['dropped']}")
+        summary = TRACER.summary()
+        late = summary.get('midi_timer_late')
+        if late:
+            line += (f"\n[MIDI] Timer jitter ({late['count']} scheduled): p50 {late['p50_ms']:.2f} ms, "
+                     f"p99 {late['p99_ms']:.2f} ms, max {late['max_ms']:.2f} ms")
+        step = summary.get('midi_ramp_step_late')
+        period = summary.get('midi_ramp_period')
+        if step:
+            line += (f"\n[MIDI] Ramp steps {step['count']} every {self.ramp_period * 1000:.0f} ms: "
+                     f"late p50 {step['p50_ms']:.2f} ms, p99 {step['p99_ms']:.2f} ms")
+            if period:
+                line += f"; period p50 {period['p50_ms']:.2f} ms, p99 {period['p99_ms']:.2f} ms"
+        return line
@@ -0,0 +1,242 @@
+"""
+Note Stream Tracker
+Turns small audio blocks into a live MIDI note stream (the sung melody) for
+harmonizer / visualisation plugins: small-hop pitch tracking, onset/offset
+detection from level and pitch confidence, and note segmentation with
+hysteresis so vibrato and scoops do not retrigger notes.
+
+Latency budget at 16 kHz (defaults):
+    capture block   8 ms   (RealtimePitchDetector uses hop-sized blocks in note mode)
+    pitch window   32 ms   (the estimate is centred ~16 ms in the past)
+    confirmation    2 hops (16 ms) before a note-on
+Every note-on is stamped with the capture time of the audio that started
+it, so the reported latency (TRACER stage 'note_on') is onset -> MIDI sent,
+driver input latency excluded.
+
+Usage:
+    tracker = NoteTracker(sample_rate=16000, send=midiout.send_message)
+    tracker.process(block, captured_ns)      # block: (samples, 1) float32
+"""
+
+import time
+
+import numpy as np
+
+from latency_trace import TRACER
+from metrics import METRICS
+
+try:
+    import aubio
+    AUBIO_AVAILABLE = True
+except ImportError:
+    AUBIO_AVAILABLE = False
+
+NOTE_STREAM_CHANNEL = 1  # MIDI channel 2 (key detection notes use channel 1)
+
+HOP_S = 0.008
+WINDOW_S = 0.032
+FMIN, FMAX = 65.0, 1100.0  # C2 .. C#6
+
+NOTE_EVENTS = METRICS.counter('note_stream_events_total', 'Note stream MIDI events sent, by type')
+
+
+def yin_pitch(frame, sample_rate, fmin=FMIN, fmax=FMAX, threshold=0.15):
+    """
+    YIN pitch of one frame (numpy fallback when aubio is not installed).
+    Returns (frequency Hz, confidence 0-1); (0, 0) when unvoiced.
+    """
+    n = len(frame)
+    tau_min = max(2, int(sample_rate / fmax))
+    tau_max = min(n // 2, int(sample_rate / fmin))
+    if tau_max <= tau_min:
+        return 0.0, 0.0
+    x = frame.astype(np.float64)
+    w = n - tau_max
+    # Difference function d(tau) = sum (x[j] - x[j+tau])^2 over j < w, via FFT correlation
+    size = 1 << (n + w - 1).bit_length()
+    spec = np.fft.rfft(x, size)
+    corr = np.fft.irfft(spec * np.conj(np.fft.rfft(x[:w], size)), size)[:tau_max + 1]
+    cumsq = np.concatenate(([0.0], np.cumsum(x * x)))
+    energy0 = cumsq[w]
+    energy_tau = cumsq[w:w + tau_max + 1] - cumsq[:tau_max + 1]
+    diff = energy0 + energy_tau - 2 * corr
+    diff[0] = 0.0
+    # Cumulative mean normalized difference
+    cmnd = np.ones_like(diff)
+    running = np.cumsum(diff[1:])
+    cmnd[1:] = diff[1:] * np.arange(1, tau_max + 1) / np.maximum(running, 1e-12)
+    below = np.nonzero(cmnd[tau_min:tau_max] < threshold)[0]
+    if len(below) == 0:
+        return 0.0, 0.0
+    tau = below[0] + tau_min
+    while tau + 1 < tau_max and cmnd[tau + 1] < cmnd[tau]:
+        tau += 1
+    # Parabolic interpolation around the minimum
+    if 0 < tau < tau_max:
+        a, b, c = cmnd[tau - 1], cmnd[tau], cmnd[tau + 1]
+        denom = a - 2 * b + c
+        shift = 0.5 * (a - c) / denom if denom else 0.0
+    else:
+        shift = 0.0
+    return sample_rate / (tau + shift), float(max(0.0, 1.0 - cmnd[tau]))
+
+
+class NoteTracker:
+    """Small-hop pitch tracker + note segmenter that sends raw MIDI messages"""
+
+    def __init__(self, sample_rate=16000, send=None, channel=NOTE_STREAM_CHANNEL, pitch_bend=False,
+                 bend_range=2.0):
+        """
+        Args:
+            sample_rate: Rate of the blocks passed to process()
+            send: Callable taking a raw MIDI message (list of ints), e.g. midiout.send_message
+            channel: MIDI channel (0-15) of the note stream
+            pitch_bend: Also send pitch bend relative to the held note
+            bend_range: Synth pitch bend range in semitones
+        """
+        self.sample_rate = sample_rate
+        self.send = send
+        self.channel = channel
+        self.pitch_bend = pitch_bend
+        self.bend_range = bend_range
+
+        self.hop = max(32, int(round(sample_rate * HOP_S)))
+        self.window = max(2 * self.hop, int(round(sample_rate * WINDOW_S)))
+
+        # Segmentation settings
+        self.gate_db = -45.0            # onset level
+        self.release_db = -52.0         # offset level (hysteresis)
+        self.min_confidence = 0.6
+        self.onset_frames = 2           # stable frames before a note-on
+        self.offset_frames = 3          # unvoiced/quiet frames before a note-off
+        self.change_hysteresis = 0.7    # semitones from the held note before a note change counts
+        self.bend_step = 64             # minimum pitch bend change (of 8192) worth sending
+
+        if AUBIO_AVAILABLE:
+            self._aubio = aubio.pitch("yin", self.window, self.hop, sample_rate)
+            self._aubio.set_unit("midi")
+            self._aubio.set_tolerance(0.15)
+        else:
+            self._aubio = None
+        self._history = np.zeros(self.window, dtype=np.float32)  # numpy YIN window
+        self._carry = np.zeros(0, dtype=np.float32)
+
+        self.reset()
+
+    def reset(self):
+        """Forget the current note (after a stop, device switch or idle period)"""
+        self.current_note = None
+        self._candidate = None
+        self._candidate_frames = 0
+        self._candidate_onset_ns = None
+        self._quiet_frames = 0
+        self._last_bend = 8192
+        self._carry = np.zeros(0, dtype=np.float32)
+
+    # --- analysis ---
+    def _frame_pitch(self, frame):
+        """(midi pitch float or None, confidence, level dBFS) of one hop"""
+        level = float(np.dot(frame, frame) / len(frame))
+        level_db = 10 * np.log10(level) if level > 1e-12 else -120.0
+        if self._aubio is not None:
+            midi = float(self._aubio(frame)[0])
+            confidence = float(self._aubio.get_confidence())
+        else:
+            self._history = np.concatenate((self._history[len(frame):], frame))
+            freq, confidence = yin_pitch(self._history, self.sample_rate)
+            midi = 69 + 12 * np.log2(freq / 440.0) if freq > 0 else 0.0
+        if midi <= 0 or confidence < self.min_confidence:
+            return None, confidence, level_db
+        return midi, confidence, level_db
+
+    def process(self, block, captured_ns=None):
+        """Feed one captured block ((samples, 1) or 1-D); sends MIDI as notes start/stop"""
+        samples = np.asarray(block, dtype=np.float32).reshape(-1)
+        if len(self._carry):
+            samples = np.concatenate((self._carry, samples))
+        n_frames = len(samples) // self.hop
+        if captured_ns is None:
+            captured_ns = time.perf_counter_ns()
+        ns_per_sample = 1e9 / self.sample_rate
+        for i in range(n_frames):
+            frame = samples[i * self.hop:(i + 1) * self.hop]
+            # Capture time of this hop's first sample (captured_ns stamps the block's last sample)
+            frame_ns = captured_ns - int((len(samples) - i * self.hop) * ns_per_sample)
+            self._step(frame, frame_ns)
+        self._carry = samples[n_frames * self.hop:].copy()
+
+    def _step(self, frame, frame_ns):
+        midi, confidence, level_db = self._frame_pitch(frame)
+        held = self.current_note
+
+        # Offset: quiet or unvoiced for offset_frames
+        gate = self.release_db if held is not None else self.gate_db
+        if midi is None or level_db < gate:
+            self._candidate = None
+            self._candidate_frames = 0
+            if held is not None:
+                self._quiet_frames += 1
+                if self._quiet_frames >= self.offset_frames:
+                    self._note_off()
+            return
+        self._quiet_frames = 0
+
+        # Held note: stay on it while within the hysteresis band, bend towards the sung pitch
+        if held is not None and abs(midi - held) < self.change_hysteresis:
+            self._candidate = None
+            self._candidate_frames = 0
+            if self.pitch_bend:
+                self._bend(midi - held)
+            return
+
+        # New (or changed) note candidate must be stable for onset_frames
+        nearest = int(round(midi))
+        if nearest != self._candidate:
+            self._candidate = nearest
+            self._candidate_frames = 1
+            self._candidate_onset_ns = frame_ns
+        else:
+            self._candidate_frames += 1
+        if self._candidate_frames >= self.onset_frames:
+            velocity = int(np.clip(127 + (level_db + 6) * 2.5, 20, 127))
+            self._note_on(nearest, velocity, self._candidate_onset_ns)
+            if self.pitch_bend:
+                self._bend(midi - nearest)
+
+    # --- MIDI ---
+    def _emit(self, message, kind):
+        if self.send is not None:
+            self.send(message)
+        NOTE_EVENTS.labels(type=kind).inc()
+
+    def _note_on(self, note, velocity, onset_ns):
+        if self.current_note is not None:
+            self._note_off()
+        note = max(0, min(127, note))
+        self._emit([0x90 | self.channel, note, velocity], 'note_on')
+        TRACER.record_since('note_on', onset_ns)
+        self.current_note = note
+        self._candidate = None
+        self._candidate_frames = 0
+
+    def _note_off(self):
+        if self.current_note is not None:
+            self._emit([0x80 | self.channel, self.current_note, 0], 'note_off')
+            self.current_note = None
+        self._quiet_frames = 0
+        if self.pitch_bend and self._last_bend != 8192:
+            self._send_bend(8192)
+
+    def _bend(self, semitones):
+        value = int(8192 + max(-1.0, min(1.0, semitones / self.bend_range)) * 8191)
+        if abs(value - self._last_bend) >= self.bend_step:
+            self._send_bend(value)
+
+    def _send_bend(self, value):
+        self._emit([0xE0 | self.channel, value & 0x7F, (value >> 7) & 0x7F], 'pitch_bend')
+        self._last_bend = value
+
+    def flush(self):
+        """Release a held note (call on stop)"""
+        self._note_off()
+        self.reset()
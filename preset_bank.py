@@ -0,0 +1,124 @@
+"""
+Preset Bank
+Named mixer presets per genre (NHẠC TRẺ / BOLERO / REMIX ...), held in
+memory and persisted to presets.json.
+
+A preset is a plain state dict:
+    {"sliders": {"MUSIC_VOL": 100, ...}, "toggles": {"VANG_FX": True, ...}, "tone": 0.0}
+
+Recall is diff-based: diff_states(current, target) returns only what
+differs, so the GUI sends just the changed CCs (one burst through
+MidiHandler.send_burst) and never resends unchanged values.
+
+Usage:
+    bank = PresetBank()                       # loads presets.json if present
+    bank.store("BOLERO", state)               # preset "default" of BOLERO
+    target = bank.get("BOLERO")
+    changes = diff_states(current_state, target)
+    bank.save()
+"""
+
+import itertools
+import json
+import os
+import threading
+
+from settings_store import atomic_write_text
+
+PRESETS_FILE = "presets.json"
+DEFAULT_PRESET = "default"
+
+
+def slider_cc_value(value):
+    """Slider position -> CC value (what is actually sent, so diffs ignore sub-step changes)"""
+    return max(0, min(127, int(value)))
+
+
+def diff_states(current, target):
+    """{'sliders': {key: value}, 'toggles': {key: state}, 'tone': value or None} of what target changes"""
+    cur_sliders = current.get("sliders", {})
+    cur_toggles = current.get("toggles", {})
+    sliders = {k: v for k, v in target.get("sliders", {}).items()
+               if k not in cur_sliders or slider_cc_value(cur_sliders[k]) != slider_cc_value(v)}
+    toggles = {k: bool(v) for k, v in target.get("toggles", {}).items()
+               if bool(cur_toggles.get(k, False)) != bool(v)}
+    tone = target.get("tone")
+    if tone is not None and current.get("tone") is not None and float(tone) == float(current["tone"]):
+        tone = None
+    return {"sliders": sliders, "toggles": toggles, "tone": tone}
+
+
+class PresetBank:
+    """{genre: {"active": name, "presets": {name: state}}}"""
+
+    def __init__(self, path=PRESETS_FILE):
+        self.path = path
+        self.genres = {}
+        self._save_seq = itertools.count()
+        self._written_seq = -1
+        self._write_lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding='utf-8') as f:
+                self.genres = json.load(f).get("genres", {})
+            total = sum(len(g.get("presets", {})) for g in self.genres.values())
+            print(f"[PRESET] {total} preset(s) loaded from {self.path}")
+        except Exception as e:
+            print(f"[ERROR] Preset bank {self.path} could not be loaded: {e}")
+
+    def save(self, background=False):
+        """Atomic write of presets.json (background: serialize now, write on a thread)"""
+        text = json.dumps({"genres": self.genres}, indent=4, ensure_ascii=False)
+        seq = next(self._save_seq)
+        if background:
+            threading.Thread(target=self._write, args=(text, seq), name="preset-save", daemon=True).start()
+        else:
+            self._write(text, seq)
+
+    def _write(self, text, seq):
+        """One writer at a time; a save overtaken by a newer one is skipped"""
+        try:
+            with self._write_lock:
+                if seq < self._written_seq:
+                    return
+                atomic_write_text(self.path, text)
+                self._written_seq = seq
+        except Exception as e:
+            print(f"[ERROR] Preset bank could not be saved: {e}")
+
+    def names(self, genre):
+        return list(self.genres.get(genre, {}).get("presets", {}))
+
+    def active_name(self, genre):
+        return self.genres.get(genre, {}).get("active", DEFAULT_PRESET)
+
+    def get(self, genre, name=None):
+        """Preset state (a copy), or None if the genre has no such preset"""
+        entry = self.genres.get(genre)
+        if not entry:
+            return None
+        state = entry.get("presets", {}).get(name or entry.get("active", DEFAULT_PRESET))
+        return json.loads(json.dumps(state)) if state is not None else None
+
+    def store(self, genre, state, name=None):
+        """Store state as preset `name` (default: the genre's active preset) and make it active"""
+        entry = self.genres.setdefault(genre, {"active": DEFAULT_PRESET, "presets": {}})
+        name = name or entry.get("active", DEFAULT_PRESET)
+        entry["presets"][name] = {
+            "sliders": {k: float(v) for k, v in state.get("sliders", {}).items()},
+            "toggles": {k: bool(v) for k, v in state.get("toggles", {}).items()},
+            "tone": float(state.get("tone", 0.0)),
+        }
+        entry["active"] = name
+
+    def delete(self, genre, name):
+        entry = self.genres.get(genre)
+        if entry and entry.get("presets", {}).pop(name, None) is not None:
+            if entry.get("active") == name:
+                entry["active"] = next(iter(entry["presets"]), DEFAULT_PRESET)
+            return True
+        return False
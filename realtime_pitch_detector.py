@@ -8,9 +8,25 @@ import numpy as np
 import sounddevice as sd
 import threading
 import time
-from collections import Counter
+from collections import Counter, namedtuple
 import queue
 import sys
+import os
+import gc
+import importlib.util
+import traceback
+import math
+
+from app_log import LOG
+from latency_trace import TRACER
+from device_registry import get_registry, PORTAUDIO_LOCK
+from note_tracker import NoteTracker
+from tuning_estimator import TuningEstimator
+import metrics
+import sampling_profiler
+from metrics import (AUDIO_BLOCKS, AUDIO_OVERRUNS, AUDIO_QUEUE_DEPTH, FRAMES, GATED_FRAMES,
+                     INFERENCE_LAST, INFERENCE_SUM, INFERENCE_COUNT, DETECTIONS, KEY_CONFIDENCE,
+                     DETECTOR_RUNNING, DETECTOR_IDLE, DETECTOR_WAKEUPS, DETECTOR_CPU_SECONDS)
 
 # Fix Windows console encoding
 try:
@@ -18,18 +34,27 @@ try:
 except:
     pass
 
-# Pitch detection
+# Pitch detection (both backends are usable when installed, CREPE is preferred).
+# CREPE is imported lazily on first use: it pulls in TensorFlow (hundreds of MB).
+CREPE_AVAILABLE = importlib.util.find_spec('crepe') is not None
+crepe = None
+
 try:
-    import crepe
+    import aubio
+    AUBIO_AVAILABLE = True
+except ImportError:
+    AUBIO_AVAILABLE = False
+
+if CREPE_AVAILABLE:
     USE_CREPE = True
     print("[OK] Using CREPE (High Accuracy)")
-except ImportError:
-    try:
-        import aubio
-        USE_CREPE = False
-        print("[OK] Using AUBIO (Fast, Good Accuracy)")
-    except ImportError:
-        raise ImportError("Please install: pip install crepe tensorflow sounddevice (or aubio)")
+elif AUBIO_AVAILABLE:
+    USE_CREPE = False
+    print("[OK] Using AUBIO (Fast, Good Accuracy)")
+else:
+    raise ImportError("Please install: pip install crepe tensorflow sounddevice (or aubio)")
+
+LOOPBACK_SAMPLE_RATE = 44100
 
 # MIDI Note to Key mapping
 NOTE_NAMES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
@@ -44,65 +69,233 @@ AUTOTUNE_KEY_MAP = {
 # Auto-Tune Scale Types (0=Major, 1=Minor)
 SCALE_TYPES = {'major': 0, 'minor': 1}
 
+# Lean mode (CUBASE_LEAN=1): smallest backend, capped capture queue,
+# CREPE model released on stop. Memory target: see memory_report.py
+LEAN_QUEUE_BLOCKS = 64  # ~4 s of 1024-sample blocks at 16 kHz
+
+
+# Idle mode (CUBASE_IDLE=0 disables): after IDLE_AFTER_S of silence only a
+# level monitor runs, on IDLE_BLOCK_S blocks (that block length bounds the wake-up delay)
+IDLE_AFTER_S = 4.0
+IDLE_BLOCK_S = 0.5
+SILENCE_DBFS = -50.0
+
+# Live view for the GUI meters: the detection thread swaps in a new immutable
+# DetectorSnapshot at most every SNAPSHOT_INTERVAL_S; readers take
+# detector.snapshot (one reference read, no lock) and never touch the history
+SNAPSHOT_INTERVAL_S = 1 / 30
+PITCH_HOLD_S = 0.25      # the current pitch is dropped after this long without a voiced frame
+RANKING_SIZE = 3
+LEVEL_FLOOR_DB = -90.0
+
+# level_db: loudest block since the last snapshot (dBFS); pitch: MIDI note (float,
+# tuning corrected) or None; histogram: 12 pitch-class shares of the analysis
+# window; ranking: tonic candidates ((key, share), ...) by share, as
+# analyze_key_and_scale picks the tonic; confidence: see key_confidence
+DetectorSnapshot = namedtuple('DetectorSnapshot', 'seq time_ns running idle level_db pitch histogram ranking '
+                                                  'key scale confidence')
+EMPTY_SNAPSHOT = DetectorSnapshot(0, 0, False, False, LEVEL_FLOOR_DB, None, (0.0,) * 12, (), None, None, 0.0)
+
+
+def level_to_db(level):
+    """Block RMS -> dBFS (LEVEL_FLOOR_DB for silence)"""
+    return max(LEVEL_FLOOR_DB, 20 * math.log10(level)) if level > 0 else LEVEL_FLOOR_DB
+
+
+def lean_mode_enabled():
+    return os.environ.get('CUBASE_LEAN', '0') not in ('', '0')
+
+
+def idle_mode_enabled():
+    return os.environ.get('CUBASE_IDLE', '1') not in ('', '0')
+
+
+def load_crepe():
+    """Import CREPE (and TensorFlow) on first use"""
+    global crepe
+    if crepe is None:
+        import crepe as crepe_module
+        crepe = crepe_module
+    return crepe
+
 
 class RealtimePitchDetector:
     """Detects musical key and scale in realtime from audio input"""
     
-    def __init__(self, midi_callback=None, device_index=None, is_loopback=False):
+    def __init__(self, midi_callback=None, device_index=None, is_loopback=False, backend=None, lean=None,
+                 note_callback=None, pitch_bend=False, tuning_callback=None, failure_callback=None):
         """
         Args:
             midi_callback: Function to call when key/scale detected. Signature: callback(key, scale)
             device_index: Audio device index (None = default device)
             is_loopback: If True, capture from OUTPUT device (WASAPI loopback mode)
                         If False, capture from INPUT device (normal mode)
+            backend: 'crepe' or 'aubio' (None = CREPE if installed, else Aubio;
+                     in lean mode Aubio if installed, else CREPE tiny)
+            lean: Lean memory profile (None = CUBASE_LEAN environment variable)
+            note_callback: Function taking a raw MIDI message (list of ints); enables the
+                           live melody note stream (None = key detection only)
+            pitch_bend: Also send pitch bend in the note stream
+            tuning_callback: Function called with the estimated tuning offset in cents
+                             (vs A4 = 440 Hz) whenever the published estimate changes
+            failure_callback: Function called with a reason (detection thread) when capture
+                              is lost mid-run and the detector has stopped itself
         """
         self.midi_callback = midi_callback
         self.device_index = device_index
         self.is_loopback = is_loopback
+        self.lean = lean_mode_enabled() if lean is None else lean
+        
+        if backend is None:
+            if self.lean:
+                backend = 'aubio' if AUBIO_AVAILABLE else 'crepe'
+            else:
+                backend = 'crepe' if USE_CREPE else 'aubio'
+        if backend == 'crepe' and not CREPE_AVAILABLE:
+            raise ValueError("CREPE backend requested but crepe is not installed")
+        if backend == 'aubio' and not AUBIO_AVAILABLE:
+            raise ValueError("Aubio backend requested but aubio is not installed")
+        self.backend = backend
         
         # Audio settings
-        self.sample_rate = 16000  # CREPE works best at 16kHz
+        self.sample_rate = 16000  # CREPE works best at 16kHz (analysis rate = rate of the queued blocks)
+        self.input_sample_rate = self.sample_rate  # INPUT stream rate (loopback captures at LOOPBACK_SAMPLE_RATE)
+        self.capture_rate = self.sample_rate
         self.buffer_size = 1024
         
         # Detection settings
         self.is_running = False
         self.detection_thread = None
-        self.audio_queue = queue.Queue()
+        self.audio_queue = queue.Queue(maxsize=LEAN_QUEUE_BLOCKS if self.lean else 0)
         
         # Analysis window (collect pitches for X seconds)
         self.analysis_window = 5.0  # seconds
-        self.pitch_history = []
+        self.pitch_history = []  # detection thread only (start() resets it before the thread runs)
+        self.accumulated_audio = []  # CREPE batch buffer (mono samples)
+        
+        # Latency tracing stamps (time.perf_counter_ns)
+        self._batch_start_ns = None  # capture time of the oldest sample in the CREPE batch
+        self._started_ns = None
+        self._history_filled = False
+        self._trace_chunk = False  # per-chunk stages of the current chunk are traced (sampled)
         self.last_detected_key = None
         self.last_detected_scale = None
+        self.key_confidence = 0.0  # share of analyzed notes inside the detected scale
+        
+        # Live snapshot (replaced, never mutated) and what the next one is built from
+        self.snapshot = EMPTY_SNAPSHOT
+        self._snapshot_level = 0.0
+        self._snapshot_due_ns = 0
+        self._pitch = None
+        self._pitch_ns = 0
+        
+        # Reference tuning (A4 offset), corrects note binning for detuned singers/tracks
+        self.tuning = TuningEstimator()
+        self.tuning_callback = tuning_callback
+        self.failure_callback = failure_callback
+        
+        # Idle mode: level monitor on large blocks after sustained silence
+        self.idle_enabled = idle_mode_enabled()
+        self.idle_after = IDLE_AFTER_S
+        self.silence_threshold = 10 ** (SILENCE_DBFS / 20)  # block RMS
+        self.is_idle = False
+        self.capture_block = self.buffer_size  # frames per captured block
+        self._last_signal_ns = None
+        self._mode_since_ns = None
+        self.mode_seconds = {'active': 0.0, 'idle': 0.0}
+        self.mode_wakeups = {'active': 0, 'idle': 0}
+        self.mode_cpu = {'active': 0.0, 'idle': 0.0}
+        self.stream = None
+        self.input_latency = None
+        self.loopback_thread = None
+        
+        # Live note stream (small-hop path, see note_tracker.py); key detection keeps buffer_size blocks
+        self.note_callback = note_callback
+        self.pitch_bend = pitch_bend
+        self.note_tracker = None
+        self._key_carry = None
+        if note_callback is not None:
+            self.note_tracker = NoteTracker(self.sample_rate, send=note_callback, pitch_bend=pitch_bend)
+        self._stream_lock = threading.Lock()  # guards opening/closing the capture source
         
         # Confidence threshold
         self.confidence_threshold = 0.5  # For CREPE
         
-        # Initialize detector based on available library
-        if USE_CREPE:
+        # Initialize detector based on selected backend
+        if self.backend == 'crepe':
             self.init_crepe()
         else:
             self.init_aubio()
     
     def init_crepe(self):
-        """Initialize CREPE-based detection"""
-        print("Initializing CREPE pitch detector...")
+        """Initialize CREPE-based detection (the model itself loads on the first batch)"""
+        LOG.info("detector", "Initializing CREPE pitch detector...")
+        try:
+            load_crepe()
+        except ImportError as e:
+            if not AUBIO_AVAILABLE:
+                raise
+            LOG.warn("detector", f"[WARN] CREPE unavailable ({e}), falling back to AUBIO")
+            self.backend = 'aubio'
+            self.init_aubio()
+            return
         self.model_capacity = 'tiny'  # Options: 'tiny', 'small', 'medium', 'large', 'full'
         # 'tiny' is fastest, 'full' is most accurate but slower
-        # For realtime, use 'tiny' or 'small'
+        # For realtime, use 'tiny' or 'small' (lean mode always uses 'tiny')
+        self.step_size = 100  # ms between predictions
+    
+    def release_model(self):
+        """Free the CREPE model weights; crepe rebuilds the model lazily on the next batch"""
+        crepe_core = sys.modules.get('crepe.core')
+        if self.backend != 'crepe' or crepe_core is None:
+            return
+        models = getattr(crepe_core, 'models', {})
+        if models.get(self.model_capacity) is None:
+            return
+        models[self.model_capacity] = None
+        tf = sys.modules.get('tensorflow')
+        if tf is not None:
+            try:
+                tf.keras.backend.clear_session()
+            except Exception as e:
+                LOG.warn("detector", f"[WARN] TensorFlow clear_session failed: {e}")
+        gc.collect()
+        LOG.info("detector", f"[LEAN] Released CREPE '{self.model_capacity}' model")
+    
+    def enqueue_audio(self, item):
+        """
+        Queue a (captured_ns, block) item, or a control item (a callable marker, the None
+        stop sentinel). A full (lean) queue drops its oldest audio block, never a control
+        item: those may go past maxsize.
+        """
+        q = self.audio_queue
+        if not q.maxsize:
+            q.put_nowait(item)
+            return
+        with q.mutex:
+            if len(q.queue) >= q.maxsize:
+                AUDIO_OVERRUNS.inc()
+                oldest = next((i for i, queued in enumerate(q.queue) if isinstance(queued, tuple)), None)
+                if oldest is not None:
+                    del q.queue[oldest]
+                elif isinstance(item, tuple):
+                    return  # only control items queued: drop this block
+            q.queue.append(item)
+            q.unfinished_tasks += 1
+            q.not_empty.notify()
     
     def init_aubio(self):
         """Initialize Aubio-based detection (fallback)"""
-        print("Initializing AUBIO pitch detector...")
+        LOG.info("detector", "Initializing AUBIO pitch detector...")
         self.aubio_pitch = aubio.pitch("yinfft", self.buffer_size, self.buffer_size, self.sample_rate)
         self.aubio_pitch.set_unit("Hz")
         self.aubio_pitch.set_silence(-40)
     
     def freq_to_midi_note(self, freq):
-        """Convert frequency (Hz) to MIDI note number"""
+        """Convert frequency (Hz) to MIDI note number (binned around the estimated tuning)"""
         if freq <= 0:
             return None
-        midi_note = 69 + 12 * np.log2(freq / 440.0)
+        midi_note = 69 + 12 * np.log2(freq / 440.0) - self.tuning.offset
         return int(round(midi_note))
     
     def midi_note_to_name(self, midi_note):
@@ -154,287 +347,652 @@ class RealtimePitchDetector:
         # Determine scale
         if major_score >= minor_score:
             scale = 'major'
+            pattern = major_pattern
         else:
             scale = 'minor'
+            pattern = minor_pattern
+        
+        # Confidence: how much of what was sung the detected scale explains
+        in_scale = sum(count for note, count in most_common if (note - tonic) % 12 in pattern)
+        self.key_confidence = in_scale / len(pitches)
         
         return key_name, scale
     
     def audio_callback(self, indata, frames, time_info, status):
         """Callback for audio stream - receives audio chunks"""
+        captured_ns = time.perf_counter_ns()
+        AUDIO_BLOCKS.inc()
         if status:
-            print(f"Audio status: {status}")
+            LOG.warn("audio", "Audio status: %s", status)
+            if getattr(status, 'input_overflow', False):
+                AUDIO_OVERRUNS.inc()
+        
+        # Add audio chunk (stamped with its capture time) to queue for processing
+        self.enqueue_audio((captured_ns, indata.copy()))
+    
+    @staticmethod
+    def int16_stereo_to_mono(raw_bytes):
+        """Convert raw int16 stereo bytes to a (samples, 1) float32 block in [-1, 1]"""
+        audio_array = np.frombuffer(raw_bytes, dtype=np.int16)
+        
+        # Reshape to stereo (2 channels) and average left and right
+        audio_mono = audio_array.reshape(-1, 2).mean(axis=1)
         
-        # Add audio chunk to queue for processing
-        self.audio_queue.put(indata.copy())
+        # Normalize to float32 [-1, 1], shaped (samples, channels)
+        return (audio_mono.astype(np.float32) / 32768.0).reshape(-1, 1)
+    
+    @staticmethod
+    def float_block_to_mono(data):
+        """Mix a (frames, channels) float32 block to a (frames, 1) mono block"""
+        if data.shape[1] > 1:
+            mono_data = np.mean(data, axis=1)
+        else:
+            mono_data = data[:, 0]
+        return mono_data.reshape(-1, 1)
     
     def audio_callback_loopback(self, indata, frames, time_info, status):
         """Callback for WASAPI loopback stream - receives raw audio bytes"""
+        captured_ns = time.perf_counter_ns()
+        AUDIO_BLOCKS.inc()
         if status:
-            print(f"Audio status: {status}")
-        
-        # Convert bytes to numpy array (int16 stereo)
-        import numpy as np
-        audio_array = np.frombuffer(indata, dtype=np.int16)
-        
-        # Reshape to stereo (2 channels)
-        audio_stereo = audio_array.reshape(-1, 2)
+            LOG.warn("audio", "Audio status: %s", status)
+            if getattr(status, 'input_overflow', False):
+                AUDIO_OVERRUNS.inc()
         
-        # Convert to mono (average left and right)
-        audio_mono = audio_stereo.mean(axis=1)
+        self.enqueue_audio((captured_ns, self.int16_stereo_to_mono(indata)))
+    
+    def detect_pitches_crepe(self, audio_data):
+        """Run CREPE on a batch of mono samples, returns (frequencies, confidence)"""
+        time_stamps, frequencies, confidence, activation = crepe.predict(
+            audio_data,
+            self.sample_rate,
+            model_capacity=self.model_capacity,
+            viterbi=True,
+            step_size=self.step_size,
+            verbose=0
+        )
+        return frequencies, confidence
+    
+    def detect_pitch_aubio(self, audio_chunk):
+        """Run Aubio on one (samples, 1) block, returns frequency in Hz (0 = unvoiced)"""
+        # Convert to float32 for aubio
+        audio_float = audio_chunk[:, 0].astype(np.float32)
+        return self.aubio_pitch(audio_float)[0]
+    
+    def update_pitch_history(self, frequencies, max_history, confidences=None, frame_seconds=0.064):
+        """
+        Append voiced frequencies as MIDI notes and keep only the most recent ones.
+        Each frame also updates the tuning estimate (weighted by its confidence),
+        and notes are binned around the estimated tuning.
+        """
+        tuning = self.tuning
+        midi = None
+        for i, freq in enumerate(frequencies):
+            if freq > 0:
+                midi = 69 + 12 * math.log2(freq / 440.0)
+                tuning.update(midi, 1.0 if confidences is None else float(confidences[i]), frame_seconds)
+                midi_note = int(round(midi - tuning.offset))
+                if midi_note:
+                    self.pitch_history.append(midi_note)
+        if midi is not None:
+            self._pitch = midi - tuning.offset
+            self._pitch_ns = time.perf_counter_ns()
+        
+        if len(self.pitch_history) > max_history:
+            self.pitch_history = self.pitch_history[-max_history:]
+        
+        if tuning.pop_change():
+            LOG.info("detector", "[TUNING] A4 = %.1f Hz (%+.0f cents)", tuning.reference_hz, tuning.offset_cents)
+            if self.tuning_callback:
+                self.tuning_callback(tuning.offset_cents)
+    
+    def reset_history(self):
+        """Forget the analyzed notes and the detected key (detection thread: queue it with enqueue_audio)"""
+        self.pitch_history = []
+        self._history_filled = False
+        self.last_detected_key = None
+        self.last_detected_scale = None
+    
+    def check_key_change(self, captured_ns=None):
+        """
+        Analyze pitch history and notify midi_callback when key/scale changes
         
-        # Normalize to float32 [-1, 1]
-        audio_float = audio_mono.astype(np.float32) / 32768.0
+        Args:
+            captured_ns: Capture stamp of the newest audio analyzed (for latency tracing)
+        """
+        if len(self.pitch_history) < 20:
+            return
         
-        # Reshape to match expected format (samples, channels)
-        audio_formatted = audio_float.reshape(-1, 1)
+        if not self._history_filled:
+            self._history_filled = True
+            TRACER.record_since('history_fill', self._started_ns)
+        
+        t0 = time.perf_counter_ns()
+        key, scale = self.analyze_key_and_scale(self.pitch_history)
+        if self._trace_chunk:
+            TRACER.record('key_analysis', time.perf_counter_ns() - t0)
+        
+        if key and scale:
+            # Only send if changed
+            KEY_CONFIDENCE.set(self.key_confidence)
+            if key != self.last_detected_key or scale != self.last_detected_scale:
+                TRACER.record_since('capture_to_key', captured_ns)
+                LOG.info("detector", "[DETECTED] %s %s", key, scale)
+                self.last_detected_key = key
+                self.last_detected_scale = scale
+                DETECTIONS.inc()
+                metrics.set_current_key(key, scale)
+                
+                # Send MIDI (the callback runs on this thread and can read TRACER.origin())
+                if self.midi_callback:
+                    TRACER.set_origin(captured_ns)
+                    t0 = time.perf_counter_ns()
+                    self.midi_callback(key, scale)
+                    TRACER.record('midi_callback', time.perf_counter_ns() - t0)
+    
+    @staticmethod
+    def _count_inference(inference_ns):
+        """Update inference health metrics (detection thread only)"""
+        seconds = inference_ns / 1e9
+        INFERENCE_LAST.set(seconds)
+        INFERENCE_SUM.add(seconds)
+        INFERENCE_COUNT.add(1)
+    
+    def process_chunk_crepe(self, audio_chunk, captured_ns=None):
+        """Accumulate one audio chunk and run CREPE once a full batch is ready"""
+        if not self.accumulated_audio:
+            self._batch_start_ns = captured_ns
+        
+        # Accumulate audio (CREPE needs larger chunks)
+        self.accumulated_audio.extend(audio_chunk[:, 0])  # Mono
+        
+        # Process when we have enough samples (e.g., 1 second)
+        min_samples = self.sample_rate * 1  # 1 second
+        
+        if len(self.accumulated_audio) >= min_samples:
+            TRACER.record_since('batch_fill', self._batch_start_ns)
+            audio_data = np.array(self.accumulated_audio[:min_samples])
+            t0 = time.perf_counter_ns()
+            frequencies, confidence = self.detect_pitches_crepe(audio_data)
+            inference_ns = time.perf_counter_ns() - t0
+            TRACER.record('inference', inference_ns)
+            self._count_inference(inference_ns)
+            
+            # Filter by confidence
+            voiced = confidence > self.confidence_threshold
+            valid_freqs = frequencies[voiced]
+            FRAMES.add(len(frequencies))
+            GATED_FRAMES.add(len(frequencies) - len(valid_freqs))
+            
+            # Keep only recent history (analysis_window seconds of 1-second batches)
+            max_history = int(self.analysis_window * len(frequencies))
+            self.update_pitch_history(valid_freqs, max_history, confidence[voiced], self.step_size / 1000.0)
+            
+            # Analyze key/scale periodically
+            self.check_key_change(captured_ns)
+            
+            # Remove processed samples (the remainder came from this chunk)
+            self.accumulated_audio = self.accumulated_audio[min_samples:]
+            self._batch_start_ns = captured_ns if self.accumulated_audio else None
+    
+    def process_chunk_aubio(self, audio_chunk, captured_ns=None):
+        """Detect pitch of one audio chunk with Aubio and update key/scale"""
+        t0 = time.perf_counter_ns()
+        pitch = self.detect_pitch_aubio(audio_chunk)
+        inference_ns = time.perf_counter_ns() - t0
+        if self._trace_chunk:
+            TRACER.record('inference', inference_ns)
+        self._count_inference(inference_ns)
+        FRAMES.add(1)
+        if pitch <= 0:
+            GATED_FRAMES.add(1)
+        
+        # Keep only recent history
+        max_history = int(self.analysis_window * self.sample_rate / self.buffer_size)
+        if pitch > 0:
+            # yinfft reports no confidence (0.0): voiced frames then weigh equally in the tuning estimate
+            confidence = self.aubio_pitch.get_confidence() or 1.0
+            self.update_pitch_history([pitch], max_history, [confidence], self.buffer_size / self.sample_rate)
+        else:
+            self.update_pitch_history((), max_history)
         
-        # Add to queue
-        self.audio_queue.put(audio_formatted)
+        # Analyze periodically
+        self.check_key_change(captured_ns)
     
-    def process_audio_crepe(self):
-        """Process audio using CREPE"""
-        accumulated_audio = []
+    @staticmethod
+    def block_rms(audio_chunk):
+        """RMS level of a (samples, 1) block"""
+        mono = audio_chunk.reshape(-1)
+        return float(np.sqrt(np.dot(mono, mono) / len(mono))) if len(mono) else 0.0
+    
+    def _set_idle(self, idle):
+        """Switch between active and idle mode, accounting the time spent in the previous one"""
+        now = time.perf_counter_ns()
+        if self._mode_since_ns is not None:
+            self.mode_seconds['idle' if self.is_idle else 'active'] += (now - self._mode_since_ns) / 1e9
+        self._mode_since_ns = now
+        self.is_idle = idle
+        DETECTOR_IDLE.set(1 if idle else 0)
+    
+    def enter_idle(self):
+        """Sustained silence: stop inference and capture large blocks for the level monitor"""
+        self._set_idle(True)
+        self.accumulated_audio = []
+        self._batch_start_ns = None
+        self.set_capture_block(int(self.capture_rate * IDLE_BLOCK_S))
+        LOG.info("detector", "[IDLE] %gs of silence, level monitor only", self.idle_after)
+    
+    def exit_idle(self, captured_ns):
+        """Signal is back: restore normal blocks and the full detection path"""
+        self._set_idle(False)
+        self._last_signal_ns = captured_ns
+        self.set_capture_block(self.active_block())
+        TRACER.record_since('idle_wake', captured_ns)
+        LOG.info("detector", "[IDLE] Signal detected, detection resumed")
+    
+    def active_block(self):
+        """Capture block size while active: one note-tracker hop in note stream mode"""
+        return self.note_tracker.hop if self.note_tracker else self.buffer_size
+    
+    def set_capture_block(self, frames):
+        """
+        Change the capture block size (the input stream is reopened, loopback picks it up).
+        A failed reopen retries the previous size; if that fails too the detector stops
+        itself (failure_callback). Returns True when the stream runs with the new size.
+        """
+        previous, self.capture_block = self.capture_block, frames
+        with self._stream_lock:
+            if not (self.is_running and self.stream is not None):
+                return True
+            self._close_stream()
+            for block in dict.fromkeys((frames, previous)):
+                self.capture_block = block
+                try:
+                    self._open_stream()
+                    return block == frames
+                except Exception as e:
+                    LOG.error("audio", "[ERROR] Capture stream could not be reopened (%d frames): %s", block, e)
+                    self._close_stream()
+        self._capture_lost("audio stream could not be reopened")
+        return False
+    
+    def _capture_lost(self, reason):
+        """Detection thread: no capture source any more, end the run (its loop exits) and tell the owner"""
+        self.is_running = False
+        DETECTOR_RUNNING.set(0)
+        self._set_idle(False)
+        self.snapshot = EMPTY_SNAPSHOT._replace(seq=self.snapshot.seq + 1)
+        LOG.error("detector", "[ERROR] Detection stopped: %s", reason)
+        if self.failure_callback:
+            self.failure_callback(reason)
+    
+    def _update_silence(self, level, captured_ns):
+        """Track the last loud block and go idle after idle_after seconds of silence"""
+        if level >= self.silence_threshold or self._last_signal_ns is None:
+            self._last_signal_ns = captured_ns
+        elif (self.idle_enabled and self.note_tracker is None  # the note stream never sleeps
+              and captured_ns - self._last_signal_ns >= self.idle_after * 1e9):
+            self.enter_idle()
+    
+    def run_detection(self, process_chunk, label):
+        """
+        Detection thread loop. Blocks on the queue (stop() wakes it with a None
+        sentinel), runs process_chunk while active and only the level monitor while idle.
+        Callables in the queue are run in order (capture format changes).
+        """
+        wakeups = {mode: DETECTOR_WAKEUPS.labels(mode=mode) for mode in self.mode_wakeups}
+        cpu = {mode: DETECTOR_CPU_SECONDS.labels(mode=mode) for mode in self.mode_cpu}
+        cpu_last = time.thread_time()
         
         while self.is_running:
+            item = self.audio_queue.get()
+            if item is None:
+                break
+            if callable(item):  # control marker queued by switch_device
+                item()
+                continue
+            mode = 'idle' if self.is_idle else 'active'
             try:
-                # Get audio chunk from queue (timeout to check is_running periodically)
-                audio_chunk = self.audio_queue.get(timeout=0.1)
-                
-                # Accumulate audio (CREPE needs larger chunks)
-                accumulated_audio.extend(audio_chunk[:, 0])  # Mono
+                captured_ns, audio_chunk = item
+                level = self.block_rms(audio_chunk)
                 
-                # Process when we have enough samples (e.g., 1 second)
-                min_samples = self.sample_rate * 1  # 1 second
-                
-                if len(accumulated_audio) >= min_samples:
-                    audio_data = np.array(accumulated_audio[:min_samples])
-                    
-                    # Run CREPE
-                    time_stamps, frequencies, confidence, activation = crepe.predict(
-                        audio_data,
-                        self.sample_rate,
-                        model_capacity=self.model_capacity,
-                        viterbi=True,
-                        step_size=100  # ms between predictions
-                    )
-                    
-                    # Filter by confidence
-                    valid_freqs = frequencies[confidence > self.confidence_threshold]
-                    
-                    # Convert to MIDI notes
-                    for freq in valid_freqs:
-                        if freq > 0:
-                            midi_note = self.freq_to_midi_note(freq)
-                            if midi_note:
-                                self.pitch_history.append(midi_note)
-                    
-                    # Keep only recent history
-                    max_history = int(self.analysis_window * len(valid_freqs) / (len(time_stamps) + 1))
-                    if len(self.pitch_history) > max_history:
-                        self.pitch_history = self.pitch_history[-max_history:]
-                    
-                    # Analyze key/scale periodically
-                    if len(self.pitch_history) >= 20:
-                        key, scale = self.analyze_key_and_scale(self.pitch_history)
-                        
-                        if key and scale:
-                            # Only send if changed
-                            if key != self.last_detected_key or scale != self.last_detected_scale:
-                                print(f"[DETECTED] {key} {scale}")
-                                self.last_detected_key = key
-                                self.last_detected_scale = scale
-                                
-                                # Send MIDI
-                                if self.midi_callback:
-                                    self.midi_callback(key, scale)
+                if self.is_idle:
+                    if level >= self.silence_threshold:
+                        self.exit_idle(captured_ns)
+                elif len(audio_chunk) <= self.buffer_size:  # idle-sized blocks left after a wake are skipped
+                    self._trace_chunk = TRACER.tick()
+                    if self._trace_chunk:
+                        TRACER.record_since('queue_wait', captured_ns)
                     
-                    # Remove processed samples
-                    accumulated_audio = accumulated_audio[min_samples:]
+                    t0 = time.perf_counter_ns()
+                    if self.note_tracker is not None:
+                        self.note_tracker.process(audio_chunk, captured_ns)
+                        for key_chunk in self._key_blocks(audio_chunk):
+                            process_chunk(key_chunk, captured_ns)
+                    else:
+                        process_chunk(audio_chunk, captured_ns)
+                    if self._trace_chunk:
+                        TRACER.record('process_chunk', time.perf_counter_ns() - t0)
                     
-            except queue.Empty:
-                continue
+                    self._update_silence(level, captured_ns)
+                
+                self._publish_snapshot(level, captured_ns)
             except Exception as e:
-                print(f"CREPE processing error: {e}")
-                import traceback
-                traceback.print_exc()
+                LOG.error("detector", "%s processing error: %s\n%s", label, e, traceback.format_exc().rstrip())
+            
+            cpu_now = time.thread_time()
+            self.mode_wakeups[mode] += 1
+            self.mode_cpu[mode] += cpu_now - cpu_last
+            wakeups[mode].inc()
+            cpu[mode].add(cpu_now - cpu_last)
+            cpu_last = cpu_now
+    
+    def _publish_snapshot(self, level, now_ns):
+        """Detection thread: swap in a new DetectorSnapshot, at most every SNAPSHOT_INTERVAL_S"""
+        if level > self._snapshot_level:
+            self._snapshot_level = level
+        if now_ns < self._snapshot_due_ns:
+            return
+        self._snapshot_due_ns = now_ns + int(SNAPSHOT_INTERVAL_S * 1e9)
+        
+        histogram, ranking = EMPTY_SNAPSHOT.histogram, ()
+        if self.pitch_history:
+            counts = np.bincount(np.asarray(self.pitch_history) % 12, minlength=12)
+            histogram = tuple((counts / counts.sum()).tolist())
+            ranking = tuple((NOTE_NAMES[i], histogram[i]) for i in np.argsort(-counts, kind='stable')[:RANKING_SIZE]
+                            if counts[i])
+        pitch = self._pitch if now_ns - self._pitch_ns <= PITCH_HOLD_S * 1e9 else None
+        key, scale = (self.last_detected_key, self.last_detected_scale) if self._history_filled else (None, None)
+        self.snapshot = DetectorSnapshot(self.snapshot.seq + 1, now_ns, self.is_running, self.is_idle,
+                                         level_to_db(self._snapshot_level), pitch, histogram, ranking,
+                                         key, scale, self.key_confidence if key else 0.0)
+        self._snapshot_level = 0.0
+    
+    def _key_blocks(self, audio_chunk):
+        """Re-block small note-stream blocks into buffer_size blocks for key detection"""
+        if self._key_carry is not None and len(self._key_carry):
+            audio_chunk = np.concatenate((self._key_carry, audio_chunk))
+        n = len(audio_chunk) // self.buffer_size
+        self._key_carry = audio_chunk[n * self.buffer_size:]
+        return [audio_chunk[i * self.buffer_size:(i + 1) * self.buffer_size] for i in range(n)]
+    
+    def process_audio_crepe(self):
+        """Process audio using CREPE"""
+        self.accumulated_audio = []
+        self.run_detection(self.process_chunk_crepe, "CREPE")
     
     def process_audio_aubio(self):
         """Process audio using Aubio (fallback)"""
-        while self.is_running:
+        self.run_detection(self.process_chunk_aubio, "Aubio")
+    
+    def power_report(self):
+        """{mode: {seconds, wakeups_per_s, cpu_pct}} for the active and idle detection modes"""
+        seconds = dict(self.mode_seconds)
+        if self._mode_since_ns is not None:
+            seconds['idle' if self.is_idle else 'active'] += (time.perf_counter_ns() - self._mode_since_ns) / 1e9
+        report = {}
+        for mode, wall in seconds.items():
+            report[mode] = {
+                'seconds': round(wall, 1),
+                'wakeups_per_s': round(self.mode_wakeups[mode] / wall, 2) if wall else 0.0,
+                'cpu_pct': round(100.0 * self.mode_cpu[mode] / wall, 3) if wall else 0.0,
+            }
+        return report
+    
+    def format_note_latency(self):
+        """Note stream latency: onset captured -> note-on sent, plus the driver's input latency"""
+        stats = TRACER.summary().get('note_on')
+        if not stats:
+            return "no notes sent"
+        text = (f"note-on latency p50 {stats['p50_ms']:.1f} ms, p90 {stats['p90_ms']:.1f} ms, "
+                f"max {stats['max_ms']:.1f} ms ({stats['count']} notes)")
+        if isinstance(self.input_latency, (int, float)):
+            text += f" + input latency {self.input_latency * 1000:.1f} ms"
+        return text
+    
+    def format_power_report(self):
+        return "  ".join(f"{mode}: {r['seconds']:g}s, {r['wakeups_per_s']:g} wakeups/s, {r['cpu_pct']:g}% CPU"
+                         for mode, r in self.power_report().items())
+    
+    def _open_stream(self):
+        with PORTAUDIO_LOCK:  # not while the device registry rescans PortAudio
+            self.stream = sd.InputStream(
+                device=self.device_index,
+                channels=1,
+                samplerate=self.capture_rate,
+                blocksize=self.capture_block,
+                callback=self.audio_callback
+            )
+            self.stream.start()
+            self.input_latency = getattr(self.stream, 'latency', None)  # seconds, reported by the driver
+    
+    def _close_stream(self):
+        if self.stream is not None:
             try:
-                audio_chunk = self.audio_queue.get(timeout=0.1)
-                
-                # Convert to float32 for aubio
-                audio_float = audio_chunk[:, 0].astype(np.float32)
-                
-                # Detect pitch
-                pitch = self.aubio_pitch(audio_float)[0]
-                
-                if pitch > 0:
-                    midi_note = self.freq_to_midi_note(pitch)
-                    if midi_note:
-                        self.pitch_history.append(midi_note)
-                
-                # Keep only recent history
-                max_history = int(self.analysis_window * self.sample_rate / self.buffer_size)
-                if len(self.pitch_history) > max_history:
-                    self.pitch_history = self.pitch_history[-max_history:]
-                
-                # Analyze periodically
-                if len(self.pitch_history) >= 20:
-                    key, scale = self.analyze_key_and_scale(self.pitch_history)
+                self.stream.stop()
+                self.stream.close()
+            except: pass
+            self.stream = None
+    
+    def _loopback_record(self, mic, stop_event):
+        """Loopback capture thread (one per capture start, stopped by its own stop_event)"""
+        try:
+            with mic.recorder(samplerate=self.capture_rate) as recorder:
+                while not stop_event.is_set():
+                    # Record chunk (large blocks while idle)
+                    data = recorder.record(numframes=self.capture_block)
+                    # data is (frames, channels) float32
                     
-                    if key and scale:
-                        if key != self.last_detected_key or scale != self.last_detected_scale:
-                            print(f"[DETECTED] {key} {scale}")
-                            self.last_detected_key = key
-                            self.last_detected_scale = scale
-                            
-                            if self.midi_callback:
-                                self.midi_callback(key, scale)
-                
-            except queue.Empty:
-                continue
-            except Exception as e:
-                print(f"Aubio processing error: {e}")
+                    captured_ns = time.perf_counter_ns()
+                    AUDIO_BLOCKS.inc()
+                    
+                    # Mix to mono, shaped (frames, 1) for consistency
+                    self.enqueue_audio((captured_ns, self.float_block_to_mono(data)))
+                    
+        except Exception as e:
+            LOG.error("audio", f"Loopback recording error: {e}")
     
-    def start(self):
-        """Start realtime pitch detection"""
-        if self.is_running:
-            print("Already running!")
-            return
-        
-        print("Starting realtime pitch detection...")
-        self.is_running = True
-        self.pitch_history = []
-        
-        # Start audio input stream
+    def _source_rate(self):
+        """Capture rate of the selected source (loopback always records at LOOPBACK_SAMPLE_RATE)"""
+        return LOOPBACK_SAMPLE_RATE if self.is_loopback else self.input_sample_rate
+    
+    def _queue_rate_marker(self):
+        rate = self._source_rate()
+        self.enqueue_audio(lambda: self.apply_sample_rate(rate))
+    
+    def _start_capture(self):
+        """Open the capture source for device_index / is_loopback (caller holds _stream_lock)"""
         try:
             if self.is_loopback:
                 # Use soundcard library for reliable Loopback/WASAPI capture
-                import soundcard as sc
+                LOG.info("audio", f"[MODE] Loopback (soundcard lib) (capturing from OUTPUT device: {self.device_index})")
                 
-                print(f"[MODE] Loopback (soundcard lib) (capturing from OUTPUT device: {self.device_index})")
-                
-                # Get the default speaker or specific speaker
+                # The registry maps the sounddevice output index to its soundcard speaker
+                # (default speaker when it cannot be matched)
                 try:
-                    # Input devices in soundcard include loopbacks if configured
-                    # But for system output capture, we usually want sc.get_microphone(..., include_loopback=True)
-                    # OR sc.default_speaker().recorder()
-                    
-                    # NOTE: mapping device_index from sounddevice to soundcard is tricky
-                    # For now, let's try to get default speaker loopback which is what users usually want
-                    
-                    # Get default speaker loopback recorder
-                    self.mic = sc.default_speaker()
-                    print(f"[DEVICE] Default Speaker Loopback: {self.mic.name}")
+                    self.mic = get_registry().loopback_speaker(self.device_index)
+                    LOG.info("audio", f"[DEVICE] Speaker Loopback: {self.mic.name}")
                     
-                    # Start recording in a separate thread because soundcard blocks or needs a context manager
+                    # Record at 44100 in a separate thread because soundcard blocks or needs a context manager
+                    self.capture_rate = self._source_rate()
                     self.stop_event = threading.Event()
-                    
-                    def loopback_record_thread():
-                        try:
-                            # Record at 44100 or 48000
-                            sr = 44100
-                            self.sample_rate = sr
-                            
-                            with self.mic.recorder(samplerate=sr) as recorder:
-                                while not self.stop_event.is_set():
-                                    # Record chunk
-                                    data = recorder.record(numframes=1024)
-                                    # data is (frames, channels) float32
-                                    
-                                    # Mix to mono if stereo
-                                    if data.shape[1] > 1:
-                                        mono_data = np.mean(data, axis=1)
-                                    else:
-                                        mono_data = data[:, 0]
-                                        
-                                    # Add to queue
-                                    # Reshape to (frames, 1) for consistency
-                                    self.audio_queue.put(mono_data.reshape(-1, 1))
-                                    
-                        except Exception as e:
-                            print(f"Loopback recording error: {e}")
-                            
-                    self.loopback_thread = threading.Thread(target=loopback_record_thread, daemon=True)
+                    self.loopback_thread = threading.Thread(target=self._loopback_record, args=(self.mic, self.stop_event),
+                                                            name="loopback-capture", daemon=True)
                     self.loopback_thread.start()
-                    print(f"[OK] Loopback recording started")
+                    LOG.info("audio", f"[OK] Loopback recording started")
                     
                 except Exception as e:
-                    print(f"[ERROR] Soundcard loopback init failed: {e}")
-                    self.is_running = False
-                    return
+                    LOG.error("audio", f"[ERROR] Soundcard loopback init failed: {e}")
+                    return False
             else:
                 # Normal INPUT mode
-                print(f"[MODE] Normal INPUT (device: {self.device_index or 'default'})")
-                self.stream = sd.InputStream(
-                    device=self.device_index,
-                    channels=1,
-                    samplerate=self.sample_rate,
-                    blocksize=self.buffer_size,
-                    callback=self.audio_callback
-                )
-                self.stream.start()
-                print(f"[OK] Audio stream started (device: {self.device_index or 'default'})")
+                LOG.info("audio", f"[MODE] Normal INPUT (device: {self.device_index or 'default'})")
+                self.capture_rate = self._source_rate()
+                self._open_stream()
+                LOG.info("audio", f"[OK] Audio stream started (device: {self.device_index or 'default'})")
 
         except Exception as e:
 
-            print(f"[ERROR] Failed to start audio stream: {e}")
-            import traceback
-            traceback.print_exc()
-            self.is_running = False
+            LOG.error("audio", "[ERROR] Failed to start audio stream: %s\n%s", e, traceback.format_exc().rstrip())
+            return False
+        return True
+    
+    def _stop_capture(self):
+        """Close the capture source; a loopback thread finishes its current block (caller holds _stream_lock)"""
+        self._close_stream()
+        
+        # Stop soundcard loopback if running
+        if self.loopback_thread is not None:
+            self.stop_event.set()
+            self.loopback_thread.join(timeout=1.0)
+            self.loopback_thread = None
+    
+    def apply_sample_rate(self, rate):
+        """Analyze audio at a new capture rate (CREPE batch restarts, Aubio is rebuilt, pitch history is kept)"""
+        if rate == self.sample_rate:
+            return
+        self.sample_rate = rate
+        self.accumulated_audio = []
+        self._batch_start_ns = None
+        self._key_carry = None
+        if self.backend == 'aubio':
+            self.init_aubio()
+        if self.note_tracker is not None:
+            self.note_tracker.flush()
+            self.note_tracker = NoteTracker(rate, send=self.note_callback, pitch_bend=self.pitch_bend)
+    
+    def switch_device(self, device_index=None, is_loopback=False):
+        """
+        Switch the capture source in place, on a running or stopped detector.
+        The backend model, pitch history and detected key are kept; a running
+        detector only loses the audio of the swap itself. Returns True on success
+        (on failure the previous device is restored).
+        """
+        if not self.is_running:
+            self.device_index = device_index
+            self.is_loopback = is_loopback
+            return True
+        
+        t0 = time.perf_counter_ns()
+        previous = (self.device_index, self.is_loopback)
+        with self._stream_lock:
+            self._stop_capture()
+            self.device_index, self.is_loopback = device_index, is_loopback
+            # Queued before the new device captures: every block behind this marker is from
+            # the new device, and the detection thread switches its analysis rate here
+            self._queue_rate_marker()
+            ok = self._start_capture()
+            if not ok:
+                LOG.warn("audio", "[WARN] Device switch failed, restoring the previous device")
+                self.device_index, self.is_loopback = previous
+                self._queue_rate_marker()
+                self._start_capture()
+            switch_ns = time.perf_counter_ns() - t0
+            TRACER.record('device_switch', switch_ns)  # under the lock: one writer at a time
+        if ok:
+            LOG.info("audio", f"[SWITCH] Capture switched in {switch_ns / 1e6:.0f} ms (history and model kept)")
+        return ok
+    
+    def start(self):
+        """Start realtime pitch detection"""
+        if self.is_running:
+            LOG.info("detector", "Already running!")
             return
         
+        LOG.info("detector", "Starting realtime pitch detection...")
+        self.is_running = True
+        self.pitch_history = []
+        self.tuning.reset()
+        self._started_ns = time.perf_counter_ns()
+        self._history_filled = False
+        self._pitch = None
+        self._snapshot_level = 0.0
+        self._snapshot_due_ns = 0
+        
+        # Fresh queue contents (stale blocks or a stop sentinel from the last run)
+        while True:
+            try:
+                self.audio_queue.get_nowait()
+            except queue.Empty:
+                break
+        self._key_carry = None
+        self._last_signal_ns = None
+        self.mode_seconds = {'active': 0.0, 'idle': 0.0}
+        self.mode_wakeups = {'active': 0, 'idle': 0}
+        self.mode_cpu = {'active': 0.0, 'idle': 0.0}
+        self._mode_since_ns = None
+        self._set_idle(False)
+        AUDIO_QUEUE_DEPTH.set_function(self.audio_queue.qsize)
+        
+        # Start audio input stream
+        with self._stream_lock:
+            # Analysis rate first: in note mode the capture block is one note-tracker hop at that rate
+            self.apply_sample_rate(self._source_rate())
+            self.capture_block = self.active_block()
+            if not self._start_capture():
+                self.is_running = False
+                return
+        
         # Start processing thread
-        if USE_CREPE:
+        if self.backend == 'crepe':
             target_func = self.process_audio_crepe
         else:
             target_func = self.process_audio_aubio
         
-        self.detection_thread = threading.Thread(target=target_func, daemon=True)
+        self.snapshot = EMPTY_SNAPSHOT._replace(seq=self.snapshot.seq + 1, running=True)
+        self.detection_thread = threading.Thread(target=target_func, name="pitch-detection", daemon=True)
         self.detection_thread.start()
-        print("[OK] Detection thread started")
+        DETECTOR_RUNNING.set(1)
+        LOG.info("detector", "[OK] Detection thread started")
     
     def stop(self):
         """Stop realtime pitch detection"""
         if not self.is_running:
             return
         
-        print("Stopping pitch detection...")
+        LOG.info("detector", "Stopping pitch detection...")
         self.is_running = False
+        DETECTOR_RUNNING.set(0)
         
-        # Stop audio stream
-        if hasattr(self, 'stream'):
-            try:
-                self.stream.stop()
-                self.stream.close()
-            except: pass
+        # Stop audio stream / loopback thread
+        with self._stream_lock:
+            self._stop_capture()
         
-        # Stop soundcard loopback if running
-        if hasattr(self, 'stop_event'):
-            self.stop_event.set()
-        
-        # Wait for thread to finish
+        # Wake the detection thread (blocked on the queue) and wait for it to finish
+        self.enqueue_audio(None)
         if self.detection_thread:
             self.detection_thread.join(timeout=2.0)
+        self.snapshot = EMPTY_SNAPSHOT._replace(seq=self.snapshot.seq + 1)
+        
+        LOG.info("detector", f"[POWER] {self.format_power_report()}")
+        self._set_idle(False)
+        
+        if self.note_tracker is not None:
+            self.note_tracker.flush()
+            LOG.info("detector", f"[NOTES] {self.format_note_latency()}")
+        
+        if self.lean:
+            self.release_model()
             
-        print("[OK] Stopped")
+        LOG.info("detector", "[OK] Stopped")
     
     @staticmethod
     def list_audio_devices():
         """List available audio input devices"""
-        devices = sd.query_devices()
+        devices = get_registry().devices()
         print("\n=== Available Audio Input Devices ===")
-        for i, device in enumerate(devices):
-            if device['max_input_channels'] > 0:
-                print(f"[{i}] {device['name']} (Channels: {device['max_input_channels']})")
+        for device in devices:
+            if device.max_input_channels > 0:
+                print(f"[{device.index}] {device.name} (Channels: {device.max_input_channels})")
         print("=====================================\n")
         return devices
 
 
 # Testing
 if __name__ == "__main__":
+    metrics.start_from_env()
+    sampling_profiler.start_from_env()
+    
     # List devices
     RealtimePitchDetector.list_audio_devices()
     
@@ -456,3 +1014,5 @@ if __name__ == "__main__":
     except KeyboardInterrupt:
         print("\nStopping...")
         detector.stop()
+        LOG.flush()
+        print("\n=== Latency trace ===\n" + TRACER.format_summary())
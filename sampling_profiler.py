@@ -0,0 +1,212 @@
+"""
+Sampling Profiler
+Opt-in in-process profiler: samples the Python stacks of every app thread
+(GUI main loop, pitch detection, audio capture, Auto-Key, ...) at a fixed
+rate, aggregates them per thread and dumps collapsed stacks that
+flamegraph.pl / speedscope / inferno read directly.
+
+Sampling is a sys._current_frames() walk with cached frame labels; at the
+default 50 Hz it typically costs under 1% CPU and can stay on for a whole
+rehearsal. The measured overhead is printed with every dump.
+
+Enable:
+    set CUBASE_PROFILE=1                 (or: python controller_gui.py --profile [HZ])
+    set CUBASE_PROFILE_HZ=50             sampling rate
+    set CUBASE_PROFILE_OUT=profiles      output directory
+
+Dumps are written on stop / exit, and on demand with a signal:
+    Linux/macOS: kill -USR1 <pid>        Windows: Ctrl+Break in the console
+
+View:
+    flamegraph.pl profiles/profile_*.collapsed > flame.svg   (or drop the file on speedscope.app)
+"""
+
+import atexit
+import datetime
+import os
+import signal
+import sys
+import threading
+import time
+
+DEFAULT_HZ = 50
+DEFAULT_OUT_DIR = "profiles"
+
+
+class SamplingProfiler:
+    """Aggregates {(thread name, collapsed stack): samples}"""
+
+    def __init__(self, hz=DEFAULT_HZ, out_dir=DEFAULT_OUT_DIR, max_depth=64):
+        self.hz = hz
+        self.out_dir = out_dir
+        self.max_depth = max_depth
+        self.counts = {}
+        self.thread_samples = {}
+        self.samples = 0
+        self._labels = {}  # code object -> "func (file:line)"
+        self._names = {}
+        self._thread = None
+        self._stop = threading.Event()
+        self._lock = threading.RLock()  # only guards dump vs. aggregation, never taken by app threads
+        # (reentrant: the dump signal handler can interrupt the main thread inside a locked copy)
+        self._cpu_s = 0.0
+        self._started = None
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            self._labels[code] = label
+        return label
+
+    def _thread_name(self, ident):
+        name = self._names.get(ident)
+        if name is None:
+            self._names = {t.ident: t.name for t in threading.enumerate()}
+            name = self._names.get(ident, f"thread-{ident}")
+        return name
+
+    def _sample_once(self):
+        own = threading.get_ident()
+        frames = sys._current_frames()
+        with self._lock:
+            for ident, frame in frames.items():
+                if ident == own:
+                    continue
+                stack = []
+                depth = 0
+                while frame is not None and depth < self.max_depth:
+                    stack.append(self._label(frame.f_code))
+                    frame = frame.f_back
+                    depth += 1
+                stack.reverse()
+                name = self._thread_name(ident)
+                key = (name, ";".join(stack))
+                self.counts[key] = self.counts.get(key, 0) + 1
+                self.thread_samples[name] = self.thread_samples.get(name, 0) + 1
+            self.samples += 1
+
+    def _run(self):
+        interval = 1.0 / self.hz
+        cpu0 = time.thread_time()
+        next_t = time.perf_counter()
+        while not self._stop.is_set():
+            self._sample_once()
+            self._cpu_s = time.thread_time() - cpu0
+            next_t += interval
+            delay = next_t - time.perf_counter()
+            if delay > 0:
+                self._stop.wait(delay)
+            else:
+                next_t = time.perf_counter()  # fell behind, don't burst
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+        print(f"[OK] Sampling profiler running at {self.hz} Hz (dump: {self.out_dir}/)")
+
+    def stop(self, dump=True):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=2.0)
+        if dump:
+            return self.dump()
+
+    def overhead_pct(self):
+        """Profiler CPU time as a percentage of wall time since start"""
+        if not self._started:
+            return 0.0
+        wall = time.perf_counter() - self._started
+        return 100.0 * self._cpu_s / wall if wall > 0 else 0.0
+
+    def collapsed(self):
+        """Lines of 'thread;frame;...;frame count' (flame graph input)"""
+        with self._lock:
+            items = list(self.counts.items())
+        return _collapsed(items)
+
+    def top_functions(self, thread_name, n=10):
+        """[(leaf frame, samples)] with the most self samples in one thread"""
+        with self._lock:
+            items = list(self.counts.items())
+        return _top_functions(items, thread_name, n)
+
+    def dump(self, path=None):
+        """Write collapsed stacks, print a per-thread summary, return the path"""
+        if path is None:
+            os.makedirs(self.out_dir, exist_ok=True)
+            stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+            path = os.path.join(self.out_dir, f"profile_{stamp}.collapsed")
+        # One copy under the lock: the sampler thread keeps adding keys while we write
+        with self._lock:
+            items = list(self.counts.items())
+            thread_samples = list(self.thread_samples.items())
+            samples = self.samples
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(_collapsed(items)) + "\n")
+
+        print(f"\n=== Sampling profile: {samples} samples, overhead ~{self.overhead_pct():.2f}% CPU ===")
+        for name, total in sorted(thread_samples, key=lambda kv: -kv[1]):
+            print(f"[{name}] {total} samples")
+            for frame, count in _top_functions(items, name, 5):
+                print(f"    {100.0 * count / total:5.1f}%  {frame}")
+        print(f"[OK] Collapsed stacks written to {path}")
+        return path
+
+
+def _collapsed(items):
+    return [f"{name};{stack} {count}" if stack else f"{name} {count}"
+            for (name, stack), count in sorted(items)]
+
+
+def _top_functions(items, thread_name, n):
+    leaf = {}
+    for (name, stack), count in items:
+        if name == thread_name and stack:
+            frame = stack.rsplit(";", 1)[-1]
+            leaf[frame] = leaf.get(frame, 0) + count
+    return sorted(leaf.items(), key=lambda kv: -kv[1])[:n]
+
+
+_profiler = None
+
+
+def install(hz=DEFAULT_HZ, out_dir=DEFAULT_OUT_DIR):
+    """Start the global profiler, dump at exit and on SIGUSR1 / SIGBREAK"""
+    global _profiler
+    if _profiler is not None:
+        return _profiler
+    if not 0 < hz < float("inf"):
+        print(f"[WARN] Profiler rate must be a positive number of Hz (got {hz}), using {DEFAULT_HZ}")
+        hz = DEFAULT_HZ
+    _profiler = SamplingProfiler(hz=hz, out_dir=out_dir)
+    _profiler.start()
+    atexit.register(_profiler.stop)
+
+    dump_signal = getattr(signal, "SIGUSR1", None) or getattr(signal, "SIGBREAK", None)
+    if dump_signal is not None and threading.current_thread() is threading.main_thread():
+        try:
+            signal.signal(dump_signal, lambda signum, frame: _profiler.dump())
+        except (ValueError, OSError) as e:
+            print(f"[WARN] Profiler dump signal not installed: {e}")
+    return _profiler
+
+
+def get_profiler():
+    return _profiler
+
+
+def start_from_env():
+    """Install the profiler if CUBASE_PROFILE is set"""
+    if os.environ.get("CUBASE_PROFILE", "0") in ("", "0"):
+        return None
+    try:
+        hz = float(os.environ.get("CUBASE_PROFILE_HZ", DEFAULT_HZ))
+    except ValueError:
+        print("[WARN] CUBASE_PROFILE_HZ must be a number")
+        hz = DEFAULT_HZ
+    return install(hz, os.environ.get("CUBASE_PROFILE_OUT", DEFAULT_OUT_DIR))
@@ -0,0 +1,317 @@
+"""
+Session Analytics Log
+What happened during a show, for analysis afterwards: every detected key
+(with its confidence) and every control change (with who made it), in a
+compact binary columnar file.
+
+The file is preallocated and memory-mapped. Each column (t, event, source,
+key, scale, confidence, cc, value) is one contiguous array of `capacity`
+slots, so a session loads straight into NumPy arrays. An append from a hot
+thread takes a slot from an atomic counter and stores 8 values into
+memoryviews of the map: no lock, no syscall, no formatting. The event column
+is written last, so a slot with event 0 was never (or not yet) completed
+and readers skip it. close() compacts the columns up to the last completed
+slot and truncates the file. A file left by a crash keeps its full size and is still readable.
+
+Columns:
+    t           float64  seconds since the session started (start time is in the header)
+    event       uint8    EVENTS: key, control, genre, detector, autokey
+    source      uint8    SOURCES: who made the change (local = this GUI, api, cubase, ramp, ...)
+    key, scale  int8     KEY_NAMES / SCALES index, -1 = none
+    confidence  float32  key confidence (share of notes inside the scale)
+    cc          int16    CC number of the control, -1 = none
+    value       float32  control: new value (slider 0-127, toggle 0/1, tone in semitones);
+                         genre: GENRES index; detector: 1/0; autokey: listen seconds
+
+Usage:
+    from session_log import SESSION, EVENT_CONTROL
+    SESSION.open("sessions")                    # or start_from_env()
+    SESSION.append(EVENT_CONTROL, source_code("local"), cc=21, value=90.0)
+    SESSION.close()
+
+    data = load_session("sessions/session_20251018_203000.cslog")
+    data["t"][data["event"] == EVENT_KEY]       # when each key was detected
+
+    python session_log.py sessions/session_20251018_203000.cslog   # show summary
+
+Environment:
+    CUBASE_SESSION_LOG=sessions          write a session file to this folder (controller_gui.py: --session-log)
+    CUBASE_SESSION_LOG_CAPACITY=1048576  records per session (~25 MB preallocated; appends past it are dropped)
+"""
+
+import atexit
+import itertools
+import mmap
+import os
+import struct
+import sys
+import time
+
+from metrics import SESSION_LOG_DROPPED, SESSION_LOG_RECORDS, Counter
+
+MAGIC = b"CUBSESS\x00"
+VERSION = 1
+HEADER = struct.Struct("<8sHHIQQd")   # magic, version, flags, reserved, capacity, count, start (epoch s)
+HEADER_SIZE = 64
+FLAG_CLOSED = 1
+DEFAULT_CAPACITY = 1 << 20
+SUFFIX = ".cslog"
+
+# (name, memoryview format, NumPy dtype): widest first so every column stays aligned
+COLUMNS = [
+    ("t", "d", "<f8"),
+    ("confidence", "f", "<f4"),
+    ("value", "f", "<f4"),
+    ("cc", "h", "<i2"),
+    ("event", "B", "u1"),
+    ("source", "B", "u1"),
+    ("key", "b", "i1"),
+    ("scale", "b", "i1"),
+]
+RECORD_SIZE = sum(struct.calcsize(fmt) for _, fmt, _ in COLUMNS)
+_EVENT_COLUMN = [name for name, _, _ in COLUMNS].index("event")
+
+EVENTS = ("", "key", "control", "genre", "detector", "autokey")
+EVENT_KEY, EVENT_CONTROL, EVENT_GENRE, EVENT_DETECTOR, EVENT_AUTOKEY = range(1, len(EVENTS))
+SOURCES = ("", "load", "local", "api", "cubase", "ramp", "detector", "autokey")
+KEY_NAMES = ('C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B')
+SCALES = ("major", "minor")
+
+_SOURCE_CODES = {name: i for i, name in enumerate(SOURCES)}
+_KEY_CODES = {name: i for i, name in enumerate(KEY_NAMES)}
+_KEY_CODES.update({'Db': 1, 'Eb': 3, 'Gb': 6, 'Ab': 8, 'Bb': 10})
+_SCALE_CODES = {name: i for i, name in enumerate(SCALES)}
+
+
+def source_code(name):
+    return _SOURCE_CODES.get(name, 0)
+
+
+def key_code(key):
+    return _KEY_CODES.get(key, -1)
+
+
+def scale_code(scale):
+    return _SCALE_CODES.get(scale, -1)
+
+
+def _column_offsets(capacity):
+    offsets, offset = [], HEADER_SIZE
+    for _, fmt, _ in COLUMNS:
+        offsets.append(offset)
+        offset += struct.calcsize(fmt) * capacity
+    return offsets, offset
+
+
+class SessionLog:
+    """One session file; append() is a no-op until open()"""
+
+    def __init__(self):
+        self.path = None
+        self.capacity = 0
+        self._file = None
+        self._mm = None
+        self._cols = None
+        self._slots = None            # itertools.count: next() hands out slots atomically
+        self._written = Counter()     # completed records
+        self._t0 = 0.0
+
+    @property
+    def enabled(self):
+        return self._cols is not None
+
+    @property
+    def count(self):
+        """Records written so far"""
+        return self._written.value
+
+    def open(self, folder, capacity=DEFAULT_CAPACITY):
+        """Start a new session file session_<date>_<time>.cslog in folder"""
+        if self._mm is not None:
+            return self.path
+        os.makedirs(folder, exist_ok=True)
+        start = time.time()
+        name = time.strftime("session_%Y%m%d_%H%M%S", time.localtime(start))
+        offsets, size = _column_offsets(capacity)
+        try:
+            # Never overwrite: a restart within the same second gets session_..._2
+            for n in itertools.count(1):
+                path = os.path.join(folder, (name if n == 1 else f"{name}_{n}") + SUFFIX)
+                try:
+                    self._file = open(path, "x+b")
+                    break
+                except FileExistsError:
+                    continue
+            self._file.truncate(size)
+            self._mm = mmap.mmap(self._file.fileno(), size)
+        except (OSError, ValueError) as e:
+            print(f"[ERROR] Session log {path} could not be created: {e}")
+            self._close_file()
+            return None
+        self._mm[:HEADER.size] = HEADER.pack(MAGIC, VERSION, 0, 0, capacity, 0, start)
+        view = memoryview(self._mm)
+        self._cols = tuple(view[offset:offset + struct.calcsize(fmt) * capacity].cast(fmt)
+                           for offset, (_, fmt, _) in zip(offsets, COLUMNS))
+        view.release()
+        self.path = path
+        self.capacity = capacity
+        self._slots = itertools.count()
+        self._written = Counter()
+        self._t0 = time.perf_counter() - (time.time() - start)
+        SESSION_LOG_RECORDS.set_function(lambda: self.count)
+        print(f"[OK] Session log: {path} ({capacity} records, {size / 1e6:.0f} MB preallocated)")
+        return path
+
+    def append(self, event, source=0, key=-1, scale=-1, confidence=0.0, cc=-1, value=0.0):
+        """One record, from any thread (lock-free)"""
+        cols = self._cols
+        if cols is None:
+            return
+        i = next(self._slots)
+        if i >= self.capacity:
+            SESSION_LOG_DROPPED.inc()
+            return
+        t, conf, val, cc_col, ev, src, key_col, scale_col = cols
+        try:
+            t[i] = time.perf_counter() - self._t0
+            conf[i] = confidence
+            val[i] = value
+            cc_col[i] = cc
+            src[i] = source
+            key_col[i] = key
+            scale_col[i] = scale
+            ev[i] = event  # last: marks the record complete
+        except ValueError:
+            return  # closed meanwhile
+        self._written.inc()
+
+    def close(self):
+        """Compact the columns to the records written, mark the file closed and truncate it"""
+        if self._mm is None:
+            return
+        cols, self._cols = self._cols, None
+        for col in cols:
+            col.release()
+        old_offsets, _ = _column_offsets(self.capacity)
+        # Keep the slots up to the last completed one (a record still in flight now stays event 0)
+        events = old_offsets[_EVENT_COLUMN]
+        count = len(self._mm[events:events + self.capacity].rstrip(b"\x00"))
+        new_offsets, size = _column_offsets(count)
+        for (_, fmt, _), old, new in zip(COLUMNS, old_offsets, new_offsets):
+            if new != old:
+                self._mm.move(new, old, struct.calcsize(fmt) * count)
+        start = HEADER.unpack_from(self._mm)[6]
+        self._mm[:HEADER.size] = HEADER.pack(MAGIC, VERSION, FLAG_CLOSED, 0, count, count, start)
+        self._mm.flush()
+        self._mm.close()
+        self._mm = None
+        self._file.truncate(size)
+        self._close_file()
+        print(f"[OK] Session log: {self.count} records written to {self.path}")
+
+    def _close_file(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+SESSION = SessionLog()
+atexit.register(SESSION.close)
+
+
+def start_from_env():
+    """Open a session file if CUBASE_SESSION_LOG is set"""
+    folder = os.environ.get("CUBASE_SESSION_LOG")
+    if not folder:
+        return None
+    try:
+        capacity = int(os.environ.get("CUBASE_SESSION_LOG_CAPACITY", DEFAULT_CAPACITY))
+    except ValueError:
+        print("[WARN] CUBASE_SESSION_LOG_CAPACITY must be a whole number")
+        capacity = DEFAULT_CAPACITY
+    return SESSION.open(folder, max(1, capacity))
+
+
+# --- reader ---
+def load_session(path):
+    """
+    A whole session as NumPy arrays: one entry per column (see COLUMNS), plus
+    "start_time" (epoch seconds) and "closed" (False for a file left by a crash).
+    Records come in append order; incomplete slots (crash, or in flight at close) are dropped.
+    """
+    import numpy as np
+
+    raw = np.fromfile(path, dtype=np.uint8)
+    if raw.size < HEADER_SIZE:
+        raise ValueError(f"{path}: not a session log (too short)")
+    magic, version, flags, _, capacity, count, start = HEADER.unpack_from(raw[:HEADER.size].tobytes())
+    if magic != MAGIC:
+        raise ValueError(f"{path}: not a session log")
+    if version != VERSION:
+        raise ValueError(f"{path}: session log version {version} (this reader: {VERSION})")
+    offsets, size = _column_offsets(capacity)
+    if raw.size < size:
+        raise ValueError(f"{path}: truncated ({raw.size} of {size} bytes)")
+    data = {name: raw[offset:offset + np.dtype(dtype).itemsize * capacity].view(dtype)
+            for offset, (name, _, dtype) in zip(offsets, COLUMNS)}
+    closed = bool(flags & FLAG_CLOSED)
+    written = np.flatnonzero(data["event"][:count if closed else capacity])
+    data = {name: column[written] for name, column in data.items()}
+    data["start_time"] = start
+    data["closed"] = closed
+    return data
+
+
+FLAP_WINDOW_S = 30.0   # a key change this soon after the previous one counts as a flap
+
+
+def format_summary(data):
+    import numpy as np
+
+    t, event = data["t"], data["event"]
+    lines = [f"Start: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(data['start_time']))}, "
+             f"{(t.max() if t.size else 0.0) / 60:.1f} min, {t.size} records"
+             + ("" if data["closed"] else " (not closed: recovered after a crash)")]
+
+    keys = np.flatnonzero(event == EVENT_KEY)
+    if keys.size:
+        gaps = np.diff(t[keys])
+        lines.append(f"Key detections: {keys.size}, mean confidence {data['confidence'][keys].mean():.0%}, "
+                     f"flaps (< {FLAP_WINDOW_S:g} s apart): {int((gaps < FLAP_WINDOW_S).sum())}")
+        for i in keys:
+            lines.append(f"  {int(t[i] // 60):3d}:{t[i] % 60:04.1f}  {KEY_NAMES[data['key'][i]]:<2} "
+                         f"{SCALES[data['scale'][i]]:<5}  {data['confidence'][i]:4.0%}  "
+                         f"({SOURCES[data['source'][i]]})")
+    else:
+        lines.append("Key detections: 0")
+
+    listens = np.flatnonzero(event == EVENT_AUTOKEY)
+    if listens.size:
+        lines.append(f"DÒ TONE listens: {listens.size}, average {data['value'][listens].mean():.1f} s")
+
+    controls = event == EVENT_CONTROL
+    lines.append(f"Control changes: {int(controls.sum())}")
+    for code in np.unique(data["source"][controls]):
+        mask = controls & (data["source"] == code)
+        per_cc = ", ".join(f"{f'CC {cc}' if cc >= 0 else 'no CC'}: {n}"
+                           for cc, n in zip(*np.unique(data["cc"][mask], return_counts=True)))
+        lines.append(f"  {SOURCES[code] or '?':<8} {int(mask.sum()):6d}  ({per_cc})")
+    detector = np.flatnonzero(event == EVENT_DETECTOR)
+    if detector.size:
+        lines.append(f"AUTO RT switched on: {int((data['value'][detector] > 0).sum())} time(s)")
+    genres = int((event == EVENT_GENRE).sum())
+    if genres:
+        lines.append(f"Genre changes: {genres}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    try:
+        sys.stdout.reconfigure(encoding='utf-8')
+    except Exception:
+        pass
+
+    if len(sys.argv) != 2:
+        print("Usage: python session_log.py sessions/session_YYYYmmdd_HHMMSS.cslog")
+        sys.exit(1)
+    print(format_summary(load_session(sys.argv[1])))
@@ -0,0 +1,227 @@
+"""
+Settings Persistence
+config.json written off the GUI thread, atomically, with an append-only
+change journal for crash recovery.
+
+- set() updates the in-memory state and marks the value dirty; it never
+  touches the disk. A writer thread appends dirty values to
+  config.json.journal in small batches (a slider drag becomes one batch of
+  latest values, fsync'd once).
+- Autosave: a snapshot is written JOURNAL_DEBOUNCE_S after the last change
+  (or at once on save_now()), to a temp file that is fsync'd and renamed
+  over config.json, so a crash leaves either the old or the new file. The
+  journal is truncated after each snapshot.
+- load() reads the snapshot and replays the journal on top. A torn last
+  journal line (crash mid-append) is ignored; a corrupt snapshot is kept
+  as config.json.corrupt and the state is rebuilt from the journal.
+
+Usage:
+    store = SettingsStore()
+    state = store.load()                     # {"sliders": {...}, "toggles": {...}, "tone": 0.0, "genre": ...}
+    store.set("sliders/MUSIC_VOL", 57.0)     # cheap, any thread
+    store.save_now()                         # LƯU: snapshot in the background
+    store.close()                            # on exit: write everything, wait for the writer
+"""
+
+import json
+import os
+import tempfile
+import threading
+import time
+
+CONFIG_FILE = "config.json"
+
+JOURNAL_BATCH_S = 0.2     # collect changes this long before appending them to the journal
+JOURNAL_DEBOUNCE_S = 2.0  # snapshot this long after the last change
+
+_MISSING = object()
+
+
+def atomic_write_text(path, text):
+    """
+    Write text to path via a fsync'd temp file + rename (never leaves a half-written
+    file). Each call gets its own temp file, so concurrent writers of the same path
+    cannot interleave: the last rename wins with a complete file.
+    """
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=f"{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def _assign(state, path, value):
+    *parents, leaf = path.split("/")
+    for part in parents:
+        child = state.get(part)
+        if not isinstance(child, dict):
+            child = state[part] = {}
+        state = child
+    state[leaf] = value
+
+
+def _lookup(state, path, default=None):
+    for part in path.split("/"):
+        if not isinstance(state, dict) or part not in state:
+            return default
+        state = state[part]
+    return state
+
+
+class SettingsStore:
+    def __init__(self, path=CONFIG_FILE, journal_path=None, debounce_s=JOURNAL_DEBOUNCE_S):
+        self.path = path
+        self.journal_path = journal_path or f"{path}.journal"
+        self.debounce_s = debounce_s
+        self.state = {}
+        self.last_load_ms = None
+        self._lock = threading.Lock()
+        self._dirty = {}             # path -> value, not journaled yet
+        self._snapshot_due = None    # perf_counter() deadline of the debounced snapshot
+        self._save_requested = False
+        self._closing = False
+        self._wake = threading.Event()
+        self._thread = None
+        self._journal = None         # append handle, writer thread only
+
+    # --- load ---
+    def load(self):
+        """Snapshot + journal replay. Returns a copy of the state."""
+        t0 = time.perf_counter()
+        state = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding='utf-8') as f:
+                    state = json.load(f)
+                if not isinstance(state, dict):
+                    raise ValueError("not a JSON object")
+            except (ValueError, OSError) as e:
+                state = {}
+                corrupt = f"{self.path}.corrupt"
+                print(f"[ERROR] {self.path} is corrupt ({e}); kept as {corrupt}, recovering from the journal")
+                try:
+                    os.replace(self.path, corrupt)
+                except OSError:
+                    pass
+        replayed = 0
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "r", encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                        _assign(state, record["p"], record["v"])
+                    except (ValueError, KeyError, TypeError):
+                        print(f"[WARN] {self.journal_path}: ignoring a torn entry after {replayed} changes")
+                        break
+                    replayed += 1
+        with self._lock:
+            self.state = state
+        self.last_load_ms = (time.perf_counter() - t0) * 1000
+        print(f"[SETTINGS] {self.path} + {replayed} journal change(s) loaded in {self.last_load_ms:.1f} ms")
+        if replayed:
+            self.save_now()  # fold the journal into a fresh snapshot
+        return json.loads(json.dumps(state))
+
+    # --- changes (any thread, never blocks on disk) ---
+    def get(self, path, default=None):
+        with self._lock:
+            return _lookup(self.state, path, default)
+
+    def set(self, path, value):
+        """Change one value ("sliders/MUSIC_VOL", "tone", ...); journaled and autosaved in the background"""
+        with self._lock:
+            if _lookup(self.state, path, _MISSING) == value:
+                return
+            _assign(self.state, path, value)
+            first = not self._dirty
+            self._dirty[path] = value
+            self._snapshot_due = time.perf_counter() + self.debounce_s
+        if first:
+            self._start()
+            self._wake.set()
+
+    def update(self, state, prefix=""):
+        """set() every leaf of a nested dict"""
+        for key, value in state.items():
+            if isinstance(value, dict):
+                self.update(value, f"{prefix}{key}/")
+            else:
+                self.set(f"{prefix}{key}", value)
+
+    def save_now(self):
+        """Write the snapshot now (in the background)"""
+        self._save_requested = True
+        self._start()
+        self._wake.set()
+
+    def close(self, timeout=2.0):
+        """Write pending changes and the snapshot, then stop the writer (call on exit)"""
+        if self._thread is None:
+            return
+        self._closing = True
+        self._wake.set()
+        self._thread.join(timeout)
+
+    # --- writer thread ---
+    def _start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="settings-writer", daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                due = self._snapshot_due
+            if self._save_requested or self._closing:
+                timeout = 0
+            else:
+                timeout = None if due is None else max(0.0, due - time.perf_counter())
+            self._wake.wait(timeout)
+            self._wake.clear()
+            if self._dirty and not (self._save_requested or self._closing):
+                time.sleep(JOURNAL_BATCH_S)  # let a slider drag settle into one batch
+            with self._lock:
+                dirty, self._dirty = self._dirty, {}
+            try:
+                if dirty:
+                    self._append_journal(dirty)
+                due = self._snapshot_due
+                if self._save_requested or self._closing or (due is not None and time.perf_counter() >= due):
+                    self._write_snapshot()
+            except OSError as e:
+                print(f"[ERROR] Settings could not be written: {e}")
+                with self._lock:
+                    self._snapshot_due = time.perf_counter() + self.debounce_s  # retry later
+            if self._closing:
+                return
+
+    def _append_journal(self, dirty):
+        if self._journal is None:
+            self._journal = open(self.journal_path, "a", encoding='utf-8')
+        self._journal.write("".join(json.dumps({"p": p, "v": v}, ensure_ascii=False) + "\n"
+                                    for p, v in dirty.items()))
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+
+    def _write_snapshot(self):
+        announce = self._save_requested
+        with self._lock:
+            text = json.dumps(self.state, indent=4)
+            self._snapshot_due = None
+            self._save_requested = False
+        t0 = time.perf_counter()
+        atomic_write_text(self.path, text)
+        # Everything journaled so far is in the snapshot: start a new journal
+        if self._journal is not None:
+            self._journal.close()
+        self._journal = open(self.journal_path, "w", encoding='utf-8')
+        if announce:
+            print(f"Đã lưu cấu hình vào {self.path} ({(time.perf_counter() - t0) * 1000:.1f} ms)")
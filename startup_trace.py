@@ -0,0 +1,173 @@
+"""
+Startup Trace
+Where the time to an interactive window goes. From begin() until ready()
+every module import is timed (total and self time, per thread), and
+named init steps are timed with stage(). ready() marks the window as
+interactive, stops the import timing and reports: one [STARTUP] line, or the
+full table (init steps, slowest imports by the repo module that pulled them
+in) with CUBASE_STARTUP_TRACE=1. Steps still running in the background
+(detector, device scan, automation libs) print their own line when they end.
+
+Only entry scripts call begin(), as early as possible (interpreter start-up
+is not included); times are measured from there. A module that merely uses
+stage() (ControllerEngine in a script or benchmark) installs no import hook
+and records nothing.
+
+Usage:
+    import startup_trace                        # first lines of controller_gui.py
+    startup_trace.begin()
+    with startup_trace.stage("engine.start"):
+        engine.start()
+    app.after_idle(startup_trace.ready)         # window drawn and idle: interactive
+
+Environment:
+    CUBASE_STARTUP_TRACE=1                   print the full report
+    CUBASE_STARTUP_REPORT=profiles/startup.txt   also write the full report to a file
+    CUBASE_STARTUP_BUDGET_MS=1000            warn when time to interactive is over budget
+"""
+
+import builtins
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+_T0 = None          # begin() time; None: not tracing
+DEFAULT_BUDGET_MS = 1000
+TOP_IMPORTS = 15
+
+_REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+_original_import = builtins.__import__
+_local = threading.local()
+_lock = threading.Lock()
+_imports = {}        # module -> (total_s, self_s, importer, thread)
+_stages = []         # (name, start_s, duration_s, thread, error)
+_ready_s = None
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    if level or name in sys.modules:
+        return _original_import(name, globals, locals, fromlist, level)
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+        stack = _local.stack = []
+    stack.append(0.0)
+    t0 = time.perf_counter()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        total = time.perf_counter() - t0
+        children = stack.pop()
+        if stack:
+            stack[-1] += total
+        importer = (globals or {}).get("__name__", "?")
+        with _lock:
+            _imports.setdefault(name, (total, total - children, importer, threading.current_thread().name))
+
+
+def begin():
+    """Start tracing (entry scripts only): time every import from here until ready()"""
+    global _T0
+    with _lock:
+        if _T0 is not None:
+            return
+        _T0 = time.perf_counter()
+    builtins.__import__ = _timed_import
+
+
+def elapsed():
+    """Seconds since begin()"""
+    return time.perf_counter() - _T0 if _T0 is not None else 0.0
+
+
+@contextmanager
+def stage(name):
+    """Time one init step (any thread); steps that end after ready() print their own line"""
+    if _T0 is None:
+        yield
+        return
+    start = time.perf_counter()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        duration = time.perf_counter() - start
+        with _lock:
+            _stages.append((name, start - _T0, duration, threading.current_thread().name, error))
+            late = _ready_s is not None
+        if late:
+            status = f" ({error})" if error else ""
+            print(f"[STARTUP] {name}: {duration * 1000:.0f} ms in the background, "
+                  f"done at {(start - _T0 + duration) * 1000:.0f} ms{status}")
+
+
+def _is_repo_module(name):
+    if name == "__main__":
+        return True
+    path = getattr(sys.modules.get(name), "__file__", None)
+    return bool(path) and os.path.dirname(os.path.abspath(path)) == _REPO_DIR
+
+
+def format_report():
+    with _lock:
+        stages = list(_stages)
+        imports = dict(_imports)
+    lines = [f"Time to interactive: {_ready_s * 1000:.0f} ms" if _ready_s is not None
+             else f"Not interactive yet ({elapsed() * 1000:.0f} ms)"]
+    lines.append("")
+    lines.append(f"{'init step':<36} {'start':>8} {'ms':>8}  thread")
+    for name, start, duration, thread, error in sorted(stages, key=lambda s: s[1]):
+        suffix = f"  ({error})" if error else ""
+        lines.append(f"{name:<36} {start * 1000:>8.0f} {duration * 1000:>8.1f}  {thread}{suffix}")
+    # Imports made directly by the repo's modules: what each of our import lines costs
+    direct = [(total, self_s, name, importer, thread) for name, (total, self_s, importer, thread) in imports.items()
+              if _is_repo_module(importer) and not _is_repo_module(name)]
+    direct.sort(reverse=True)
+    lines.append("")
+    lines.append(f"{'import':<36} {'total ms':>8} {'self ms':>8}  imported by (thread)")
+    for total, self_s, name, importer, thread in direct[:TOP_IMPORTS]:
+        lines.append(f"{name:<36} {total * 1000:>8.1f} {self_s * 1000:>8.1f}  {importer} ({thread})")
+    lines.append(f"{len(imports)} modules imported while tracing, "
+                 f"{sum(i[1] for i in imports.values()) * 1000:.0f} ms in total")
+    return "\n".join(lines)
+
+
+def ready():
+    """The window is interactive: stop timing imports and report"""
+    global _ready_s
+    with _lock:
+        if _T0 is None or _ready_s is not None:
+            return
+        _ready_s = elapsed()
+    if builtins.__import__ is _timed_import:
+        builtins.__import__ = _original_import
+
+    from metrics import STARTUP_SECONDS
+    STARTUP_SECONDS.set(_ready_s)
+
+    try:
+        budget_ms = float(os.environ.get("CUBASE_STARTUP_BUDGET_MS", DEFAULT_BUDGET_MS))
+    except ValueError:
+        print("[WARN] CUBASE_STARTUP_BUDGET_MS must be a number")
+        budget_ms = DEFAULT_BUDGET_MS
+    tag = "[OK]" if _ready_s * 1000 <= budget_ms else "[WARN]"
+    print(f"{tag} [STARTUP] Interactive in {_ready_s * 1000:.0f} ms (budget {budget_ms:.0f} ms)")
+
+    report = format_report()
+    if os.environ.get("CUBASE_STARTUP_TRACE", "0") not in ("", "0"):
+        print("\n=== Startup trace ===\n" + report)
+    path = os.environ.get("CUBASE_STARTUP_REPORT")
+    if path:
+        try:
+            folder = os.path.dirname(path)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(report + "\n")
+            print(f"[OK] Startup report: {path}")
+        except OSError as e:
+            print(f"[ERROR] Startup report {path} could not be written: {e}")
@@ -0,0 +1,142 @@
+import time
+
+import pytest
+
+rtmidi = pytest.importorskip("rtmidi", exc_type=ImportError)  # also when the ALSA library is missing
+
+import midi_handler
+from midi_handler import MidiHandler
+
+CC = 21
+
+
+class RecordingOut:
+    """rtmidi.MidiOut stand-in: one port that records what was written to it"""
+
+    def __init__(self):
+        self.sent = []
+
+    def get_ports(self):
+        return ["loopMIDI Port 1"]
+
+    def open_port(self, index):
+        pass
+
+    def close_port(self):
+        pass
+
+    def send_message(self, message):
+        self.sent.append((time.perf_counter(), list(message)))
+
+
+@pytest.fixture
+def handler(monkeypatch):
+    monkeypatch.setattr(midi_handler.rtmidi, "MidiOut", RecordingOut)
+    return MidiHandler(cc_rate=20, routes=[{"name": "main", "match": "loopMIDI"}])
+
+
+def _cc_values(handler, cc=CC):
+    return [message[2] for _, message in handler.midiout.sent if message[1] == cc]
+
+
+def _wait_quiet(handler, quiet_s=0.2, timeout=2.0):
+    """Wait until nothing has been written for quiet_s"""
+    deadline = time.perf_counter() + timeout
+    count = -1
+    while time.perf_counter() < deadline:
+        if len(handler.midiout.sent) == count:
+            return
+        count = len(handler.midiout.sent)
+        time.sleep(quiet_s)
+
+
+def test_latest_value_wins_while_rate_limited(handler):
+    handler.send_cc(CC, 10)
+    for value in range(11, 60):
+        handler.send_cc(CC, value)
+    _wait_quiet(handler)
+
+    assert _cc_values(handler) == [10, 59]
+
+
+def test_back_to_the_sent_value_cancels_the_pending_one(handler):
+    handler.send_cc(CC, 10)
+    handler.send_cc(CC, 20)
+    handler.send_cc(CC, 10)
+    _wait_quiet(handler)
+
+    assert _cc_values(handler) == [10]
+
+
+def test_unchanged_value_is_not_sent_again(handler):
+    handler.send_cc(CC, 10)
+    time.sleep(2 * handler._interval)
+    handler.send_cc(CC, 10)
+    _wait_quiet(handler)
+
+    assert _cc_values(handler) == [10]
+
+
+def test_rate_limit_per_cc(handler):
+    # A 0.5 s drag at ~1 kHz: at most cc_rate values per second, the last one always arrives
+    start = time.perf_counter()
+    value = 0
+    while time.perf_counter() - start < 0.5:
+        value = (value + 1) % 128
+        handler.send_cc(CC, value)
+        handler.send_cc(CC + 1, 127 - value)
+        time.sleep(0.001)
+    _wait_quiet(handler)
+
+    for cc, last in ((CC, value), (CC + 1, 127 - value)):
+        values = _cc_values(handler, cc)
+        assert len(values) <= 0.5 * handler.cc_rate + 2
+        assert values[-1] == last
+
+
+# --- TimerWheel (4 slots of 0.25 s: one turn is 1 s; times are exact in binary) ---
+@pytest.fixture
+def wheel():
+    wheel = midi_handler.TimerWheel(tick_s=0.25, slots=4)
+    wheel.origin = 0.0
+    return wheel
+
+
+def test_wheel_fires_only_entries_that_are_due(wheel):
+    wheel.schedule(0.75, "near")
+    wheel.schedule(5.0, "far")          # 5 turns ahead, shares its slot with ticks 4, 8, 12, 16
+
+    assert wheel.next_due() == 0.75
+    assert wheel.advance(1.0) == [(0.75, "near")]
+    assert wheel.advance(4.9) == []     # the far slot was visited every turn, never early
+    assert wheel.next_due() == 5.0
+    assert wheel.advance(5.0) == [(5.0, "far")]
+    assert wheel.count == 0
+    assert wheel.next_due() is None
+
+
+def test_wheel_never_fires_before_the_due_time(wheel):
+    wheel.schedule(4.9, "item")         # rounds up to the 5.0 tick
+
+    assert wheel.advance(4.75) == []
+    assert wheel.advance(5.0) == [(4.9, "item")]
+
+
+def test_wheel_next_due_finds_an_entry_more_than_one_turn_ahead(wheel):
+    wheel.schedule(3.0, "later")
+    wheel.schedule(2.5, "sooner")       # both past the current turn: found by the full scan
+
+    assert wheel.next_due() == 2.5
+    wheel.advance(2.5)
+    assert wheel.next_due() == 3.0
+
+
+def test_wheel_catches_up_after_a_long_stall(wheel):
+    for due in (0.5, 1.75, 6.0):
+        wheel.schedule(due, due)
+
+    # One advance many turns late visits each slot once and returns everything due
+    assert sorted(wheel.advance(100.0)) == [(0.5, 0.5), (1.75, 1.75), (6.0, 6.0)]
+    assert wheel.count == 0
+    wheel.schedule(50.0, "past")        # due before the wheel's position: next tick, not lost
+    assert wheel.advance(100.25) == [(50.0, "past")]
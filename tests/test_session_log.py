@@ -0,0 +1,69 @@
+import os
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from session_log import (EVENT_CONTROL, EVENT_KEY, HEADER_SIZE, RECORD_SIZE, SessionLog, key_code, load_session,
+                         scale_code, source_code)
+
+
+def _append_three(log):
+    log.append(EVENT_KEY, source_code("detector"), key_code("A"), scale_code("minor"), 0.8)
+    log.append(EVENT_CONTROL, source_code("api"), cc=21, value=90.0)
+    log.append(EVENT_CONTROL, source_code("cubase"), cc=22, value=1.0)
+
+
+def test_close_compacts_the_columns(tmp_path):
+    log = SessionLog()
+    path = log.open(str(tmp_path), capacity=1000)
+    _append_three(log)
+    log.close()
+
+    assert os.path.getsize(path) == HEADER_SIZE + 3 * RECORD_SIZE
+    data = load_session(path)
+    assert data["closed"]
+    assert data["event"].tolist() == [EVENT_KEY, EVENT_CONTROL, EVENT_CONTROL]
+    assert data["source"].tolist() == [source_code("detector"), source_code("api"), source_code("cubase")]
+    assert data["key"].tolist() == [key_code("A"), -1, -1]
+    assert data["scale"].tolist() == [scale_code("minor"), -1, -1]
+    assert data["cc"].tolist() == [-1, 21, 22]
+    assert data["value"].tolist() == [0.0, 90.0, 1.0]
+    assert data["confidence"][0] == pytest.approx(0.8)
+    assert np.all(np.diff(data["t"]) >= 0)
+
+
+def test_file_left_by_a_crash_is_readable(tmp_path):
+    log = SessionLog()
+    path = log.open(str(tmp_path), capacity=1000)
+    _append_three(log)
+    log._mm.flush()  # what the OS writes back after the process dies
+
+    data = load_session(path)
+    assert not data["closed"]
+    assert os.path.getsize(path) == HEADER_SIZE + 1000 * RECORD_SIZE
+    assert data["cc"].tolist() == [-1, 21, 22]
+    log.close()
+
+
+def test_incomplete_slots_are_skipped(tmp_path):
+    log = SessionLog()
+    path = log.open(str(tmp_path), capacity=1000)
+    log.append(EVENT_CONTROL, source_code("local"), cc=21, value=1.0)
+    next(log._slots)  # a record still in flight (event column not written yet)
+    log.append(EVENT_CONTROL, source_code("local"), cc=21, value=3.0)
+    next(log._slots)  # in flight at close: after the last completed slot, compacted away
+    log.close()
+
+    assert os.path.getsize(path) == HEADER_SIZE + 3 * RECORD_SIZE
+    assert load_session(path)["value"].tolist() == [1.0, 3.0]
+
+
+def test_appends_past_capacity_are_dropped(tmp_path):
+    log = SessionLog()
+    path = log.open(str(tmp_path), capacity=2)
+    _append_three(log)
+    log.close()
+
+    assert log.count == 2
+    assert load_session(path)["cc"].tolist() == [-1, 21]
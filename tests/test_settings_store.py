@@ -0,0 +1,68 @@
+import json
+
+from settings_store import SettingsStore
+
+
+def _store(tmp_path):
+    return SettingsStore(path=str(tmp_path / "config.json"), debounce_s=60)
+
+
+def _write_journal(store, lines):
+    with open(store.journal_path, "w", encoding="utf-8") as f:
+        f.write("".join(lines))
+
+
+def test_journal_replays_on_top_of_the_snapshot(tmp_path):
+    store = _store(tmp_path)
+    with open(store.path, "w", encoding="utf-8") as f:
+        json.dump({"sliders": {"MUSIC_VOL": 10.0, "MIC_VOL": 20.0}, "tone": 0.0}, f)
+    _write_journal(store, [json.dumps({"p": "sliders/MUSIC_VOL", "v": 57.0}) + "\n",
+                           json.dumps({"p": "tone", "v": -2.0}) + "\n",
+                           json.dumps({"p": "sliders/MUSIC_VOL", "v": 60.0}) + "\n"])
+
+    state = store.load()
+    store.close()
+
+    assert state == {"sliders": {"MUSIC_VOL": 60.0, "MIC_VOL": 20.0}, "tone": -2.0}
+    # The replayed journal is folded into a fresh snapshot and truncated
+    with open(store.path, encoding="utf-8") as f:
+        assert json.load(f) == state
+    with open(store.journal_path, encoding="utf-8") as f:
+        assert f.read() == ""
+
+
+def test_torn_last_journal_line_is_ignored(tmp_path, capsys):
+    store = _store(tmp_path)
+    _write_journal(store, [json.dumps({"p": "sliders/MUSIC_VOL", "v": 57.0}) + "\n",
+                           json.dumps({"p": "genre", "v": "BOLERO"}) + "\n",
+                           '{"p": "tone", "v": 3'])  # crash mid-append
+
+    state = store.load()
+    store.close()
+
+    assert state == {"sliders": {"MUSIC_VOL": 57.0}, "genre": "BOLERO"}
+    assert "ignoring a torn entry after 2 changes" in capsys.readouterr().out
+
+
+def test_corrupt_snapshot_is_kept_and_rebuilt_from_the_journal(tmp_path):
+    store = _store(tmp_path)
+    with open(store.path, "w", encoding="utf-8") as f:
+        f.write('{"sliders": {"MUSIC_VOL": 1')
+    _write_journal(store, [json.dumps({"p": "sliders/MIC_VOL", "v": 80.0}) + "\n"])
+
+    state = store.load()
+    store.close()
+
+    assert state == {"sliders": {"MIC_VOL": 80.0}}
+    with open(f"{store.path}.corrupt", encoding="utf-8") as f:
+        assert f.read() == '{"sliders": {"MUSIC_VOL": 1'
+
+
+def test_changes_survive_a_restart(tmp_path):
+    store = _store(tmp_path)
+    store.load()
+    store.set("sliders/MUSIC_VOL", 42.0)
+    store.set("toggles/MUTE_MIC", True)
+    store.close()
+
+    assert _store(tmp_path).load() == {"sliders": {"MUSIC_VOL": 42.0}, "toggles": {"MUTE_MIC": True}}
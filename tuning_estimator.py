@@ -0,0 +1,113 @@
+"""
+Reference Tuning Estimator
+Estimates how far the performance is from A4 = 440 Hz, incrementally and in
+O(1) per pitch frame, from the pitch frames the detector already produces
+(no extra FFT passes).
+
+Frames are first averaged over ~one vibrato period (`smooth_seconds`,
+restarted on note changes): a wide vibrato spends most of its time at the
+extremes, and its raw fractional parts would drag the circular mean to
++-50 cents. Each averaged pitch contributes its fractional MIDI part as a
+unit vector on a circle (so -0.49 and +0.49 semitones are neighbours),
+weighted by confidence. The running sums decay exponentially
+(time constant `time_constant` seconds), so the estimate converges within a
+few seconds and follows slow drifts. The circular mean angle is the offset;
+the mean vector length says how concentrated the frames are. The published
+offset only moves when the estimate is reliable and changes by more than
+`deadband_cents`, which keeps it (and the TUNE CC) stable.
+
+Usage:
+    tuning = TuningEstimator()
+    tuning.update(midi_float, confidence, frame_seconds)
+    note = round(midi_float - tuning.offset)      # tuning-corrected binning
+"""
+
+import math
+from collections import deque
+
+from metrics import METRICS
+
+TUNING_OFFSET = METRICS.gauge('detector_tuning_offset_cents', 'Estimated reference tuning offset from A4 = 440 Hz')
+
+
+class TuningEstimator:
+    def __init__(self, time_constant=4.0, min_concentration=0.5, min_frames=30, deadband_cents=2.0,
+                 smooth_seconds=0.18):
+        self.time_constant = time_constant
+        self.smooth_seconds = smooth_seconds
+        self.min_concentration = min_concentration  # mean vector length needed to trust the angle
+        self.min_frames = min_frames
+        self.deadband = deadband_cents / 100.0
+        self.reset()
+
+    def reset(self):
+        self._cos = 0.0
+        self._sin = 0.0
+        self._weight = 0.0
+        self._decay_dt = None
+        self._decay = 1.0
+        self._recent = deque()   # (midi, weight) of the current note, ~smooth_seconds long
+        self._recent_size = 2
+        self._recent_midi = 0.0
+        self._recent_weight = 0.0
+        self.frames = 0
+        self.offset = 0.0        # published offset in semitones (0 until reliable)
+        self.raw_offset = 0.0    # current circular mean
+        self.concentration = 0.0
+        self._changed = False
+        TUNING_OFFSET.set(0.0)
+
+    def update(self, midi, weight=1.0, frame_seconds=0.064):
+        """Add one voiced frame (fractional MIDI pitch, confidence weight, frame spacing)"""
+        if weight <= 0:
+            return
+        if frame_seconds != self._decay_dt:
+            self._decay_dt = frame_seconds
+            self._decay = math.exp(-frame_seconds / self.time_constant)
+            self._recent_size = max(2, round(self.smooth_seconds / frame_seconds))
+
+        # Average over ~one vibrato period of the same note (running sums, O(1))
+        recent = self._recent
+        if recent and abs(midi - recent[-1][0]) > 1.0:
+            recent.clear()
+            self._recent_midi = self._recent_weight = 0.0
+        recent.append((midi, weight))
+        self._recent_midi += midi * weight
+        self._recent_weight += weight
+        if len(recent) > self._recent_size:
+            old_midi, old_weight = recent.popleft()
+            self._recent_midi -= old_midi * old_weight
+            self._recent_weight -= old_weight
+        if len(recent) < self._recent_size:
+            return
+        midi = self._recent_midi / self._recent_weight
+        weight = self._recent_weight / len(recent)
+
+        phase = 2 * math.pi * (midi - round(midi))
+        decay = self._decay
+        self._cos = self._cos * decay + weight * math.cos(phase)
+        self._sin = self._sin * decay + weight * math.sin(phase)
+        self._weight = self._weight * decay + weight
+        self.frames += 1
+
+        self.raw_offset = math.atan2(self._sin, self._cos) / (2 * math.pi)
+        self.concentration = math.hypot(self._cos, self._sin) / self._weight
+        if (self.frames >= self.min_frames and self.concentration >= self.min_concentration
+                and abs(self.raw_offset - self.offset) >= self.deadband):
+            self.offset = self.raw_offset
+            self._changed = True
+            TUNING_OFFSET.set(self.offset_cents)
+
+    @property
+    def offset_cents(self):
+        return round(self.offset * 100.0, 1)
+
+    @property
+    def reference_hz(self):
+        """A4 frequency the performance is tuned to"""
+        return 440.0 * 2 ** (self.offset / 12.0)
+
+    def pop_change(self):
+        """True once after each change of the published offset"""
+        changed, self._changed = self._changed, False
+        return changed